@@ -1,12 +1,24 @@
 from typing import Tuple, Any, List
 
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils import trace as trace_utils
+from .stat_parser import StatParser
 
 class Connection:
+    # phases timed as spans while tracing is on, whichever subclass implements them
+    TRACED_METHODS = ("setup_connection", "setup_node", "resync_ptp_node", "run_node", "read_node_log",
+                      "read_node_stats", "apply_calib_node", "apply_calib_offset_node", "close")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        trace_utils.trace_methods(cls, Connection.TRACED_METHODS, trace_utils.CONNECTION)
+
     def __init__(self, root = None, stop_event = None):
         self.__c = None
         self.stop_event = stop_event
         self.script = root
+        self.trace_label = None # node the spans of the connection are shown under
 
     def setup_connection(self) -> None:
         raise NotImplementedError()
@@ -32,6 +44,12 @@ class Connection:
     def read_node_log(self, time: int = 60, hide: bool = False) -> List[str]:
         raise NotImplementedError()
 
+    def read_node_stats(self, time: int = 60, parser: StatParser = None) -> StatParser:
+        """Collects `stat` lines for `time` sec into the parser"""
+        parser = parser if parser is not None else StatParser()
+        parser.feed_lines(self.read_node_log(time=time, hide=True))
+        return parser
+
     def apply_calib_offset_node(self, meanOffset: int, node_port: int) -> Tuple[int, int]:
         raise NotImplementedError()
     
@@ -42,7 +60,7 @@ class Connection:
         raise NotImplementedError
     
     def check_stop_event(self, func):
-        if self.stop_event.is_set():
+        if cancel_utils.is_cancelled(self.stop_event):
             print_utils.print_thread_terminated(self.script, func)
             self.close()
             return True
@@ -1,19 +1,25 @@
 from .connection import Connection
+from .line_reader import LineReader
+from .stat_parser import StatParser
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
 
 from typing import Any, Tuple, List
-import time as timer
 import serial
 import io
 import os
 
 class Direct_Connect(Connection):
-    def __init__(self, root: str, stop_event = None, tty_usb_port: int = 0):
+    def __init__(self, root: str, stop_event = None, tty_usb_port: int = 0, device = None):
+        """`device` replaces the serial port with any object behaving like serial.Serial, e.g. a simulator"""
         super().__init__(root, stop_event)
-        self.__c = serial.Serial()
-        self.__c.port = f"/dev/ttyUSB{tty_usb_port}"
-        self.__c.baudrate = 115200
-        self.__c.timeout = 0.4
+        self.trace_label = f"ttyUSB{tty_usb_port}"
+        self.__c = device if device is not None else serial.Serial()
+        if device is None:
+            self.__c.port = f"/dev/ttyUSB{tty_usb_port}"
+            self.__c.baudrate = 115200
+        self.__c.timeout = 0.05 # read granularity of the line reader
+        self.__reader = LineReader(self.__read_serial, name=f"ttyUSB{tty_usb_port}_reader")
         self.__try_open_serial()
 
     def setup_connection(self) -> None:
@@ -34,22 +40,19 @@ class Direct_Connect(Connection):
         result = self.run_node("sfp match")
         result = self.run_node("ptp start 0")
         
+        since = self.__reader.mark()
         self.toggle_stat_on_node()
 
-        timer.sleep(2) # wait for commands to proceed 
-
-        # Cycle file until resynchronized
+        # Wait until resynchronized: 3 TRACK_PHASE stat lines
         print_utils.print_info("---------- START RESYNCHRONOZATION ----------", 1)
-        isSync = False
-        while(not isSync):
-            if self.check_stop_event("resync_ptp_event"):
-                self.toggle_stat_off_node()
-                return
-            timer.sleep(4)
-            # check for "TRACK_PHASE" stability
-            sync_count = self.__read_node_output().count("TRACK_PHASE")
-            print_utils.print_info(f"Sync count (TRACK_PHASE): {sync_count}", 2)
-            isSync = (sync_count >= 3)
+        sync_lines = self.__reader.wait_for_lines("TRACK_PHASE", 3, since=since, stop_event=self.stop_event)
+        if sync_lines is None and cancel_utils.is_cancelled(self.stop_event):
+            self.toggle_stat_off_node()
+        if self.check_stop_event("resync_ptp_event"):
+            return
+        if sync_lines is None:
+            raise ConnectionError(f"{self.__c.port} is lost while waiting for PTP resynchronization: {self.__reader.error}")
+        print_utils.print_info(f"Sync count (TRACK_PHASE): {len(sync_lines)}", 2)
 
         self.toggle_stat_off_node()
         print_utils.print_info("---------- END RESYNCHRONOZATION ----------", 1)
@@ -72,12 +75,17 @@ class Direct_Connect(Connection):
         return buf
     
     def run_node(self, op: str, hide: bool = False) -> Any:
+        since = self.__reader.mark()
         self.__c.write(bytes(f"{op} \r", "utf-8"))
-        return self.__read_node_output(hide)
+        res = self.__reader.wait_quiet(since)
+        if (not hide):
+            print_utils.print_untagged(res, 2)
+        return res
 
     def read_node_log(self, time: int = 60, hide = False) -> List[str]:
-        res = []
+        """Returns the complete lines the node printed with stats on during `time` sec"""
         self.toggle_stat_on_node()
+        since = self.__reader.mark()
 
         if (time > 5):
             for t in print_utils.timer_bar(
@@ -87,22 +95,27 @@ class Direct_Connect(Connection):
                 length=100):
                 if self.check_stop_event("read_node_log"):
                     return []
-                timer.sleep(1)
-                res.append(self.__read_node_output(hide=hide))
-        else:
-            for t in range(0, time):
-                timer.sleep(1)
-                res.append(self.__read_node_output(hide=hide))
+                cancel_utils.wait(self.stop_event, 1)
+        elif cancel_utils.wait(self.stop_event, time) and self.check_stop_event("read_node_log"):
+            return []
+        res = self.__reader.lines_since(since)
         self.toggle_stat_off_node()
-        return res
-
-    def __read_node_output(self, hide: bool = False, buf_len: int = 2048) -> str:
-        res = []
-        buf = str(self.__c.read(buf_len), "utf-8")
-        res = "".join(buf)
         if (not hide):
-            print_utils.print_untagged(res, 2)
+            print_utils.print_untagged("\n".join(res), 2)
         return res
+
+    def read_node_stats(self, time: int = 60, parser: StatParser = None) -> StatParser:
+        """Parses `stat` lines as they arrive, so nothing but the parser's fixed columns is kept"""
+        parser = parser if parser is not None else StatParser()
+        self.__reader.add_listener(parser.feed_line)
+        try:
+            self.read_node_log(time=time, hide=True)
+        finally:
+            self.__reader.remove_listener(parser.feed_line)
+        return parser
+
+    def __read_serial(self) -> bytes:
+        return self.__c.read(max(1, self.__c.in_waiting))
     
     def apply_calib_offset_node(self, meanOffset: int, node_port: int) -> Tuple[int, int]:
         if self.check_stop_event("apply_calib_offset_node"):
@@ -178,13 +191,17 @@ class Direct_Connect(Connection):
         return self.__try_close_serial()
     
     def __try_open_serial(self) -> int:
-        if not self.__c.is_open:
+        """Opens the port unless open and starts the line reader unless running: an injected device may come open"""
+        is_opened = not self.__c.is_open
+        if is_opened:
             self.__c.open()
-            return 1
-        return 0
+        if not self.__reader.is_running():
+            self.__reader.start()
+        return 1 if is_opened else 0
     
     def __try_close_serial(self) -> int:
         if self.__c.is_open:
+            self.__reader.stop()
             self.__c.close()
             return 1
         return 0
@@ -15,7 +15,12 @@ class ScriptRunStatusesEnum(enum.IntEnum):
     IP_INVALID = 0x00_00_00_01
     DESTINATION_UNREACHABLE = 0x00_00_00_02
     CONNECTION_LOSS = 0x00_00_00_03
+    TERMINATED = 0x00_00_00_04
     SYNC_TIMEOUT = 0x00_00_01_00
 
     ## Remote Config Specific
-    COEF_COHERENCY_LOSS = 0x00_01_00_01
\ No newline at end of file
+    COEF_COHERENCY_LOSS = 0x00_01_00_01
+
+    ## PTP Monitor Specific
+    PTP_LOCK_LOST = 0x00_02_00_01
+    PTP_OFFSET_DRIFT = 0x00_02_00_02
\ No newline at end of file
@@ -0,0 +1,132 @@
+from ..utils import cancel as cancel_utils
+
+import collections
+import threading
+import time as timer
+from typing import Callable, List
+
+class LineReader:
+    """Drains a byte stream on a background thread into a bounded history of complete lines.
+    `read` must block for a short while at most and return b"" when nothing arrived"""
+
+    def __init__(self, read: Callable[[], bytes], capacity: int = 10000, name: str = "line_reader",
+                 encoding: str = "utf-8"):
+        self.__read = read
+        self.__encoding = encoding
+        self.__name = name
+        self.__lines = collections.deque(maxlen=capacity)
+        self.__count = 0 # lines ever completed, so marks stay valid after old lines are dropped
+        self.__partial = ""
+        self.__last_data_at = 0.0
+        self.__listeners: List[Callable[[str], None]] = []
+        self.__cond = threading.Condition()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.error = None
+
+    def start(self):
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__stop.clear()
+            self.error = None
+            self.__thread = threading.Thread(target=self.__run, name=self.__name, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def add_listener(self, on_line: Callable[[str], None]):
+        """Calls `on_line` from the reader thread for every line completed from now on"""
+        with self.__cond:
+            self.__listeners.append(on_line)
+
+    def remove_listener(self, on_line: Callable[[str], None]):
+        with self.__cond:
+            self.__listeners.remove(on_line)
+
+    def mark(self) -> int:
+        """Position to pass as `since` to read only the lines completed after this call"""
+        with self.__cond:
+            return self.__count
+
+    def lines_since(self, mark: int) -> List[str]:
+        with self.__cond:
+            return self.__lines_since(mark)
+
+    def partial(self) -> str:
+        """Text received after the last line break, e.g. a shell prompt"""
+        with self.__cond:
+            return self.__partial
+
+    def wait_for(self, predicate: Callable[[List[str]], bool], since: int = None, timeout: float = None,
+                 stop_event = None, poll: float = 0.1) -> bool:
+        """Blocks until predicate(lines completed since `since`) is true.
+        Returns False on timeout, on stop event or if the stream broke"""
+        deadline = None if timeout is None else timer.monotonic() + timeout
+        since = self.mark() if since is None else since
+        with cancel_utils.on_cancel(stop_event, self.__wake), self.__cond:
+            while not predicate(self.__lines_since(since)):
+                if cancel_utils.is_cancelled(stop_event) or self.error is not None:
+                    return False
+                left = poll if deadline is None else min(poll, deadline - timer.monotonic())
+                if left <= 0:
+                    return False
+                self.__cond.wait(left)
+            return True
+
+    def __wake(self):
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def wait_for_lines(self, pattern: str, count: int = 1, since: int = None, timeout: float = None,
+                       stop_event = None) -> List[str] | None:
+        """Waits for `count` lines containing `pattern`. Returns them or None if not met"""
+        since = self.mark() if since is None else since
+        is_met = self.wait_for(lambda lines: sum(pattern in x for x in lines) >= count,
+                               since, timeout, stop_event)
+        return [x for x in self.lines_since(since) if pattern in x] if is_met else None
+
+    def wait_quiet(self, since: int, quiet: float = 0.1, timeout: float = 0.4) -> str:
+        """Waits until the stream keeps silent for `quiet` sec or `timeout` passes.
+        Returns lines completed since `since` and the pending partial line as one text"""
+        started = timer.monotonic()
+        deadline = started + timeout
+        with self.__cond:
+            while (now := timer.monotonic()) < deadline:
+                silent_for = now - max(self.__last_data_at, started)
+                if silent_for >= quiet and self.__count > since:
+                    break
+                self.__cond.wait(min(deadline - now, max(quiet - silent_for, 0.01)))
+            return "\n".join(self.__lines_since(since) + ([self.__partial] if self.__partial else []))
+
+    def __lines_since(self, mark: int) -> List[str]:
+        new = min(self.__count - mark, len(self.__lines))
+        return list(self.__lines)[len(self.__lines) - new:] if new > 0 else []
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                data = self.__read()
+            except Exception as ex: # port closed or unplugged: let waiters fail instead of hanging
+                with self.__cond:
+                    self.error = ex
+                    self.__cond.notify_all()
+                return
+            if not data:
+                continue
+            with self.__cond:
+                self.__last_data_at = timer.monotonic()
+                text = self.__partial + data.decode(self.__encoding, errors="replace")
+                *lines, self.__partial = text.split("\n")
+                for line in lines:
+                    line = line.rstrip("\r")
+                    self.__lines.append(line)
+                    for on_line in self.__listeners:
+                        on_line(line)
+                self.__count += len(lines)
+                self.__cond.notify_all()
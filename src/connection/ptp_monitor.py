@@ -0,0 +1,280 @@
+from . import snmp_engine as snmp
+from .snmp_mib import Mib
+from ..utils.ring_buffer import RingBuffer
+
+import collections
+import heapq
+import threading
+import time as timer
+from typing import Callable, Deque, Dict, List, Tuple
+
+TableIndex = Tuple[int, ...]
+
+# event kinds passed to PtpMonitor.on_event
+LOCK_LOST = "lock_lost"
+LOCK_ACQUIRED = "lock_acquired"
+OFFSET_DRIFT = "offset_drift"
+UNREACHABLE = "unreachable"
+REACHABLE = "reachable"
+
+# sample fields and their array typecodes. state -1 marks a poll left without response
+SAMPLE_FIELDS = {"time": "d", "state": "b", "offset": "q", "rtt": "q", "skew": "q"}
+NO_RESPONSE = -1
+TRACK_PHASE = 4
+
+# wrpcPtp* scalars of a node and the matching wrsPtpDataTable columns of a switch
+NODE_OBJECTS = ("wrpcPtpServoStateN", "wrpcPtpClockOffsetPsHR", "wrpcPtpRTT", "wrpcPtpSkew")
+SWITCH_COLUMNS = ("wrsPtpServoStateN", "wrsPtpClockOffsetPsHR", "wrsPtpRTT", "wrsPtpSkew")
+
+class _Series:
+    """History and alarm state of one node or of one wrsPtpDataTable row of a switch"""
+
+    def __init__(self, capacity: int):
+        self.samples = RingBuffer(capacity, SAMPLE_FIELDS)
+        self.state = None
+        self.is_drifting = False
+
+class _Target:
+    def __init__(self, ip: str, port: int, is_switch: bool):
+        self.address = (ip, port)
+        self.is_switch = is_switch
+        self.series: Dict[TableIndex, _Series] = {}
+        self.is_reachable = True
+        self.rows: Dict[TableIndex, List] = {} # switch rows collected by the running walk
+        self.next_oids: List[snmp.Oid] = None # where the running walk goes on, None - a new poll is due
+        self.polled_at = 0.0 # when the running poll started
+
+class PtpMonitor:
+    """Samples PTP state of a fleet of WR nodes and switches from one UDP socket and one scheduler thread.
+    Requests are rate limited, so thousands of targets are polled without flooding the network.
+    Every node (and every switch table row) keeps a fixed-size sample history"""
+
+    def __init__(self, mib: Mib, interval: float = 1.0, rate: float = 500, max_in_flight: int = 256,
+                 timeout: float = 1.0, history: int = 600, offset_limit: int = 1000, switch_rows: int = 20,
+                 on_event: Callable[[str, TableIndex, str, str], None] = None, community: str = "public"):
+        self.interval = interval
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.history = history
+        self.offset_limit = offset_limit
+        self.switch_rows = switch_rows
+        self.on_event = on_event
+        self.__node_oids = [mib.resolve(f"{x}.0") for x in NODE_OBJECTS]
+        self.__switch_oids = [mib.resolve(x) for x in SWITCH_COLUMNS]
+        self.__engine = snmp.SnmpEngine(community=community)
+        self.__targets: Dict[Tuple[str, int], _Target] = {}
+        self.__schedule: List[Tuple[float, int, Tuple[str, int]]] = []
+        self.__schedule_seq = 0
+        # request_id -> (target, sent at), plus the same ids in sending order for timeouts
+        self.__in_flight: Dict[int, Tuple[_Target, float]] = {}
+        self.__sent_order: Deque[Tuple[float, int]] = collections.deque()
+        self.__tokens = 0.0
+        self.__tokens_at = timer.monotonic()
+        self.__lock = threading.RLock() # on_event handlers may query the monitor
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.requests_sent = 0
+        self.timeouts = 0
+
+    def add(self, ip: str, is_switch: bool = False, port: int = 161):
+        with self.__lock:
+            address = (ip, port)
+            if address in self.__targets:
+                return
+            self.__targets[address] = _Target(ip, port, is_switch)
+            # spread the first polls over one interval
+            self.__push(address, timer.monotonic() + (len(self.__targets) / self.rate) % self.interval)
+
+    def remove(self, ip: str, port: int = 161):
+        with self.__lock:
+            self.__targets.pop((ip, port), None)
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__stop.clear()
+                self.__thread = threading.Thread(target=self.__run, name="ptp_monitor", daemon=True)
+                self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        thread = self.__thread
+        if thread is not None:
+            thread.join()
+        self.__thread = None
+
+    def close(self):
+        self.stop()
+        self.__engine.close()
+
+    def history_of(self, ip: str, index: TableIndex = (), port: int = 161) -> RingBuffer | None:
+        """Returns the samples of a node, or of the wrsPtpDataTable row `index` of a switch"""
+        with self.__lock:
+            target = self.__targets.get((ip, port))
+            series = None if target is None else target.series.get(index)
+            return None if series is None else series.samples
+
+    def summary(self) -> Dict[str, int]:
+        """Counts series by their last state and finds the worst offset among the locked ones"""
+        result = {"targets": 0, "series": 0, "locked": 0, "unlocked": 0, "unreachable": 0, "drifting": 0,
+                  "worst_offset": 0}
+        with self.__lock:
+            result["targets"] = len(self.__targets)
+            for target in self.__targets.values():
+                for series in target.series.values():
+                    result["series"] += 1
+                    last = series.samples.latest()
+                    if last is None:
+                        continue
+                    if last["state"] == NO_RESPONSE:
+                        result["unreachable"] += 1
+                    elif last["state"] == TRACK_PHASE:
+                        result["locked"] += 1
+                        if abs(last["offset"]) > abs(result["worst_offset"]):
+                            result["worst_offset"] = last["offset"]
+                    else:
+                        result["unlocked"] += 1
+                    result["drifting"] += series.is_drifting
+        return result
+
+    # ----------- scheduler -----------
+
+    def __run(self):
+        while not self.__stop.is_set():
+            with self.__lock:
+                now = timer.monotonic()
+                self.__expire(now)
+                wake_at = self.__dispatch(now)
+            response = self.__engine.receive(max(0, min(wake_at - timer.monotonic(), self.timeout)))
+            with self.__lock:
+                while response is not None:
+                    self.__on_response(*response)
+                    response = self.__engine.receive(0)
+
+    def __push(self, address: Tuple[str, int], at: float):
+        self.__schedule_seq += 1
+        heapq.heappush(self.__schedule, (at, self.__schedule_seq, address))
+
+    def __dispatch(self, now: float) -> float:
+        """Sends the due polls the rate limit allows. Returns the time worth waking up at"""
+        self.__tokens = min(self.__tokens + (now - self.__tokens_at) * self.rate, max(self.rate * 0.1, 1))
+        self.__tokens_at = now
+        while self.__schedule and self.__schedule[0][0] <= now:
+            if self.__tokens < 1 or len(self.__in_flight) >= self.max_in_flight:
+                return now + (1 - self.__tokens) / self.rate if self.__tokens < 1 else now + self.timeout
+            _, _, address = heapq.heappop(self.__schedule)
+            target = self.__targets.get(address)
+            if target is None: # removed meanwhile
+                continue
+            self.__tokens -= 1
+            if target.next_oids is not None: # continuation of a switch walk, rate limited as any request
+                oids, target.next_oids = target.next_oids, None
+                self.__send(target, snmp.GET_BULK_REQUEST, oids, now)
+            elif target.is_switch:
+                target.rows = {}
+                target.polled_at = now
+                self.__send(target, snmp.GET_BULK_REQUEST, self.__switch_oids, now)
+            else:
+                self.__send(target, snmp.GET_REQUEST, self.__node_oids, now)
+        return self.__schedule[0][0] if self.__schedule else now + self.interval
+
+    def __send(self, target: _Target, pdu_type: int, oids: List[snmp.Oid], now: float):
+        try:
+            request_id = self.__engine.send(target.address[0], target.address[1], pdu_type,
+                                            [(x, snmp.NULL, None) for x in oids],
+                                            max_repetitions=self.switch_rows if pdu_type == snmp.GET_BULK_REQUEST else 0)
+        except OSError:
+            self.__on_timeout(target, now)
+            return
+        self.requests_sent += 1
+        self.__in_flight[request_id] = (target, now)
+        self.__sent_order.append((now, request_id))
+
+    def __expire(self, now: float):
+        while self.__sent_order and now - self.__sent_order[0][0] >= self.timeout:
+            _, request_id = self.__sent_order.popleft()
+            pending = self.__in_flight.pop(request_id, None)
+            if pending is not None:
+                self.timeouts += 1
+                self.__on_timeout(pending[0], now)
+
+    def __on_timeout(self, target: _Target, now: float):
+        if target.address not in self.__targets:
+            return
+        if target.is_reachable:
+            target.is_reachable = False
+            self.__emit(target, (), UNREACHABLE, "no response")
+        target.rows = {}
+        target.next_oids = None
+        for index in (target.series or {(): None}):
+            self.__record(target, index, now, NO_RESPONSE, 0, 0, 0)
+        self.__push(target.address, now + self.interval)
+
+    def __on_response(self, address, request_id: int, error_status: int, error_index: int, varbinds: List[snmp.VarBind]):
+        pending = self.__in_flight.pop(request_id, None)
+        if pending is None:
+            return
+        target, sent_at = pending
+        if target.address not in self.__targets:
+            return
+        now = timer.monotonic()
+        if not target.is_reachable:
+            target.is_reachable = True
+            self.__emit(target, (), REACHABLE, "responds again")
+
+        if not target.is_switch:
+            if error_status != 0 or not varbinds or varbinds[0][1] in snmp.EXCEPTION_TAGS:
+                # the servo state is unknown: recording 0 would raise a false lock loss
+                self.__record(target, (), now, NO_RESPONSE, 0, 0, 0)
+            else:
+                values = [x[2] if x[1] not in snmp.EXCEPTION_TAGS else 0 for x in varbinds]
+                if len(values) == len(NODE_OBJECTS):
+                    self.__record(target, (), now, *values)
+            self.__push(target.address, sent_at + self.interval)
+            return
+
+        # GETBULK over the switch columns: varbinds go row by row, columns in request order
+        last_oids = list(self.__switch_oids)
+        in_table = [error_status == 0] * len(self.__switch_oids)
+        for i, (oid, tag, value) in enumerate(varbinds):
+            column = i % len(self.__switch_oids)
+            column_oid = self.__switch_oids[column]
+            if not in_table[column] or tag in snmp.EXCEPTION_TAGS or oid[:len(column_oid)] != column_oid:
+                in_table[column] = False
+                continue
+            index = oid[len(column_oid):]
+            target.rows.setdefault(index, [0] * len(SWITCH_COLUMNS))[column] = value
+            last_oids[column] = oid
+        if all(in_table) and varbinds:
+            # the table has more rows than one response carried: the walk goes on once the rate limit allows
+            target.next_oids = last_oids
+            self.__push(target.address, now)
+            return
+        for index, values in sorted(target.rows.items()):
+            self.__record(target, index, now, *values)
+        target.rows = {}
+        self.__push(target.address, target.polled_at + self.interval)
+
+    def __record(self, target: _Target, index: TableIndex, now: float, state: int, offset: int, rtt: int, skew: int):
+        series = target.series.get(index)
+        if series is None:
+            series = target.series[index] = _Series(self.history)
+        series.samples.append(now, state, offset, rtt, skew)
+        if state == NO_RESPONSE:
+            return
+
+        if series.state == TRACK_PHASE and state != TRACK_PHASE:
+            self.__emit(target, index, LOCK_LOST, f"servo state {state}")
+        elif series.state is not None and series.state != TRACK_PHASE and state == TRACK_PHASE:
+            self.__emit(target, index, LOCK_ACQUIRED, "trackPhase")
+        series.state = state
+
+        is_drifting = state == TRACK_PHASE and abs(offset) > self.offset_limit
+        if is_drifting and not series.is_drifting:
+            self.__emit(target, index, OFFSET_DRIFT, f"clock offset {offset} ps exceeds {self.offset_limit} ps")
+        series.is_drifting = is_drifting
+
+    def __emit(self, target: _Target, index: TableIndex, kind: str, text: str):
+        if self.on_event is not None:
+            self.on_event(target.address[0], index, kind, text)
@@ -0,0 +1,159 @@
+from . import snmp_engine as snmp
+from .snmp_mib import Mib
+from ..utils.cancel import CancelToken
+
+from concurrent.futures import Future
+import threading
+import time as timer
+from typing import Dict, List, Tuple
+
+class SyncCriterion:
+    """Lock is stable once `hits` consecutive polls report one of `states` for at least `min_duration` sec"""
+
+    def __init__(self, hits: int = 3, min_duration: float = 2.0, states: Tuple[str, ...] = ("trackPhase",)):
+        self.hits = hits
+        self.min_duration = min_duration
+        self.states = states
+
+    def is_met(self, hits: int, locked_for: float) -> bool:
+        return hits >= self.hits and locked_for >= self.min_duration
+
+class _WatchedNode:
+    def __init__(self, ip: str, port: int, deadline: float, stop_event, interval: float, criterion: SyncCriterion):
+        self.address = (ip, port)
+        self.criterion = criterion
+        self.deadline = deadline
+        self.stop_event = stop_event
+        self.future = Future()
+        self.interval = interval
+        self.next_poll = 0
+        self.hits = 0
+        self.locked_since = None
+        self.state = None
+        self.remove_abort = lambda: None
+
+class PtpSyncWaiter:
+    """Watches wrpcPtpServoStateN of any number of nodes from one UDP socket and one scheduler thread.
+    Nodes far from lock are polled rarely, nodes approaching lock often; each finishes on its first stable lock"""
+
+    # servo states after which lock is seconds away
+    __NEAR_LOCK_STATES = ("syncPhase", "waitOffsetStable", "trackPhase")
+    __STATE_OBJECT = "wrpcPtpServoStateN"
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, mib: Mib, criterion: SyncCriterion = None,
+                 min_interval: float = 0.25, max_interval: float = 2.0, community: str = "public"):
+        self.criterion = criterion if criterion is not None else SyncCriterion()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.__state_oid = mib.resolve(f"{PtpSyncWaiter.__STATE_OBJECT}.0")
+        self.__state_labels = mib.objects[PtpSyncWaiter.__STATE_OBJECT].enum_labels
+        self.__engine = snmp.SnmpEngine(community=community)
+        self.__nodes: Dict[Tuple[str, int], _WatchedNode] = {}
+        self.__requests: Dict[int, Tuple[str, int]] = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def shared(mib: Mib) -> "PtpSyncWaiter":
+        """Process-wide waiter, so every node of a fleet is watched by the same scheduler"""
+        with PtpSyncWaiter.__shared_lock:
+            if PtpSyncWaiter.__shared is None:
+                PtpSyncWaiter.__shared = PtpSyncWaiter(mib)
+            return PtpSyncWaiter.__shared
+
+    def watch(self, ip: str, timeout: float, stop_event = None, port: int = 161, criterion: SyncCriterion = None) -> Future:
+        """Returns a future resolved to True on stable lock and to False on timeout or stop event"""
+        node = _WatchedNode(ip, port, timer.monotonic() + timeout, stop_event, self.max_interval,
+                            criterion if criterion is not None else self.criterion)
+        if isinstance(stop_event, CancelToken): # wakes the scheduler thread, which then drops the node
+            node.remove_abort = stop_event.on_cancel(self.__engine.abort)
+        with self.__lock:
+            previous = self.__nodes.get(node.address)
+            if previous is not None:
+                previous.remove_abort()
+                previous.future.set_result(False)
+            self.__nodes[node.address] = node
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="ptp_sync_waiter", daemon=True)
+                self.__thread.start()
+        return node.future
+
+    def wait(self, ips: List[str], timeout: float, stop_event = None, port: int = 161) -> Dict[str, bool]:
+        futures = {ip: self.watch(ip, timeout, stop_event, port) for ip in ips}
+        return {ip: future.result() for ip, future in futures.items()}
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                if not self.__nodes:
+                    self.__thread = None
+                    self.__requests.clear()
+                    return
+                now = timer.monotonic()
+                for address, node in list(self.__nodes.items()):
+                    if node.future.done() or now >= node.deadline or \
+                            (node.stop_event is not None and node.stop_event.is_set()):
+                        self.__finish(address, False)
+                    elif now >= node.next_poll:
+                        self.__poll(node, now)
+                wake_at = min([x.next_poll for x in self.__nodes.values()] +
+                              [x.deadline for x in self.__nodes.values()], default=now)
+
+            try:
+                response = self.__engine.receive(min(max(0, wake_at - timer.monotonic()), self.min_interval))
+            except InterruptedError: # a stop event was set: the next round finishes its nodes
+                continue
+            if response is not None:
+                with self.__lock:
+                    self.__on_response(*response)
+
+    def __poll(self, node: _WatchedNode, now: float):
+        try:
+            request_id = self.__engine.send(node.address[0], node.address[1], snmp.GET_REQUEST,
+                                            [(self.__state_oid, snmp.NULL, None)])
+            self.__requests[request_id] = node.address
+        except OSError: # unreachable right now: retry on the next poll
+            pass
+        node.next_poll = now + node.interval
+
+    def __on_response(self, address, request_id: int, error_status: int, error_index: int, varbinds: List[snmp.VarBind]):
+        node_address = self.__requests.pop(request_id, None)
+        node = self.__nodes.get(node_address)
+        if node is None or error_status != 0 or not varbinds:
+            return
+        _, tag, value = varbinds[0]
+        now = timer.monotonic()
+        node.state = self.__state_labels.get(value, value) if tag == snmp.INTEGER else None
+
+        if node.state in node.criterion.states:
+            node.hits += 1
+            node.locked_since = node.locked_since if node.locked_since is not None else now
+        else:
+            node.hits = 0
+            node.locked_since = None
+        if node.criterion.is_met(node.hits, now - node.locked_since if node.locked_since is not None else 0):
+            self.__finish(node_address, True)
+            return
+
+        # adaptive polling: back off while far from lock, poll fast when close to it
+        if node.state in PtpSyncWaiter.__NEAR_LOCK_STATES:
+            node.interval = self.min_interval
+        else:
+            node.interval = min(node.interval * 2, self.max_interval)
+        node.next_poll = min(node.next_poll, now + node.interval)
+
+    def __finish(self, address: Tuple[str, int], is_synced: bool):
+        node = self.__nodes.pop(address)
+        node.remove_abort()
+        if not node.future.done():
+            node.future.set_result(is_synced)
+        for request_id in [k for k, v in self.__requests.items() if v == address]:
+            del self.__requests[request_id]
+
+    def close(self):
+        with self.__lock:
+            for address in list(self.__nodes):
+                self.__finish(address, False)
+        self.__engine.close()
@@ -0,0 +1,257 @@
+from .direct_connect import Direct_Connect
+from .stat_parser import SERVO_STATES, TRACK_PHASE
+
+import heapq
+import itertools
+import random
+import threading
+import time as timer
+from typing import Dict, List, Sequence, Tuple
+
+UNINITIALIZED = SERVO_STATES.index("UNINITIALIZED")
+
+class SimSfpEntry:
+    """Row of the SFP database of a simulated node"""
+
+    def __init__(self, pn: str, tx: int, rx: int, alpha: int, port: int = 0):
+        self.pn = pn
+        self.tx = tx
+        self.rx = rx
+        self.alpha = alpha
+        self.port = port
+
+class SimWrpcNode:
+    """State of a simulated WR-Node: SFP database, plugged SFPs and the PTP servo.
+    The console and SNMP simulators share it, so coefficients written over one are seen by the other.
+
+    The PPS of the node lags the switch by `delays_ps[port]` minus half the RX - TX asymmetry of the SFP
+    entry matched on the port, so writing the offset a calibration measured moves the next measurement to 0"""
+
+    def __init__(self, sfp_pns: Sequence[str | None] = ("SFP1G-LX-31",), delays_ps: Sequence[float] = (1500.0,),
+                 rtt_ps: int = 800000, lock_time: float = 3.0, jitter_ps: float = 4.0, seed: int = None):
+        self.sfp_pns = list(sfp_pns)
+        self.delays_ps = list(delays_ps) + [0.0] * (len(self.sfp_pns) - len(delays_ps))
+        self.rtt_ps = rtt_ps
+        self.lock_time = lock_time
+        self.jitter_ps = jitter_ps
+        self.sfp_db: List[SimSfpEntry] = []
+        self.__matched: Dict[int, SimSfpEntry | None] = {}
+        self.__ptp_started_at = None
+        self.__random = random.Random(seed)
+        self.__lock = threading.RLock()
+        self.start_ptp()
+
+    def start_ptp(self):
+        with self.__lock:
+            self.match_sfps()
+            self.__ptp_started_at = timer.monotonic()
+
+    def stop_ptp(self):
+        with self.__lock:
+            self.__ptp_started_at = None
+
+    def servo_state(self, at: float = None) -> int:
+        """Index in SERVO_STATES. The servo walks SYNC_NSEC, SYNC_SEC and SYNC_PHASE to TRACK_PHASE in `lock_time` sec"""
+        with self.__lock:
+            if self.__ptp_started_at is None:
+                return UNINITIALIZED
+            elapsed = (at if at is not None else timer.monotonic()) - self.__ptp_started_at
+        if elapsed >= self.lock_time:
+            return TRACK_PHASE
+        return 1 + min(2, int(4 * max(elapsed, 0) / self.lock_time))
+
+    def add_sfp(self, pn: str, tx: int, rx: int, alpha: int, port: int = 0) -> SimSfpEntry:
+        """Adds or replaces the entry of the PN on the port. Takes effect on the next match_sfps()"""
+        with self.__lock:
+            entry = self.find_sfp(pn, port)
+            if entry is None:
+                entry = SimSfpEntry(pn, tx, rx, alpha, port)
+                self.sfp_db.append(entry)
+            entry.tx, entry.rx, entry.alpha = tx, rx, alpha
+            return entry
+
+    def erase_sfps(self):
+        with self.__lock:
+            self.sfp_db.clear()
+
+    def find_sfp(self, pn: str, port: int = 0) -> SimSfpEntry | None:
+        with self.__lock:
+            return next((x for x in self.sfp_db if x.pn == pn and x.port == port), None)
+
+    def match_sfps(self) -> Dict[int, SimSfpEntry | None]:
+        """Looks the plugged SFPs up in the database. Returns port -> matched entry"""
+        with self.__lock:
+            self.__matched = {port: self.find_sfp(pn, port) if pn else None for port, pn in enumerate(self.sfp_pns)}
+            return dict(self.__matched)
+
+    def matched_sfp(self, port: int = 0) -> SimSfpEntry | None:
+        with self.__lock:
+            return self.__matched.get(port)
+
+    def pps_delay_ps(self, port: int = 0) -> float:
+        """Mean delay of the node PPS to the switch PPS an oscilloscope would measure"""
+        with self.__lock:
+            entry = self.__matched.get(port)
+            correction = (entry.rx - entry.tx) / 2 if entry is not None else 0
+            return self.delays_ps[port] - correction
+
+    def stat_line(self, at: float = None, port: int = 0) -> str:
+        """`stat` line as the WRPC shell prints it once a second"""
+        with self.__lock:
+            state = self.servo_state(at)
+            entry = self.__matched.get(port)
+            tx, rx = (entry.tx, entry.rx) if entry is not None else (0, 0)
+            crtt = self.rtt_ps - tx - rx + round(self.__random.gauss(0, self.jitter_ps))
+            cko = round(self.__random.gauss(0, self.jitter_ps)) if state == TRACK_PHASE else self.__random.randint(-5000, 5000)
+            now = timer.time()
+        return (f"lnk:1 rx:{int(now) % 100000} tx:{int(now) % 100000} lock:1 sv:1 ss:'{SERVO_STATES[state]}' aux:0 "
+                f"sec:{int(now)} nsec:{int(now % 1 * 1e9)} mu:{self.rtt_ps} dms:{self.rtt_ps // 2} "
+                f"dtxm:0 drxm:0 dtxs:{tx} drxs:{rx} asym:0 crtt:{crtt} cko:{cko} setp:{cko % 8000} "
+                f"hd:30000 md:30000 ad:65000 temp:41.1875 C")
+
+class SimWrpcConsole:
+    """Stand-in for the serial port of a WR-Node running the WRPC shell, implementing the part of
+    serial.Serial that Direct_Connect uses. Commands are answered after `latency` sec and, while stats
+    are on, a `stat` line is printed every `stat_period` sec. Output is produced on read(), so no thread is needed"""
+
+    PROMPT = "wrc# "
+
+    def __init__(self, node: SimWrpcNode = None, latency: float = 0.01, stat_period: float = 1.0, port: str = "sim"):
+        self.node = node if node is not None else SimWrpcNode()
+        self.latency = latency
+        self.stat_period = stat_period
+        self.port = port
+        self.baudrate = 115200
+        self.timeout = 0.05
+        self.is_open = False
+        self.commands: List[str] = [] # every command received, for inspection
+        self.__scheduled: List[Tuple[float, int, bytes]] = [] # heap of (ready at, seq, data)
+        self.__seq = itertools.count()
+        self.__out = bytearray()
+        self.__inbuf = ""
+        self.__is_stat_on = False
+        self.__next_stat_at = 0.0
+        self.__cond = threading.Condition()
+
+    def open(self):
+        with self.__cond:
+            self.is_open = True
+            self.__next_stat_at = timer.monotonic() + self.stat_period
+
+    def close(self):
+        """Whatever the node printed meanwhile is lost, as with a real port. The node keeps its stat state"""
+        with self.__cond:
+            self.is_open = False
+            self.__scheduled.clear()
+            self.__out.clear()
+            self.__cond.notify_all()
+
+    @property
+    def in_waiting(self) -> int:
+        with self.__cond:
+            self.__collect(timer.monotonic())
+            return len(self.__out)
+
+    def write(self, data: bytes) -> int:
+        with self.__cond:
+            if not self.is_open:
+                raise OSError(f"{self.port} is not open")
+            self.__inbuf += data.decode("utf-8", errors="replace")
+            while (end := min((i for i in (self.__inbuf.find("\r"), self.__inbuf.find("\n")) if i >= 0), default=-1)) >= 0:
+                line, self.__inbuf = self.__inbuf[:end], self.__inbuf[end + 1:]
+                self.commands.append(line.strip())
+                reply = self.__execute(line.strip())
+                text = f"{line}\r\n" + "".join(f"{x}\r\n" for x in reply) + SimWrpcConsole.PROMPT
+                heapq.heappush(self.__scheduled, (timer.monotonic() + self.latency, next(self.__seq), text.encode("utf-8")))
+            self.__cond.notify_all()
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        """Returns up to `size` bytes, waiting up to `timeout` sec for the first of them"""
+        deadline = timer.monotonic() + self.timeout
+        with self.__cond:
+            while self.is_open:
+                now = timer.monotonic()
+                self.__collect(now)
+                if self.__out or now >= deadline:
+                    break
+                next_at = deadline
+                if self.__scheduled:
+                    next_at = min(next_at, self.__scheduled[0][0])
+                if self.__is_stat_on:
+                    next_at = min(next_at, self.__next_stat_at)
+                self.__cond.wait(max(next_at - now, 0.001))
+            data = bytes(self.__out[:size])
+            del self.__out[:size]
+        return data
+
+    def __collect(self, now: float):
+        """Moves the output due by `now` to the read buffer. Must hold the condition"""
+        if not self.is_open:
+            return
+        while self.__scheduled and self.__scheduled[0][0] <= now:
+            self.__out += heapq.heappop(self.__scheduled)[2]
+        if self.__is_stat_on and self.stat_period > 0:
+            if now - self.__next_stat_at > 100 * self.stat_period: # nobody read for long: skip to the recent lines
+                self.__next_stat_at = now - self.stat_period
+            while self.__next_stat_at <= now:
+                self.__out += f"{self.node.stat_line(self.__next_stat_at)}\r\n".encode("utf-8")
+                self.__next_stat_at += self.stat_period
+
+    def __execute(self, command: str) -> List[str]:
+        """Output lines of a WRPC shell command"""
+        words = command.split()
+        if not words:
+            return []
+        if words[0] == "stat":
+            self.__is_stat_on = (words[1] == "on") if len(words) > 1 else not self.__is_stat_on
+            self.__next_stat_at = timer.monotonic() + self.stat_period
+            return ["statistics now " + ("ON" if self.__is_stat_on else "OFF")]
+        if words[0] == "ptp" and len(words) > 1 and words[1] in ("start", "stop"):
+            if words[1] == "start":
+                self.node.start_ptp()
+            else:
+                self.node.stop_ptp()
+            return []
+        if words[0] == "sfp" and len(words) > 1:
+            return self.__execute_sfp(words[1], words[2:])
+        if words[0] in ("auxmux", "verbose"):
+            return []
+        return ["Unrecognized command."]
+
+    def __execute_sfp(self, op: str, args: List[str]) -> List[str]:
+        if op == "match":
+            lines = []
+            for port, entry in self.node.match_sfps().items():
+                pn = self.node.sfp_pns[port]
+                if pn is None:
+                    lines.append(f"Port {port} No SFP.")
+                elif entry is None:
+                    lines += [f"port {port} SFP not matched!", pn, f"Port {port} Could not match to DB"]
+                else:
+                    lines += [pn, f"Port {port} SFP matched, dTx={entry.tx} dRx={entry.rx} alpha={entry.alpha}"]
+            return lines
+        if op == "show":
+            return [f"Port {x.port}, SFP {i + 1}: PN:{x.pn:<16} dTx: {x.tx:>8} dRx: {x.rx:>8} alpha: {x.alpha:>8}"
+                    for i, x in enumerate(self.node.sfp_db)]
+        if op == "add" and len(args) >= 4:
+            try:
+                self.node.add_sfp(args[0], int(args[1]), int(args[2]), int(args[3]), int(args[4]) if len(args) > 4 else 0)
+            except ValueError:
+                return ["Wrong parameter"]
+            return [f"{len(self.node.sfp_db)} SFPs in DB"]
+        if op == "erase":
+            self.node.erase_sfps()
+            return ["SFP DB erased"]
+        return ["Wrong parameter"]
+
+class Sim_Connect(Direct_Connect):
+    """Direct_Connect to a simulated WR-Node: the whole console path runs, only the serial port is a SimWrpcConsole"""
+
+    def __init__(self, root: str, stop_event = None, tty_usb_port: int = 0, console: SimWrpcConsole = None):
+        self.console = console if console is not None else SimWrpcConsole(port=f"sim{tty_usb_port}")
+        super().__init__(root, stop_event, tty_usb_port, device=self.console)
+
+    @property
+    def node(self) -> SimWrpcNode:
+        return self.console.node
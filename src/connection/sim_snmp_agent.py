@@ -0,0 +1,273 @@
+from . import snmp_engine as snmp
+from . import snmp_mib
+from .sim_connect import SimWrpcNode
+from .stat_parser import TRACK_PHASE
+
+import bisect
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import threading
+import time as timer
+from typing import Any, Dict, List, Tuple
+
+MIBS_FOLDER = "src/mibs"
+
+# wrpcPtpConfigApply / wrpcPtpConfigRestart values, see WR-WRPC-MIB
+APPLY_GIVEN_SFP = 1
+APPLY_CURRENT_SFP = 2
+APPLY_MEMORY_CURRENT_SFP = 3
+APPLY_ERASE = 50
+APPLY_SUCCESSFUL = 100
+APPLY_MATCH_FAILED = 101
+APPLY_FAILED = 200
+APPLY_INVALID_PN = 203
+RESTART_PTP = 1
+RESTART_SUCCESSFUL = 100
+
+# error-status codes of a response
+NOT_WRITABLE = snmp.ERROR_STATUSES.index("notWritable")
+WRONG_TYPE = snmp.ERROR_STATUSES.index("wrongType")
+
+class SimSnmpAgent:
+    """SNMPv2c agent serving the WR-WRPC-MIB objects of a simulated node on a local UDP port.
+    GET, GETNEXT, GETBULK and SET are served; writes of wrpcPtpConfigApply and wrpcPtpConfigRestart act on
+    the node as the WRPC agent does. Every response is delayed by `latency` sec and a `loss` share
+    of the requests is dropped, so retries and timeouts of the client can be exercised"""
+
+    __WRITABLE = ("wrpcPtpConfigRestart", "wrpcPtpConfigApply", "wrpcPtpConfigSfpPn",
+                  "wrpcPtpConfigDeltaTx", "wrpcPtpConfigDeltaRx", "wrpcPtpConfigAlpha")
+
+    def __init__(self, node: SimWrpcNode = None, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 loss: float = 0.0, community: str = "public", seed: int = None):
+        """`port` 0 picks a free one, read it back from `address`"""
+        self.node = node if node is not None else SimWrpcNode(seed=seed)
+        self.latency = latency
+        self.loss = loss
+        self.community = community
+        self.mib = snmp_mib.load_mibs("WR-WRPC-MIB", [MIBS_FOLDER])
+        self.requests = 0
+        self.dropped = 0
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.bind((host, port))
+        self.__sock.setblocking(False)
+        self.address: Tuple[str, int] = self.__sock.getsockname()
+        self.__random = random.Random(seed)
+        self.__writable = {self.mib.resolve(f"{x}.0") for x in SimSnmpAgent.__WRITABLE}
+        self.__store: Dict[snmp.Oid, Tuple[int, Any]] = {}
+        self.__lock = threading.Lock()
+        self.__fleet = None
+        self.__put("wrpcVersionHwType.0", snmp.OCTET_STRING, b"SIM")
+        self.__put("wrpcVersionSwVersion.0", snmp.OCTET_STRING, b"wrpc-sim")
+        self.__put("wrpcPtpConfigRestart.0", snmp.INTEGER, 0)
+        self.__put("wrpcPtpConfigApply.0", snmp.INTEGER, 0)
+        self.__put("wrpcPtpConfigSfpPn.0", snmp.OCTET_STRING, b"")
+        self.__put("wrpcPtpConfigDeltaTx.0", snmp.INTEGER, 0)
+        self.__put("wrpcPtpConfigDeltaRx.0", snmp.INTEGER, 0)
+        self.__put("wrpcPtpConfigAlpha.0", snmp.INTEGER, 0)
+        self.__put("wrpcPortLinkStatus.0", snmp.INTEGER, 2)
+
+    @property
+    def host(self) -> str:
+        return self.address[0]
+
+    @property
+    def port(self) -> int:
+        return self.address[1]
+
+    def fileno(self) -> int:
+        return self.__sock.fileno()
+
+    def start(self) -> "SimSnmpAgent":
+        """Serves the agent from a thread of its own"""
+        if self.__fleet is None:
+            self.__fleet = SimSnmpFleet([self]).start()
+        return self
+
+    def stop(self):
+        if self.__fleet is not None:
+            self.__fleet.stop()
+            self.__fleet = None
+        self.close()
+
+    def close(self):
+        self.__sock.close()
+
+    def receive(self) -> Tuple[bytes, Tuple[str, int]] | None:
+        """Reads one request and returns (response, client address). None if nothing is to be answered"""
+        try:
+            data, address = self.__sock.recvfrom(65535)
+        except (BlockingIOError, OSError):
+            return None
+        self.requests += 1
+        if self.loss and self.__random.random() < self.loss:
+            self.dropped += 1
+            return None
+        try:
+            return self.__handle(data), address
+        except snmp.SnmpDecodeError:
+            return None
+
+    def send(self, response: bytes, address: Tuple[str, int]):
+        try:
+            self.__sock.sendto(response, address)
+        except OSError: # closed meanwhile or the client is gone
+            pass
+
+    def __put(self, obj: str, tag: int, value: Any):
+        self.__store[self.mib.resolve(obj)] = (tag, value)
+
+    def __refresh(self):
+        """Copies the node state into the served objects. Must hold the lock"""
+        node = self.node
+        state = node.servo_state()
+        entry = node.matched_sfp(0)
+        tx, rx = (entry.tx, entry.rx) if entry is not None else (0, 0)
+        offset = round(self.__random.gauss(0, node.jitter_ps)) if state == TRACK_PHASE else self.__random.randint(-5000, 5000)
+        self.__put("wrpcPtpServoStateN.0", snmp.INTEGER, state)
+        self.__put("wrpcPtpClockOffsetPsHR.0", snmp.INTEGER, offset)
+        self.__put("wrpcPtpSkew.0", snmp.INTEGER, round(self.__random.gauss(0, node.jitter_ps)))
+        self.__put("wrpcPtpRTT.0", snmp.COUNTER64, max(node.rtt_ps - tx - rx, 0))
+        self.__put("wrpcPortSfpPn.0", snmp.OCTET_STRING, (node.sfp_pns[0] or "").encode("utf-8"))
+        self.__put("wrpcPortSfpInDB.0", snmp.INTEGER, 2 if node.find_sfp(node.sfp_pns[0], 0) is not None else 1)
+        table = self.mib.resolve("wrpcSfpTable")
+        for oid in [x for x in self.__store if x[:len(table)] == table]:
+            del self.__store[oid]
+        for index, sfp in enumerate(node.sfp_db, start=1):
+            self.__put(f"wrpcSfpPn.{index}", snmp.OCTET_STRING, sfp.pn.encode("utf-8"))
+            self.__put(f"wrpcSfpDeltaTx.{index}", snmp.INTEGER, sfp.tx)
+            self.__put(f"wrpcSfpDeltaRx.{index}", snmp.INTEGER, sfp.rx)
+            self.__put(f"wrpcSfpAlpha.{index}", snmp.INTEGER, sfp.alpha)
+
+    def __handle(self, data: bytes) -> bytes:
+        pdu_type, request_id, non_repeaters, max_repetitions, varbinds = snmp.decode_message(data)
+        error_status, error_index = 0, 0
+        with self.__lock:
+            self.__refresh()
+            keys = sorted(self.__store)
+            if pdu_type == snmp.GET_REQUEST:
+                response = [(oid,) + self.__store.get(oid, (snmp.NO_SUCH_OBJECT, None)) for oid, _, _ in varbinds]
+            elif pdu_type == snmp.GET_NEXT_REQUEST:
+                response = [self.__next(keys, oid) for oid, _, _ in varbinds]
+            elif pdu_type == snmp.GET_BULK_REQUEST:
+                response = [self.__next(keys, oid) for oid, _, _ in varbinds[:non_repeaters]]
+                cursors = [oid for oid, _, _ in varbinds[non_repeaters:]]
+                for _ in range(max_repetitions if cursors else 0):
+                    row = [self.__next(keys, oid) for oid in cursors]
+                    response += row
+                    cursors = [oid for oid, _, _ in row]
+                    if all(tag == snmp.END_OF_MIB_VIEW for _, tag, _ in row):
+                        break
+            elif pdu_type == snmp.SET_REQUEST:
+                response = list(varbinds)
+                error_status, error_index = self.__set(varbinds)
+            else:
+                raise snmp.SnmpDecodeError(f"Unexpected PDU type 0x{pdu_type:02X}")
+        return snmp.encode_message(self.community, snmp.GET_RESPONSE, request_id, response, error_status, error_index)
+
+    def __next(self, keys: List[snmp.Oid], oid: snmp.Oid) -> snmp.VarBind:
+        i = bisect.bisect_right(keys, oid)
+        if i == len(keys):
+            return (oid, snmp.END_OF_MIB_VIEW, None)
+        return (keys[i],) + self.__store[keys[i]]
+
+    def __set(self, varbinds: List[snmp.VarBind]) -> Tuple[int, int]:
+        """Applies the SET PDU as a whole. Returns (error status, error index)"""
+        for i, (oid, tag, _) in enumerate(varbinds, start=1):
+            if oid not in self.__writable:
+                return NOT_WRITABLE, i
+            if tag != self.__store[oid][0]:
+                return WRONG_TYPE, i
+        for oid, tag, value in varbinds:
+            self.__store[oid] = (tag, value)
+
+        written = {oid for oid, _, _ in varbinds}
+        apply = self.mib.resolve("wrpcPtpConfigApply.0")
+        if apply in written:
+            self.__store[apply] = (snmp.INTEGER, self.__apply(self.__store[apply][1]))
+        restart = self.mib.resolve("wrpcPtpConfigRestart.0")
+        if restart in written and self.__store[restart][1] == RESTART_PTP:
+            self.node.stop_ptp()
+            self.node.start_ptp()
+            self.__store[restart] = (snmp.INTEGER, RESTART_SUCCESSFUL)
+        return 0, 0
+
+    def __apply(self, action: int) -> int:
+        """Runs a wrpcPtpConfigApply action on the node. Returns the resulting wrpcPtpConfigApply value"""
+        value = lambda obj: self.__store[self.mib.resolve(obj)][1]
+        tx, rx, alpha = value("wrpcPtpConfigDeltaTx.0"), value("wrpcPtpConfigDeltaRx.0"), value("wrpcPtpConfigAlpha.0")
+        if action == APPLY_ERASE:
+            self.node.erase_sfps()
+            return APPLY_SUCCESSFUL
+        if action == APPLY_MEMORY_CURRENT_SFP:
+            entry = self.node.matched_sfp(0)
+            if entry is None:
+                return APPLY_FAILED
+            entry.tx, entry.rx, entry.alpha = tx, rx, alpha
+            return APPLY_SUCCESSFUL
+        if action not in (APPLY_GIVEN_SFP, APPLY_CURRENT_SFP):
+            return APPLY_FAILED
+        pn = value("wrpcPtpConfigSfpPn.0").decode("utf-8", errors="replace").strip() if action == APPLY_GIVEN_SFP \
+            else self.node.sfp_pns[0]
+        if not pn:
+            return APPLY_INVALID_PN
+        self.node.add_sfp(pn, tx, rx, alpha, 0)
+        return APPLY_SUCCESSFUL if self.node.match_sfps().get(0) is not None else APPLY_MATCH_FAILED
+
+class SimSnmpFleet:
+    """Serves any number of agents from one thread, so a fleet of a thousand simulated nodes costs
+    a thousand sockets but a single thread. Responses are delayed without blocking the other agents"""
+
+    def __init__(self, agents: List[SimSnmpAgent]):
+        self.agents = agents
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def hosts(self) -> List[str]:
+        return [x.host for x in self.agents]
+
+    def start(self) -> "SimSnmpFleet":
+        if self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name=f"sim_snmp_fleet_{self.agents[0].host}", daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for agent in self.agents:
+            agent.close()
+
+    def __run(self):
+        replies = [] # heap of (send at, seq, agent, response, address)
+        seq = itertools.count()
+        with selectors.DefaultSelector() as selector:
+            for agent in self.agents:
+                selector.register(agent, selectors.EVENT_READ, agent)
+            while not self.__stop.is_set():
+                timeout = 0.2 if not replies else max(0, min(0.2, replies[0][0] - timer.monotonic()))
+                for key, _ in selector.select(timeout):
+                    agent = key.data
+                    reply = agent.receive()
+                    if reply is None:
+                        continue
+                    if agent.latency:
+                        heapq.heappush(replies, (timer.monotonic() + agent.latency, next(seq), agent) + reply)
+                    else:
+                        agent.send(*reply)
+                while replies and replies[0][0] <= timer.monotonic():
+                    _, _, agent, response, address = heapq.heappop(replies)
+                    agent.send(response, address)
+
+def start_fleet(count: int, port: int = 16161, first_host: str = "127.0.0.2", **agent_args) -> SimSnmpFleet:
+    """Starts `count` agents, each with its own node, on consecutive loopback addresses sharing `port`.
+    Linux routes the whole 127.0.0.0/8 to the loopback, so the fleet needs no network setup there"""
+    first = int.from_bytes(socket.inet_aton(first_host), "big")
+    return SimSnmpFleet([SimSnmpAgent(host=socket.inet_ntoa((first + i).to_bytes(4, "big")), port=port, **agent_args)
+                         for i in range(count)]).start()
@@ -1,150 +1,418 @@
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils import trace as trace_utils
 from .exceptions.node_errors import *
+from . import snmp_engine as snmp
+from . import snmp_mib
+from .snmp_mib import Mib, MibObject
+from .ptp_sync import PtpSyncWaiter, SyncCriterion
 
-# import os
-import subprocess
+import threading
 import time as timer
-from typing import List, Any
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Any, Tuple
+
+TableIndex = Tuple[int, ...]
+TableRow = Dict[str, Any]
 
 
 class SNMP_Connect:
-    def __init__(self, mibs: str, libs: List[str], ip: str, root_script: str, stop_event = None):
+
+    # base SYNTAX -> BER tag used for SET requests
+    __SYNTAX_TAGS = {
+        "INTEGER": snmp.INTEGER,
+        "Integer32": snmp.INTEGER,
+        "Unsigned32": snmp.GAUGE32,
+        "Gauge32": snmp.GAUGE32,
+        "Counter32": snmp.COUNTER32,
+        "Counter64": snmp.COUNTER64,
+        "TimeTicks": snmp.TIMETICKS,
+        "IpAddress": snmp.IP_ADDRESS,
+        "OBJECT IDENTIFIER": snmp.OBJECT_IDENTIFIER,
+        "OCTET STRING": snmp.OCTET_STRING,
+        "DisplayString": snmp.OCTET_STRING,
+        "PhysAddress": snmp.OCTET_STRING,
+    }
+
+    __TYPE_NAMES = {
+        snmp.INTEGER: "INTEGER",
+        snmp.OCTET_STRING: "STRING",
+        snmp.OBJECT_IDENTIFIER: "OID",
+        snmp.IP_ADDRESS: "IpAddress",
+        snmp.COUNTER32: "Counter32",
+        snmp.GAUGE32: "Gauge32",
+        snmp.TIMETICKS: "Timeticks",
+        snmp.OPAQUE: "Opaque",
+        snmp.COUNTER64: "Counter64",
+    }
+
+    __EXCEPTION_TEXTS = {
+        snmp.NO_SUCH_OBJECT: "No Such Object available on this agent at this OID",
+        snmp.NO_SUCH_INSTANCE: "No Such Instance currently exists at this OID",
+        snmp.END_OF_MIB_VIEW: "No more variables left in this MIB View (It is past the end of the MIB tree)",
+    }
+
+    # PDU type -> name of the span timing the request
+    __PDU_SPANS = {
+        snmp.GET_REQUEST: "snmp_get",
+        snmp.GET_BULK_REQUEST: "snmp_getbulk",
+        snmp.SET_REQUEST: "snmp_set",
+    }
+
+    # (ip, table, column, value) -> table index, shared by all connections to the node
+    __row_index_cache: Dict[Tuple[str, str, str, Any], TableIndex] = {}
+    __row_index_cache_lock = threading.Lock()
+
+    def __init__(self, mibs: str, libs: List[str], ip: str, root_script: str, stop_event = None, port: int = 161):
         self.__mibs = mibs
-        self.__libs = ":".join(libs)
+        self.__libs = libs
+        self.__mib_index = None
         self.__ip = ip
-        self.__retries = 1
-        self.__timeout = 1
+        self.__port = port
+        self.__engine = snmp.SnmpEngine(community="public", timeout=1, retries=1)
+        self.__max_repetitions = 25
         self.__was_connected = False
         self.root_script = root_script
         self.stop_event = stop_event
+        self.trace_label = ip
+
+    @property
+    def mib(self) -> Mib:
+        """MIB index, loaded on first use and shared by every connection in the process"""
+        if self.__mib_index is None:
+            self.__mib_index = snmp_mib.load_mibs(self.__mibs, self.__libs)
+        return self.__mib_index
 
     def set_retries(self, count: int):
-        self.__retries = count
+        self.__engine.retries = count
 
     def set_timeout(self, timeout: int):
-        self.__timeout = timeout
+        self.__engine.timeout = timeout
+
+    def set_max_repetitions(self, count: int):
+        """Rows requested per GETBULK PDU by walks"""
+        self.__max_repetitions = max(1, count)
 
     def snmpget(self, obj: str, hide: bool = False) -> str:
-        cmd = [
-            "snmpget",
-            "-c", "public",
-            "-v2c",
-            "-m", self.__mibs,
-            "-M", f"+/var/lib/mibs/ietf:{self.__libs}",
-            "-r", f"{self.__retries}",
-            "-t", f"{self.__timeout}",
-            "-O", "vq",
-            self.__ip,
-            f"{obj}"
-        ]
-        print_utils.print_executable(" ".join(cmd), 2)
-        buf = SNMP_Connect.__run_cmd(cmd).strip("\n ")
-        
-        self.__check_for_error(SnmpCommandCode.GET, obj, buf)
-        self.__was_connected = True
+        oid = self.__resolve(SnmpCommandCode.GET, obj)
+        print_utils.print_executable(f"snmpget {self.__ip} {obj}", 2)
+        varbinds = self.__request(SnmpCommandCode.GET, obj, snmp.GET_REQUEST, [(oid, snmp.NULL, None)])
+
+        buf = self.__format_varbind(varbinds[0], val_only=True)
         if(not hide):
             print_utils.print_info(f"{obj} = {buf}", 2)
         return buf
-    
+
     def snmpwalk(self, obj: str, val_only: bool = False, hide: bool = False) -> str:
         if self.check_stop_event("snmpwalk"):
             return
-        cmd = [
-            "snmpwalk",
-            "-c", "public",
-            "-v2c",
-            "-m", self.__mibs,
-            "-M", f"+/var/lib/mibs/ietf:{self.__libs}",
-            "-r", f"{self.__retries}",
-            "-t", f"{self.__timeout}"
-        ]
-        if (val_only):
-            cmd.extend(["-O", "vq"])
-        cmd.extend([self.__ip, f"{obj}"])
-
-        print_utils.print_executable(" ".join(cmd), 2)
-        buf = SNMP_Connect.__run_cmd(cmd).strip("\n ")
-        
-        self.__check_for_error(SnmpCommandCode.WALK, obj, buf)
-        self.__was_connected = True
+        root = self.__resolve(SnmpCommandCode.WALK, obj)
+        print_utils.print_executable(f"snmpwalk {self.__ip} {obj}", 2)
+
+        lines = [self.__format_varbind(x, val_only) for x in self.__bulk_walk(obj, root)]
+        if not lines: # walk of a leaf instance falls back to GET as net-snmp does
+            varbind = self.__request(SnmpCommandCode.WALK, obj, snmp.GET_REQUEST, [(root, snmp.NULL, None)])[0]
+            lines.append(self.__format_varbind(varbind, val_only))
+
+        buf = "\n".join(lines)
         if(not hide):
             print_utils.print_info(buf, 2)
         return buf
-    
+
     def snmpset(self, obj: str, value: Any, val_only: bool = False, hide: bool = False) -> str:
-        cmd = [
-            "snmpset",
-            "-c", "public",
-            "-v2c",
-            "-m", self.__mibs,
-            "-M", f"+/var/lib/mibs/ietf:{self.__libs}",
-            "-r", f"{self.__retries}",
-            "-t", f"{self.__timeout}",
-        ]
-        if (val_only):
-            cmd.extend(["-O", "vq"])
-        cmd.extend([self.__ip, f"{obj}", "i", f"{value}"])
-        
-        print_utils.print_executable(" ".join(cmd), 2)
-        buf = SNMP_Connect.__run_cmd(cmd).strip("\n ")
-        
-        self.__check_for_error(SnmpCommandCode.SET, obj, buf)
-        self.__was_connected = True
+        oid = self.__resolve(SnmpCommandCode.SET, obj)
+        print_utils.print_executable(f"snmpset {self.__ip} {obj} {value}", 2)
+        varbinds = self.__request(SnmpCommandCode.SET, obj, snmp.SET_REQUEST,
+                                  [(oid,) + self.__encode_set_value(oid, obj, value)])
+
+        buf = self.__format_varbind(varbinds[0], val_only)
         if(not hide):
             print_utils.print_info(buf, 2)
         return buf
 
+    def snmpget_multi(self, objs: List[str], hide: bool = False) -> List[str]:
+        """GETs all objects in a single PDU. Returns values in the order of objs"""
+        oids = [self.__resolve(SnmpCommandCode.GET, obj) for obj in objs]
+        print_utils.print_executable(f"snmpget {self.__ip} {' '.join(objs)}", 2)
+        varbinds = self.__request(SnmpCommandCode.GET, objs, snmp.GET_REQUEST,
+                                  [(oid, snmp.NULL, None) for oid in oids])
+
+        buf = [self.__format_varbind(x, val_only=True) for x in varbinds]
+        if(not hide):
+            for obj, val in zip(objs, buf):
+                print_utils.print_info(f"{obj} = {val}", 2)
+        return buf
+
+    def snmpset_multi(self, values: List[Tuple[str, Any]], val_only: bool = False, hide: bool = False) -> List[str]:
+        """SETs all (object, value) pairs in a single PDU, so the agent applies them together"""
+        objs = [obj for obj, _ in values]
+        varbinds = []
+        for obj, value in values:
+            oid = self.__resolve(SnmpCommandCode.SET, obj)
+            varbinds.append((oid,) + self.__encode_set_value(oid, obj, value))
+        print_utils.print_executable(f"snmpset {self.__ip} " + " ".join(f"{obj} {value}" for obj, value in values), 2)
+        varbinds = self.__request(SnmpCommandCode.SET, objs, snmp.SET_REQUEST, varbinds)
+
+        buf = [self.__format_varbind(x, val_only) for x in varbinds]
+        if(not hide):
+            print_utils.print_info("\n".join(buf), 2)
+        return buf
+
+    def snmpget_values(self, objs: List[str], hide: bool = False) -> List[Any]:
+        """GETs all objects in a single PDU and returns their typed values (int, str, enum label or None)"""
+        oids = [self.__resolve(SnmpCommandCode.GET, obj) for obj in objs]
+        print_utils.print_executable(f"snmpget {self.__ip} {' '.join(objs)}", 2)
+        varbinds = self.__request(SnmpCommandCode.GET, objs, snmp.GET_REQUEST,
+                                  [(oid, snmp.NULL, None) for oid in oids])
+
+        values = [self.__decode_varbind(x)[2] for x in varbinds]
+        if(not hide):
+            for obj, val in zip(objs, values):
+                print_utils.print_info(f"{obj} = {val}", 2)
+        return values
+
+    def iter_table(self, table: str, columns: List[str] = None, max_repetitions: int = None) -> Iterator[Tuple[TableIndex, TableRow]]:
+        """Streams (index, {column: typed value}) rows in index order.
+        Every GETBULK reads up to max_repetitions rows of all columns at once"""
+        cols = self.__table_columns(table, columns)
+        max_repetitions = max_repetitions if max_repetitions is not None else self.__max_repetitions
+        print_utils.print_executable(f"snmpbulkwalk -Cr{max_repetitions} {self.__ip} {table}", 2)
+
+        column_oids = {col.name: col.oid for col in cols}
+        cursors = dict(column_oids)
+        pending: Dict[TableIndex, TableRow] = {}
+        while cursors:
+            if self.check_stop_event("iter_table"):
+                return
+            names = list(cursors)
+            varbinds = self.__request(SnmpCommandCode.WALK, names, snmp.GET_BULK_REQUEST,
+                                      [(cursors[x], snmp.NULL, None) for x in names],
+                                      max_repetitions=max_repetitions)
+            # response repeats the requested columns: row 0 of every column, then row 1, ...
+            for i, varbind in enumerate(varbinds):
+                name = names[i % len(names)]
+                if name not in cursors:
+                    continue
+                oid, tag, _ = varbind
+                if tag in snmp.EXCEPTION_TAGS or oid[:len(column_oids[name])] != column_oids[name]:
+                    del cursors[name] # column is over
+                    continue
+                if oid <= cursors[name]: # the frontier would never move
+                    raise SNMP_Connect.__no_progress(name, cursors[name])
+                _, index, value = self.__decode_varbind(varbind)
+                pending.setdefault(index, {})[name] = value
+                cursors[name] = oid
+
+            # a row is complete once every still walked column has moved past its index
+            frontier = min((cursors[x][len(column_oids[x]):] for x in cursors), default=None)
+            for index in sorted(pending):
+                if frontier is not None and index > frontier:
+                    break
+                yield index, pending.pop(index)
+
+    def snmptable(self, table: str, columns: List[str] = None, hide: bool = True) -> Dict[TableIndex, TableRow]:
+        """Reads the whole table. Returns {index: {column: typed value}}"""
+        if self.check_stop_event("snmptable"):
+            return {}
+        rows = dict(self.iter_table(table, columns))
+
+        if(not hide):
+            for index, row in rows.items():
+                print_utils.print_info(f"{table}.{SNMP_Connect.index_to_str(index)}: {row}", 2)
+        return rows
+
+    def find_table_row(self, table: str, column: str, value: Any, columns: List[str] = None) -> Tuple[TableIndex, TableRow] | None:
+        """Walks the table for the row whose column equals value and remembers its index for this node"""
+        rows = self.snmptable(table, columns)
+        for index, row in rows.items():
+            if SNMP_Connect.__values_equal(row.get(column), value):
+                with SNMP_Connect.__row_index_cache_lock:
+                    SNMP_Connect.__row_index_cache[(self.__ip, table, column, value)] = index
+                return index, row
+        self.forget_table_row(table, column, value)
+        return None
+
+    def cached_table_row(self, table: str, column: str, value: Any) -> TableIndex | None:
+        """Index found by an earlier find_table_row on this node. Callers must verify it is still valid"""
+        with SNMP_Connect.__row_index_cache_lock:
+            return SNMP_Connect.__row_index_cache.get((self.__ip, table, column, value))
+
+    def forget_table_row(self, table: str, column: str, value: Any):
+        with SNMP_Connect.__row_index_cache_lock:
+            SNMP_Connect.__row_index_cache.pop((self.__ip, table, column, value), None)
+
+    def index_to_str(index: TableIndex) -> str:
+        return ".".join(str(x) for x in index)
+
+    def __values_equal(a: Any, b: Any) -> bool:
+        if isinstance(a, str) and isinstance(b, str): # agents pad DisplayStrings like SFP PNs
+            return a.strip() == b.strip()
+        return a == b
+
+    @trace_utils.traced_method(trace_utils.SNMP)
     def ptp_resync(self, timeout: int = 60) -> bool:
         if self.check_stop_event("ptp_resync"):
             return
-        self.snmpset("wrpcPtpConfigRestart.0", "restartPtp")
         if timeout == 0:
+            self.snmpset("wrpcPtpConfigRestart.0", "restartPtp")
+            return True
+        is_synced = self.ptp_resync_async(timeout).result()
+        if self.check_stop_event("ptp_resync"):
+            return False
+        if is_synced:
             return True
-        res = []
-        timer_secs = range(timeout-1, -1, -1)
-        for sec in print_utils.timer_bar(
-                timer_secs,
-                prefix="Timeout:",
-                suffix="left",
-                length=100):
-            if self.check_stop_event("ptp_resync"):
-                return False
-            res.append(self.snmpget("wrpcPtpServoStateN.0", hide=True))
-            if sec % 4 == 0:
-                print_utils.print_info(res, 2)
-                if (len(list(filter(lambda x: ("trackPhase" in x), res))) >= 3):
-                    return True
-                res = []
-            timer.sleep(1)
 
         raise NodeSyncTimeoutError(f"Synchronisation timeout ({timeout} sec) reached. Script discontinued")
 
-    def __check_for_error(self, stage: SnmpCommandCode, obj: str, *buf: str):
-        # print_utils.print_info(obj, 1)
-        # print_utils.print_info(buf, 1)
-        if ("Timeout" in "".join(buf)): # Could not connect
+    def ptp_resync_async(self, timeout: int = 60, criterion: SyncCriterion = None) -> Future:
+        """Restarts PTP and hands the node to the shared sync waiter.
+        The future resolves to True on stable lock, False on timeout or stop event"""
+        self.snmpset("wrpcPtpConfigRestart.0", "restartPtp")
+        sync_wait = PtpSyncWaiter.shared(self.mib).watch(self.__ip, timeout, self.stop_event, self.__port, criterion)
+        if trace_utils.is_tracing_on(): # the lock is awaited elsewhere: time it from the restart to the resolution
+            started_at, ip = timer.perf_counter(), self.__ip
+            sync_wait.add_done_callback(lambda x: trace_utils.tracer.record(
+                "ptp_lock_wait", trace_utils.SNMP, ip, started_at, timer.perf_counter() - started_at))
+        return sync_wait
+
+    def __request(self, stage: SnmpCommandCode, obj: str | List[str], pdu_type: int, varbinds: List[snmp.VarBind],
+                  max_repetitions: int = 0) -> List[snmp.VarBind]:
+        try:
+            with cancel_utils.on_cancel(self.stop_event, self.__engine.abort), \
+                 trace_utils.span(SNMP_Connect.__PDU_SPANS.get(pdu_type, "snmp_request"), trace_utils.SNMP, self.__ip):
+                error_status, error_index, response = self.__engine.request(self.__ip, pdu_type, varbinds, port=self.__port,
+                                                                            max_repetitions=max_repetitions,
+                                                                            is_cancelled=lambda: cancel_utils.is_cancelled(self.stop_event))
+        except InterruptedError as ex: # stop event set while waiting for the node
+            raise NodeConnectError(stage, ScriptRunStatusesEnum.TERMINATED, str(ex))
+        except TimeoutError as ex:
             if self.__was_connected:
-                raise NodeConnectError(stage, ScriptRunStatusesEnum.CONNECTION_LOSS, buf)
+                raise NodeConnectError(stage, ScriptRunStatusesEnum.CONNECTION_LOSS, str(ex))
             else:
-                raise NodeConnectError(stage, ScriptRunStatusesEnum.DESTINATION_UNREACHABLE, buf)
-        if ("Unknown Object Identifier" in "".join(buf)): #  Unknown Object Identifier (Sub-id not found: (top) -> wrpcSfpTy)
-            raise NodeValueError(stage, ScriptRunStatusesEnum.UNKNOWN_MIB_OBJECT, obj, buf)
-        if ("Error" in "".join(buf)): # I don't remember :(
-            raise NodeValueError(stage, ScriptRunStatusesEnum.UNKNOWN_ERROR, obj, buf)
-        return False
+                raise NodeConnectError(stage, ScriptRunStatusesEnum.DESTINATION_UNREACHABLE, str(ex))
+        self.__was_connected = True
+        if error_status != 0:
+            if isinstance(obj, list): # error-index points to the failed varbind
+                obj = obj[error_index - 1] if 0 < error_index <= len(obj) else ", ".join(obj)
+            reason = snmp.ERROR_STATUSES[error_status] if error_status < len(snmp.ERROR_STATUSES) else error_status
+            raise NodeValueError(stage, ScriptRunStatusesEnum.UNKNOWN_ERROR, obj,
+                                 f"Error in packet. Reason: {reason} (index {error_index})")
+        if not response:
+            raise NodeValueError(stage, ScriptRunStatusesEnum.UNKNOWN_ERROR, obj, "Error: empty response")
+        return response
+
+    def __resolve(self, stage: SnmpCommandCode, obj: str) -> snmp.Oid:
+        try:
+            oid = self.mib.resolve(obj)
+        except ValueError:
+            oid = None
+        if oid is None:
+            raise NodeValueError(stage, ScriptRunStatusesEnum.UNKNOWN_MIB_OBJECT, obj,
+                                 f"Unknown Object Identifier ({obj})")
+        return oid
+
+    def __encode_set_value(self, oid: snmp.Oid, obj: str, value: Any) -> Tuple[int, Any]:
+        mib_obj, _ = self.mib.lookup(oid)
+        if mib_obj is None or mib_obj.syntax is None:
+            return (snmp.INTEGER, int(value))
+        tag = SNMP_Connect.__SYNTAX_TAGS.get(mib_obj.syntax, snmp.INTEGER)
+        if tag == snmp.INTEGER and str(value) in mib_obj.enums:
+            return (tag, mib_obj.enums[str(value)])
+        if tag in (snmp.INTEGER,) + snmp.UNSIGNED_TAGS:
+            try:
+                return (tag, int(value))
+            except ValueError:
+                raise NodeValueError(SnmpCommandCode.SET, ScriptRunStatusesEnum.UNKNOWN_ERROR, obj,
+                                     f"Error: value '{value}' is not valid for {mib_obj.syntax}")
+        return (tag, value)
+
+    def __bulk_walk(self, obj: str, root: snmp.Oid) -> Iterator[snmp.VarBind]:
+        oid = root
+        while True:
+            if self.check_stop_event("snmpwalk"):
+                return
+            varbinds = self.__request(SnmpCommandCode.WALK, obj, snmp.GET_BULK_REQUEST, [(oid, snmp.NULL, None)],
+                                      max_repetitions=self.__max_repetitions)
+            for varbind in varbinds:
+                previous_oid = oid
+                oid, tag, _ = varbind
+                if tag in snmp.EXCEPTION_TAGS or oid[:len(root)] != root:
+                    return
+                if oid <= previous_oid: # a broken agent would have the walk request the same OIDs forever
+                    raise SNMP_Connect.__no_progress(obj, previous_oid)
+                yield varbind
+
+    def __no_progress(obj: str, oid: snmp.Oid) -> NodeValueError:
+        return NodeValueError(SnmpCommandCode.WALK, ScriptRunStatusesEnum.UNKNOWN_ERROR, obj,
+                              f"Error: OID not increasing after {'.'.join(str(x) for x in oid)}")
+
+    def __table_columns(self, table: str, columns: List[str] | None) -> List[MibObject]:
+        cols = self.mib.table_columns(table)
+        if columns is not None:
+            cols = [x for x in cols if x.name in columns]
+        if not cols:
+            raise NodeValueError(SnmpCommandCode.WALK, ScriptRunStatusesEnum.UNKNOWN_MIB_OBJECT, table,
+                                 f"Unknown Object Identifier ({table} is not a table)")
+        return cols
+
+    def __decode_varbind(self, varbind: snmp.VarBind) -> Tuple[MibObject | None, TableIndex, Any]:
+        """Returns (MIB object, index suffix, typed value)"""
+        oid, tag, value = varbind
+        mib_obj, suffix = self.mib.lookup(oid)
+        if tag in snmp.EXCEPTION_TAGS:
+            value = None
+        elif tag == snmp.INTEGER and mib_obj is not None and value in mib_obj.enum_labels:
+            value = mib_obj.enum_labels[value]
+        elif tag == snmp.OCTET_STRING:
+            text = value.decode("utf-8", errors="replace")
+            value = text if text.isprintable() else value
+        return mib_obj, suffix, value
+
+    def __format_varbind(self, varbind: snmp.VarBind, val_only: bool = False) -> str:
+        oid, tag, value = varbind
+        mib_obj, suffix = self.mib.lookup(oid)
+        if tag in SNMP_Connect.__EXCEPTION_TEXTS:
+            text = SNMP_Connect.__EXCEPTION_TEXTS[tag]
+        else:
+            text = SNMP_Connect.__format_value(mib_obj, tag, value, val_only)
+        if val_only:
+            return text
+
+        if mib_obj is not None:
+            name = f"{mib_obj.module}::{mib_obj.name}" + "".join(f".{x}" for x in suffix)
+        else:
+            name = "." + ".".join(str(x) for x in oid)
+        return f"{name} = {text}"
+
+    def __format_value(mib_obj: MibObject | None, tag: int, value: Any, val_only: bool) -> str:
+        enum_labels = mib_obj.enum_labels if mib_obj is not None else {}
+        if tag == snmp.INTEGER and value in enum_labels:
+            text = enum_labels[value] if val_only else f"{enum_labels[value]}({value})"
+        elif tag == snmp.OCTET_STRING:
+            text = value.decode("utf-8", errors="replace")
+            if not text.isprintable():
+                text = " ".join(f"{b:02X}" for b in value)
+            elif mib_obj is None or mib_obj.syntax != "DisplayString":
+                text = f"\"{text}\""
+        elif tag == snmp.OBJECT_IDENTIFIER:
+            text = "." + ".".join(str(x) for x in value)
+        elif tag == snmp.TIMETICKS and not val_only:
+            secs, centis = divmod(value, 100)
+            mins, secs = divmod(secs, 60)
+            hours, mins = divmod(mins, 60)
+            text = f"({value}) {hours}:{mins:02}:{secs:02}.{centis:02}"
+        else:
+            text = f"{value}"
+        if val_only:
+            return text
+        return f"{SNMP_Connect.__TYPE_NAMES.get(tag, 'Wrong Type')}: {text}"
 
-    def __run_cmd(cmd: List[str]) -> str:
-        p = subprocess.Popen(cmd, text = True,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT)
-        return p.communicate()[0]
-    
     def close(self):
-        pass
+        self.__engine.close()
 
     def check_stop_event(self, func):
-        if self.stop_event.is_set():
-            print_utils.print_thread_terminated(self.script, func)
+        if cancel_utils.is_cancelled(self.stop_event):
+            print_utils.print_thread_terminated(self.root_script, func)
             self.close()
             return True
-        return False
\ No newline at end of file
+        return False
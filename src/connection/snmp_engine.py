@@ -0,0 +1,267 @@
+import random
+import socket
+import select
+import time as timer
+from typing import Any, Callable, List, Tuple
+
+# ASN.1 / SNMP tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+# PDU types
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+GET_RESPONSE = 0xA2
+SET_REQUEST = 0xA3
+GET_BULK_REQUEST = 0xA5
+
+SNMP_VERSION_2C = 1
+
+ERROR_STATUSES = [
+    "noError", "tooBig", "noSuchName", "badValue", "readOnly", "genErr",
+    "noAccess", "wrongType", "wrongLength", "wrongEncoding", "wrongValue",
+    "noCreation", "inconsistentValue", "resourceUnavailable", "commitFailed",
+    "undoFailed", "authorizationError", "notWritable", "inconsistentName"
+]
+
+UNSIGNED_TAGS = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+EXCEPTION_TAGS = (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW)
+
+Oid = Tuple[int, ...]
+VarBind = Tuple[Oid, int, Any] # (oid, tag, value)
+
+class SnmpDecodeError(ValueError):
+    pass
+
+# ----------- BER encoding -----------
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    buf = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(buf)]) + buf
+
+def encode_tlv(tag: int, content: bytes) -> bytes:
+    return bytes([tag]) + encode_length(len(content)) + content
+
+def encode_integer(value: int, tag: int = INTEGER) -> bytes:
+    if tag in UNSIGNED_TAGS:
+        # unsigned values still use two's complement, so keep the sign bit clear
+        content = value.to_bytes(value.bit_length() // 8 + 1, "big")
+    else:
+        content = value.to_bytes((value + (value < 0)).bit_length() // 8 + 1, "big", signed=True)
+    return encode_tlv(tag, content)
+
+def encode_oid(oid: Oid) -> bytes:
+    if len(oid) < 2:
+        raise ValueError(f"OID {oid} is too short")
+    content = bytearray([oid[0] * 40 + oid[1]])
+    for sub_id in oid[2:]:
+        chunk = [sub_id & 0x7F]
+        sub_id >>= 7
+        while sub_id:
+            chunk.append(0x80 | (sub_id & 0x7F))
+            sub_id >>= 7
+        content.extend(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(content))
+
+def encode_value(tag: int, value: Any) -> bytes:
+    if tag in (INTEGER,) + UNSIGNED_TAGS:
+        return encode_integer(int(value), tag)
+    if tag in (OCTET_STRING, OPAQUE):
+        return encode_tlv(tag, value if isinstance(value, bytes) else str(value).encode("utf-8"))
+    if tag == IP_ADDRESS:
+        return encode_tlv(tag, socket.inet_aton(value) if isinstance(value, str) else bytes(value))
+    if tag == OBJECT_IDENTIFIER:
+        return encode_oid(value)
+    if tag in (NULL,) + EXCEPTION_TAGS:
+        return encode_tlv(tag, b"")
+    raise ValueError(f"Unsupported value tag 0x{tag:02X}")
+
+def encode_message(community: str, pdu_type: int, request_id: int, varbinds: List[Tuple[Oid, int, Any]],
+                   non_repeaters: int = 0, max_repetitions: int = 0) -> bytes:
+    varbinds_buf = b"".join(
+        encode_tlv(SEQUENCE, encode_oid(oid) + encode_value(tag, value)) for oid, tag, value in varbinds)
+    pdu = encode_integer(request_id) + \
+          encode_integer(non_repeaters) + \
+          encode_integer(max_repetitions) + \
+          encode_tlv(SEQUENCE, varbinds_buf)
+    return encode_tlv(SEQUENCE,
+                      encode_integer(SNMP_VERSION_2C) +
+                      encode_tlv(OCTET_STRING, community.encode("utf-8")) +
+                      encode_tlv(pdu_type, pdu))
+
+# ----------- BER decoding -----------
+
+def decode_tlv(data: bytes, pos: int = 0) -> Tuple[int, bytes, int]:
+    """Returns (tag, content, position after the TLV)"""
+    try:
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(data[pos:pos + size], "big")
+            pos += size
+    except IndexError:
+        raise SnmpDecodeError("Truncated BER header")
+    if pos + length > len(data):
+        raise SnmpDecodeError("Truncated BER content")
+    return tag, data[pos:pos + length], pos + length
+
+def decode_oid(content: bytes) -> Oid:
+    if not content:
+        return ()
+    oid = list(divmod(content[0], 40)) if content[0] < 80 else [2, content[0] - 80]
+    sub_id = 0
+    for byte in content[1:]:
+        sub_id = (sub_id << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            oid.append(sub_id)
+            sub_id = 0
+    return tuple(oid)
+
+def decode_value(tag: int, content: bytes) -> Any:
+    if tag == INTEGER:
+        return int.from_bytes(content, "big", signed=True)
+    if tag in UNSIGNED_TAGS:
+        return int.from_bytes(content, "big", signed=False)
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(content)
+    if tag == IP_ADDRESS:
+        return ".".join(str(b) for b in content)
+    if tag in (NULL,) + EXCEPTION_TAGS:
+        return None
+    return bytes(content)
+
+def decode_message(data: bytes) -> Tuple[int, int, int, int, List[VarBind]]:
+    """Returns (pdu_type, request_id, error_status, error_index, varbinds)"""
+    tag, message, _ = decode_tlv(data)
+    if tag != SEQUENCE:
+        raise SnmpDecodeError("SNMP message is not a SEQUENCE")
+    _, _, pos = decode_tlv(message)             # version
+    _, _, pos = decode_tlv(message, pos)        # community
+    pdu_type, pdu, _ = decode_tlv(message, pos)
+
+    _, request_id, pos = decode_tlv(pdu)
+    _, error_status, pos = decode_tlv(pdu, pos)
+    _, error_index, pos = decode_tlv(pdu, pos)
+    _, varbinds_buf, _ = decode_tlv(pdu, pos)
+
+    varbinds = []
+    pos = 0
+    while pos < len(varbinds_buf):
+        _, varbind, pos = decode_tlv(varbinds_buf, pos)
+        _, oid, value_pos = decode_tlv(varbind)
+        value_tag, value, _ = decode_tlv(varbind, value_pos)
+        varbinds.append((decode_oid(oid), value_tag, decode_value(value_tag, value)))
+
+    return (pdu_type,
+            int.from_bytes(request_id, "big", signed=True),
+            int.from_bytes(error_status, "big", signed=True),
+            int.from_bytes(error_index, "big", signed=True),
+            varbinds)
+
+# ----------- Transport -----------
+
+class SnmpEngine:
+    """SNMPv2c client keeping one UDP socket open for all requests.
+    abort() makes a receive() blocked in another thread raise InterruptedError at once"""
+
+    __MAX_DATAGRAM = 65535
+
+    def __init__(self, community: str = "public", timeout: float = 1, retries: int = 1):
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.setblocking(False)
+        self.__wake_reader, self.__wake_writer = socket.socketpair()
+        self.__wake_reader.setblocking(False)
+        self.__request_id = random.randrange(1, 2 ** 30)
+
+    def fileno(self) -> int:
+        return self.__sock.fileno()
+
+    def next_request_id(self) -> int:
+        self.__request_id = self.__request_id % (2 ** 31 - 1) + 1
+        return self.__request_id
+
+    def send(self, host: str, port: int, pdu_type: int, varbinds: List[Tuple[Oid, int, Any]],
+             non_repeaters: int = 0, max_repetitions: int = 0, request_id: int = None) -> int:
+        if request_id is None:
+            request_id = self.next_request_id()
+        self.__sock.sendto(
+            encode_message(self.community, pdu_type, request_id, varbinds, non_repeaters, max_repetitions),
+            (host, port))
+        return request_id
+
+    def receive(self, timeout: float = 0) -> Tuple[Tuple[str, int], int, int, int, List[VarBind]] | None:
+        """Returns (address, request_id, error_status, error_index, varbinds) or None if nothing arrived in time"""
+        deadline = timer.monotonic() + timeout
+        while True:
+            ready, _, _ = select.select([self.__sock, self.__wake_reader], [], [], max(0, deadline - timer.monotonic()))
+            if not ready:
+                return None
+            if self.__wake_reader in ready:
+                self.__drain_wakeups()
+                raise InterruptedError("SNMP request aborted")
+            try:
+                data, address = self.__sock.recvfrom(SnmpEngine.__MAX_DATAGRAM)
+                pdu_type, request_id, error_status, error_index, varbinds = decode_message(data)
+            except (BlockingIOError, ConnectionRefusedError, SnmpDecodeError):
+                continue
+            if pdu_type == GET_RESPONSE:
+                return address, request_id, error_status, error_index, varbinds
+
+    def request(self, host: str, pdu_type: int, varbinds: List[Tuple[Oid, int, Any]], port: int = 161,
+                non_repeaters: int = 0, max_repetitions: int = 0,
+                is_cancelled: Callable[[], bool] = None) -> Tuple[int, int, List[VarBind]]:
+        """Sends the PDU and waits for the matching response. Returns (error_status, error_index, varbinds).
+        `is_cancelled` is checked before every send, after the wakeups of earlier requests are dropped:
+        an abort() that came before the request and was drained with them still stops it"""
+        request_id = self.next_request_id()
+        self.__drain_wakeups() # an abort meant for an earlier request
+        for _ in range(self.retries + 1):
+            if is_cancelled is not None and is_cancelled():
+                raise InterruptedError("SNMP request aborted")
+            self.send(host, port, pdu_type, varbinds, non_repeaters, max_repetitions, request_id)
+            deadline = timer.monotonic() + self.timeout
+            while (left := deadline - timer.monotonic()) > 0:
+                response = self.receive(left)
+                if response is None:
+                    break
+                _, response_id, error_status, error_index, response_varbinds = response
+                if response_id == request_id:
+                    return error_status, error_index, response_varbinds
+        raise TimeoutError(f"Timeout: No Response from {host}:{port}")
+
+    def abort(self):
+        try:
+            self.__wake_writer.send(b"\0")
+        except OSError: # closed or already full of wakeups
+            pass
+
+    def __drain_wakeups(self):
+        try:
+            while self.__wake_reader.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        self.__sock.close()
+        self.__wake_reader.close()
+        self.__wake_writer.close()
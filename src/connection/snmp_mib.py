@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+Oid = Tuple[int, ...]
+
+INDEX_FILE_SUFFIX = ".index.json"
+INDEX_FORMAT_VERSION = 1
+
+__TOKEN_RE = re.compile(r'"[^"]*"|--[^\n]*|::=|\.\.|[A-Za-z](?:\w|-(?!-))*|-?\d+|\S')
+
+# Nodes every SMIv2 module builds upon
+WELL_KNOWN_OIDS = {
+    "iso":          (1,),
+    "org":          (1, 3),
+    "dod":          (1, 3, 6),
+    "internet":     (1, 3, 6, 1),
+    "directory":    (1, 3, 6, 1, 1),
+    "mgmt":         (1, 3, 6, 1, 2),
+    "mib-2":        (1, 3, 6, 1, 2, 1),
+    "system":       (1, 3, 6, 1, 2, 1, 1),
+    "experimental": (1, 3, 6, 1, 3),
+    "private":      (1, 3, 6, 1, 4),
+    "enterprises":  (1, 3, 6, 1, 4, 1),
+    "snmpV2":       (1, 3, 6, 1, 6),
+}
+
+__NODE_MACROS = ("OBJECT-TYPE", "MODULE-IDENTITY", "OBJECT-IDENTITY", "NOTIFICATION-TYPE",
+                 "OBJECT-GROUP", "NOTIFICATION-GROUP", "MODULE-COMPLIANCE")
+
+__loaded_mibs: Dict[Tuple[str, ...], "Mib"] = {}
+__loaded_mibs_lock = threading.Lock()
+
+class MibObject:
+    def __init__(self, module: str, name: str, oid: Oid, syntax: str | None = None,
+                 enums: Dict[str, int] = None, index: List[str] = None):
+        self.module = module
+        self.name = name
+        self.oid = oid
+        self.syntax = syntax
+        self.enums = enums if enums is not None else {}
+        self.enum_labels = {v: k for k, v in self.enums.items()}
+        self.index = index if index is not None else []
+
+class Mib:
+    """Name <-> OID/type/enum index over one or more compiled MIB modules"""
+
+    def __init__(self, compiled_modules: List[dict]):
+        self.modules = [x["module"] for x in compiled_modules]
+        self.module = self.modules[0] if self.modules else ""
+        self.objects: Dict[str, MibObject] = {}
+        self.__by_oid: Dict[Oid, MibObject] = {}
+        self.__columns: Dict[Oid, List[MibObject]] = {}
+        for compiled in compiled_modules:
+            for name, (oid, syntax, enums, index) in compiled["objects"].items():
+                obj = MibObject(compiled["module"], name, tuple(oid), syntax, enums, index)
+                self.objects[name] = obj
+                self.__by_oid[obj.oid] = obj
+
+    def resolve(self, obj: str) -> Oid | None:
+        """Resolves 'name.1.2', 'MODULE::name.1' or '.1.3.6...' to an OID"""
+        obj = obj.split("::")[-1].strip()
+        if obj.startswith(".") or obj[:1].isdigit():
+            return tuple(int(x) for x in obj.strip(".").split("."))
+        name, _, suffix = obj.partition(".")
+        if name in self.objects:
+            base = self.objects[name].oid
+        elif name in WELL_KNOWN_OIDS:
+            base = WELL_KNOWN_OIDS[name]
+        else:
+            return None
+        return base + tuple(int(x) for x in suffix.split(".") if x != "")
+
+    def lookup(self, oid: Oid) -> Tuple[MibObject | None, Oid]:
+        """Returns the deepest known object covering the OID and the remaining index suffix"""
+        for i in range(len(oid), 0, -1):
+            obj = self.__by_oid.get(oid[:i])
+            if obj is not None:
+                return obj, oid[i:]
+        return None, oid
+
+    def table_columns(self, table: str) -> List[MibObject]:
+        """Returns the columns of a conceptual table (or of its entry) ordered by OID"""
+        obj = self.objects.get(table)
+        if obj is None:
+            return []
+        entry_oid = obj.oid if obj.index else obj.oid + (1,)
+        if entry_oid not in self.__columns:
+            self.__columns[entry_oid] = sorted(
+                (x for x in self.objects.values() if x.oid[:-1] == entry_oid), key=lambda x: x.oid)
+        return self.__columns[entry_oid]
+
+    def enum_value(self, name: str, label: str) -> int | None:
+        obj = self.objects.get(name)
+        return obj.enums.get(label) if obj is not None else None
+
+    def enum_label(self, name: str, value: int) -> str | None:
+        obj = self.objects.get(name)
+        return obj.enum_labels.get(value) if obj is not None else None
+
+def find_mib_file(mib: str, dirs: List[str]) -> str:
+    for lib in dirs:
+        for file_name in (mib, f"{mib}.txt", f"{mib}.mib"):
+            path = os.path.join(lib, file_name)
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+    raise FileNotFoundError(f"MIB {mib} is not found in {dirs}")
+
+def load_mibs(mibs: str, dirs: List[str]) -> Mib:
+    """Returns the index of ':'-separated MIB modules. Indexes are built once per process"""
+    paths = tuple(find_mib_file(x, dirs) for x in mibs.split(":") if x != "")
+    with __loaded_mibs_lock:
+        if paths not in __loaded_mibs:
+            __loaded_mibs[paths] = Mib([load_compiled_mib(x) for x in paths])
+        return __loaded_mibs[paths]
+
+def load_compiled_mib(path: str) -> dict:
+    """Loads the persisted index of the MIB source, recompiling it when the source hash changed"""
+    with open(path, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    index_path = os.path.splitext(path)[0] + INDEX_FILE_SUFFIX
+    try:
+        with open(index_path, "r") as f:
+            compiled = json.load(f)
+        if compiled.get("version") == INDEX_FORMAT_VERSION and compiled.get("sha256") == sha256:
+            return compiled
+    except (OSError, ValueError):
+        pass
+
+    compiled = compile_mib(path)
+    compiled["sha256"] = sha256
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(compiled, f, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+    except OSError: # read-only MIB folder: keep the index in memory only
+        pass
+    return compiled
+
+def compile_mib(path: str) -> dict:
+    """Parses the SMIv2 source into {"module", "objects": {name: [oid, syntax, enums, index]}}"""
+    with open(path, "r") as f:
+        text = f.read()
+    module = text.split("DEFINITIONS", 1)[0].strip()
+    nodes, conventions = _parse(_tokenize(text))
+
+    objects = {}
+    for name, (parent, sub_ids, syntax, enums, index) in nodes.items():
+        oid = _resolve_oid(name, nodes)
+        if oid is None:
+            continue
+        if syntax in conventions: # resolve TEXTUAL-CONVENTION to its base type
+            syntax, tc_enums = conventions[syntax]
+            enums = enums or tc_enums
+        objects[name] = [list(oid), syntax, enums, index]
+    return {"version": INDEX_FORMAT_VERSION, "module": module, "objects": objects}
+
+def _resolve_oid(name: str, nodes: Dict[str, tuple], depth: int = 0) -> Oid | None:
+    if name in WELL_KNOWN_OIDS:
+        return WELL_KNOWN_OIDS[name]
+    if name not in nodes or depth > 64:
+        return None
+    parent, sub_ids = nodes[name][:2]
+    base = _resolve_oid(parent, nodes, depth + 1)
+    return None if base is None else base + sub_ids
+
+def _tokenize(text: str) -> List[str]:
+    return [t for t in __TOKEN_RE.findall(text) if not t.startswith("--") and not t.startswith('"')]
+
+def _parse(tokens: List[str]) -> Tuple[Dict[str, tuple], Dict[str, tuple]]:
+    """Returns ({name: (parent, sub_ids, syntax, enums, index)}, {convention: (syntax, enums)})"""
+    nodes = {}
+    conventions = {}
+    i = 0
+    while i < len(tokens) - 2:
+        name = tokens[i]
+        if name[0].isupper() and tokens[i + 1] == "::=" and tokens[i + 2] == "TEXTUAL-CONVENTION":
+            i += 3
+            while i < len(tokens) and tokens[i] != "SYNTAX":
+                i += 1
+            syntax, enums, i = _parse_syntax(tokens, i + 1)
+            conventions[name] = (syntax, enums)
+            continue
+
+        is_node = name[0].islower() and (
+            tokens[i + 1] in __NODE_MACROS or
+            (tokens[i + 1] == "OBJECT" and tokens[i + 2] == "IDENTIFIER"))
+        if not is_node:
+            i += 1
+            continue
+
+        syntax, enums, index = None, {}, []
+        i += 1
+        while i < len(tokens) and tokens[i] != "::=":
+            if tokens[i] == "SYNTAX":
+                syntax, enums, i = _parse_syntax(tokens, i + 1)
+            elif tokens[i] in ("INDEX", "AUGMENTS") and tokens[i + 1] == "{":
+                i += 2
+                while tokens[i] != "}":
+                    if tokens[i] not in (",", "IMPLIED"):
+                        index.append(tokens[i])
+                    i += 1
+            else:
+                i += 1
+        # ::= { parent sub_id ... }
+        value = []
+        i += 2
+        while i < len(tokens) and tokens[i] != "}":
+            value.append(tokens[i])
+            i += 1
+        sub_ids = tuple(int(x) for x in re.findall(r"\d+", " ".join(value[1:])))
+        if value and not value[0].isdigit():
+            nodes[name] = (value[0], sub_ids, syntax, enums, index)
+    return nodes, conventions
+
+def _parse_syntax(tokens: List[str], i: int) -> Tuple[str, Dict[str, int], int]:
+    """Parses a SYNTAX clause value. Returns (base type, enums, position after the clause)"""
+    if tokens[i] == "SEQUENCE" and tokens[i + 1] == "OF":
+        syntax = "SEQUENCE OF"
+        i += 3
+    elif tokens[i] in ("OCTET", "OBJECT"):
+        syntax = f"{tokens[i]} {tokens[i + 1]}"
+        i += 2
+    else:
+        syntax = tokens[i]
+        i += 1
+    enums = {}
+    if i < len(tokens) and tokens[i] == "{":
+        i += 1
+        while tokens[i] != "}":
+            if tokens[i + 1] == "(":
+                enums[tokens[i]] = int(tokens[i + 2])
+                i += 4
+            else:
+                i += 1
+        i += 1
+    # skip constraints like (SIZE (0..31))
+    depth = 0
+    while i < len(tokens) and (tokens[i] == "(" or depth > 0):
+        depth += {"(": 1, ")": -1}.get(tokens[i], 0)
+        i += 1
+    return syntax, enums, i
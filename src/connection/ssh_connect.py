@@ -1,19 +1,46 @@
 from .connection import Connection as Con
+from .line_reader import LineReader
+from .stat_parser import StatParser
+from .ssh_pool import SshPool
+from .tty_agent_client import TtyAgentClient
+from . import tty_agent
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
 
 from typing import Tuple, Any, List
-from fabric import Connection, Config
-import time as timer
+from fabric import Connection
+import hashlib
+import io
+import socket
+
+# how SSH_Connect reaches the node tty on the host
+TTY_EXEC = "exec"   # separate remote exec per command and per read
+TTY_RELAY = "relay" # one channel relaying the raw tty through sh/cat
+TTY_AGENT = "agent" # one channel to the uploaded tty_agent speaking a framed protocol
 
 class SSH_Connect(Con):
 
-    def __init__(self, host_name: str, connect_pwd: str, host_root_pwd: str, root: str, stop_event = None, tty_usb_port: int = 0):
+    # relays the tty over the stdin/stdout of one SSH channel; the reader is killed when the channel closes
+    __TTY_RELAY = "stty -F {tty} 115200 raw -echo -echoe -echok -echoctl -echoke && " \
+                  "{{ cat {tty} & R=$!; trap 'kill $R' EXIT HUP INT TERM; cat > {tty}; }}"
+
+    def __init__(self, host_name: str, connect_pwd: str, host_root_pwd: str, root: str, stop_event = None, tty_usb_port: int = 0,
+                 tty_mode: str = TTY_RELAY):
+        """`tty_mode` is one of TTY_EXEC, TTY_RELAY or TTY_AGENT. The last two stream node output live
+        over one long-lived channel; TTY_AGENT needs python3 on the host"""
         super().__init__(root, stop_event)
+        self.trace_label = f"{host_name}:ttyUSB{tty_usb_port}"
         self.__c = None
         self.__HOST_NAME = host_name
         self.__CONNECT_PWD = connect_pwd
         self.__HOST_ROOT_PWD = host_root_pwd
         self.__TTY_USB__ = f"/dev/ttyUSB{tty_usb_port}"
+        if tty_mode not in (TTY_EXEC, TTY_RELAY, TTY_AGENT):
+            raise ValueError(f"Unknown tty mode: {tty_mode}")
+        self.__tty_mode = tty_mode
+        self.__tty_channel = None
+        self.__agent = None
+        self.__reader = LineReader(self.__read_tty_channel, name=f"ssh_ttyUSB{tty_usb_port}_reader")
         self.__tryNewSSHConnection()
 
     def setup_connection(self) -> None:
@@ -41,6 +68,8 @@ class SSH_Connect(Con):
     def resync_ptp_node(self) -> None:
         if self.check_stop_event("resync_ptp_node"):
             return
+        if self.__tty_mode != TTY_EXEC:
+            return self.__resync_ptp_node_live()
         self.__tryNewSSHConnection()
         result = self.run_host(f"stty -F {self.__TTY_USB__} 115200 raw -echo -echoe -echok -echoctl -echoke", hide=True)
 
@@ -51,7 +80,7 @@ class SSH_Connect(Con):
         
         self.toggle_stat_on_node()
 
-        timer.sleep(2) # wait for commands to proceed 
+        cancel_utils.wait(self.stop_event, 2) # wait for commands to proceed 
 
         # Cycle file until resynchronized
         print_utils.print_info("---------- START RESYNCHRONIZATION ----------", 1)
@@ -71,6 +100,32 @@ class SSH_Connect(Con):
         print_utils.print_info("---------- END RESYNCHRONOZATION ----------", 1)
         return
 
+    def __resync_ptp_node_live(self) -> None:
+        print_utils.print_info("---------- RESTART PTP ----------", 1)
+        result = self.run_node("ptp stop 0")
+        result = self.run_node("sfp match")
+        result = self.run_node("ptp start 0")
+
+        self.__set_streaming(True)
+        since = self.__reader.mark()
+        self.toggle_stat_on_node()
+
+        # Wait until resynchronized: 3 TRACK_PHASE stat lines
+        print_utils.print_info("---------- START RESYNCHRONIZATION ----------", 1)
+        sync_lines = self.__reader.wait_for_lines("TRACK_PHASE", 3, since=since, stop_event=self.stop_event)
+        self.__set_streaming(False)
+        if sync_lines is None and self.stop_event is not None and self.stop_event.is_set():
+            self.toggle_stat_off_node()
+        if self.check_stop_event("resync_ptp_node"):
+            return
+        if sync_lines is None:
+            raise ConnectionError(f"{self.__TTY_USB__} relay is lost while waiting for PTP resynchronization: {self.__reader.error}")
+        print_utils.print_info(f"Sync count (TRACK_PHASE): {len(sync_lines)}", 2)
+
+        self.toggle_stat_off_node()
+        print_utils.print_info("---------- END RESYNCHRONOZATION ----------", 1)
+        return
+
     def toggle_stat_on_node(self) -> None:
         self.__tryNewSSHConnection()
         self.run_node(f"stat on")
@@ -86,16 +141,135 @@ class SSH_Connect(Con):
             hide=(hide and print_utils.is_verbosity_printable(1)))
     
     def run_node(self, op: str, hide: bool = False) -> Any:
+        if self.__tty_mode != TTY_EXEC:
+            self.__open_tty_channel()
+            if self.__agent is not None:
+                res = self.__agent.command(op)
+            else:
+                since = self.__reader.mark()
+                self.__tty_channel.sendall(bytes(f"{op} \r", "utf-8"))
+                res = self.__reader.wait_quiet(since)
+            if (not hide):
+                print_utils.print_untagged(res, 2)
+            return res
         return self.__c.run(f"echo -e -n '{op}\r' > {self.__TTY_USB__}",
             hide=(hide and print_utils.is_verbosity_printable(2)))
 
     def read_node_log(self, time: int = 60, hide = True) -> List[str]:
+        if self.__tty_mode != TTY_EXEC:
+            return self.__read_node_log_live(time, hide)
         output_file = "stat.log"
         self.toggle_stat_on_node()
         self.__run_node_to_file(None, time, output_file, hide=hide)
         self.toggle_stat_off_node()
         return self.run_host(f"cat {output_file}").stdout.split("\n")
 
+    def read_node_stats(self, time: int = 60, parser: StatParser = None) -> StatParser:
+        if self.__tty_mode == TTY_EXEC:
+            return super().read_node_stats(time, parser)
+        parser = parser if parser is not None else StatParser()
+        self.__open_tty_channel()
+        self.__reader.add_listener(parser.feed_line)
+        self.__set_streaming(True)
+        try:
+            self.__read_node_log_live(time, hide=True, is_streamed=True)
+        finally:
+            self.__set_streaming(False)
+            self.__reader.remove_listener(parser.feed_line)
+        return parser
+
+    def __read_node_log_live(self, time: int, hide: bool, is_streamed: bool = False) -> List[str]:
+        """The agent records the log on the host and sends it back in one frame unless it is streamed anyway"""
+        self.toggle_stat_on_node()
+        is_bulk = self.__agent is not None and not is_streamed
+        if is_bulk:
+            self.__agent.start_log()
+        since = self.__reader.mark()
+        if (time > 5):
+            for t in print_utils.timer_bar(
+                range(time, -1, -1),
+                prefix="Logging time:",
+                suffix="left",
+                length=100):
+                if self.check_stop_event("read_node_log"):
+                    return []
+                cancel_utils.wait(self.stop_event, 1)
+        elif cancel_utils.wait(self.stop_event, time) and self.check_stop_event("read_node_log"):
+            return []
+        res = self.__agent.fetch_log() if is_bulk else self.__reader.lines_since(since)
+        self.toggle_stat_off_node()
+        if (not hide):
+            print_utils.print_untagged("\n".join(res), 2)
+        return res
+
+    def __node_output(self, op: str) -> str:
+        """Runs the command on the node and returns what the node answered"""
+        if self.__tty_mode != TTY_EXEC:
+            return self.run_node(op, hide=True)
+        output_file = "output.txt"
+        self.__run_node_to_file(op, 1, file=output_file)
+        return self.run_host(f"cat {output_file}", hide=True).stdout
+
+    def __open_tty_channel(self):
+        if self.__tty_channel is not None and not self.__tty_channel.closed and self.__reader.is_running():
+            return
+        self.__close_tty_channel()
+        self.__tryNewSSHConnection()
+        self.__c.open()
+        if self.__tty_mode == TTY_AGENT:
+            agent_path = self.__upload_agent()
+        self.__tty_channel = self.__c.client.get_transport().open_session()
+        if self.__tty_mode == TTY_AGENT:
+            self.__tty_channel.exec_command(f"python3 {agent_path} {self.__TTY_USB__}")
+            self.__agent = TtyAgentClient(self.__tty_channel, name=f"ssh_{self.__TTY_USB__[5:]}_agent")
+            self.__reader = self.__agent.reader
+        else:
+            self.__tty_channel.exec_command(SSH_Connect.__TTY_RELAY.format(tty=self.__TTY_USB__))
+            self.__tty_channel.settimeout(0.05) # read granularity of the line reader
+        self.__reader.start()
+        print_utils.print_info(f"---------- {self.__TTY_USB__} {self.__tty_mode.upper()} OPENED ----------", 2)
+
+    def __upload_agent(self) -> str:
+        """Uploads tty_agent once: the file name carries its hash, so an existing file is always current"""
+        with open(tty_agent.__file__, "rb") as f:
+            source = f.read()
+        path = f"/tmp/tss_tty_agent_{hashlib.sha256(source).hexdigest()[:12]}.py"
+        if self.__c.run(f"test -f {path}", hide=True, warn=True).failed:
+            self.__c.put(io.BytesIO(source), remote=path)
+            print_utils.print_info(f"---------- TTY AGENT UPLOADED TO {path} ----------", 2)
+        return path
+
+    def __set_streaming(self, is_on: bool):
+        if self.__agent is not None:
+            try:
+                self.__agent.set_streaming(is_on)
+            except OSError: # channel lost: reported by the read that needs it
+                pass
+
+    def __close_tty_channel(self):
+        if self.__tty_channel is None:
+            return
+        if self.__agent is not None:
+            self.__agent.close()
+            self.__agent = None
+        self.__reader.stop()
+        try:
+            self.__tty_channel.shutdown_write() # EOF ends the remote relay
+            self.__tty_channel.close()
+        except (OSError, EOFError):
+            pass
+        self.__tty_channel = None
+
+    def __read_tty_channel(self) -> bytes:
+        try:
+            data = self.__tty_channel.recv(4096)
+        except socket.timeout:
+            return b""
+        if not data:
+            raise EOFError(f"{self.__TTY_USB__} relay closed by {self.__HOST_NAME}. "
+                           f"Exit status: {self.__tty_channel.recv_exit_status()}")
+        return data
+
     def __run_node_to_file(self, op: str | None, sleep: int, file: str = "output.txt", hide:bool = True):
         if self.check_stop_event("__run_node_to_file"):
             return
@@ -116,9 +290,9 @@ class SSH_Connect(Con):
                 if self.check_stop_event("__run_node_to_file"):
                     result = self.run_host(f"kill -9 {ps_id}", hide=hide)
                     return
-                timer.sleep(1)
+                cancel_utils.wait(self.stop_event, 1)
         else:
-            timer.sleep(sleep)
+            cancel_utils.wait(self.stop_event, sleep)
 
         result = self.run_host(f"kill -9 {ps_id}", hide=hide)
         # print(result.stdout)
@@ -139,9 +313,7 @@ class SSH_Connect(Con):
                 
         self.toggle_stat_off_node() # ensure no statuses printed
 
-        output_file = "output.txt"
-        self.__run_node_to_file("sfp match", 1, file=output_file)
-        result = self.run_host(f"cat {output_file}", hide=True).stdout.upper().split("\n")
+        result = self.__node_output("sfp match").upper().split("\n")
         sfpIds = list(filter(lambda line : ("PORT" not in line), result))
         sfpId = sfpIds[1].split()[0] if len(sfpIds) == 4 else sfpIds[node_port + 1].split()[0]
 
@@ -149,9 +321,8 @@ class SSH_Connect(Con):
         # Output:
         # Port 0, SFP 2: PN:SFP1G-SX-85      dTx:   -38753 dRx:    38801 alpha:        0
         # Port 1, SFP 1: PN:SFP1G-LX-31      dTx:        0 dRx:        0 alpha:        0
-        output_file = "output.txt"
-        self.__run_node_to_file("sfp show", 1, file=output_file)
-        result = self.run_host(f"cat {output_file} | grep {sfpId}", hide=True).stdout.upper().split("\n")
+        result = self.__node_output("sfp show").split("\n")
+        result = [x.upper() for x in list(filter(lambda line : (f"{sfpId}" in line.upper()), result))]
         sfpOffsets = list(filter(lambda line : (f"PORT {node_port}" in line), result))
         txOffset, rxOffset = (0, 0)
         if len(sfpOffsets) == 1:
@@ -186,9 +357,7 @@ class SSH_Connect(Con):
 
         self.toggle_stat_off_node() # ensure no statuses printed
 
-        output_file = "output.txt"
-        self.__run_node_to_file("sfp match", 1, file=output_file)
-        result = self.run_host(f"cat {output_file}", hide=True).stdout.upper().split("\n")
+        result = self.__node_output("sfp match").upper().split("\n")
         sfpIds = list(filter(lambda line : ("PORT" not in line), result))
         # print(result)
         # print(sfpIds)
@@ -203,19 +372,19 @@ class SSH_Connect(Con):
 
     def __tryNewSSHConnection(self) -> int:
         if type(self.__c) is not Connection:
-            config = Config(overrides={'sudo': {'password': self.__HOST_ROOT_PWD}})
-            print_utils.print_info("---------- CONNECT SSH ----------", 1)
-            self.__c = Connection(self.__HOST_NAME, port=22, connect_kwargs={"password": self.__CONNECT_PWD}, config=config)
+            self.__c = SshPool.shared().acquire(self.__HOST_NAME, self.__CONNECT_PWD, self.__HOST_ROOT_PWD)
             return 1
         return 0
 
     def __tryCloseSSHConnection(self) -> int:
+        """Hands the connection back to the pool: it stays authenticated for the next run until idle eviction"""
         if type(self.__c) is Connection:
-            self.__c.close()
+            SshPool.shared().release(self.__c)
             self.__c = None
-            print_utils.print_info("---------- SSH SESSION CLOSED ----------", 1)
+            print_utils.print_info("---------- SSH SESSION RELEASED ----------", 1)
             return 1
         return 0
 
     def close(self) -> int:
+        self.__close_tty_channel()
         return self.__tryCloseSSHConnection()
\ No newline at end of file
@@ -0,0 +1,99 @@
+from ..utils import print as print_utils
+
+from fabric import Connection, Config
+import atexit
+import threading
+import time as timer
+from typing import Dict, Tuple
+
+class _PooledConnection:
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self.users = 0
+        self.open_lock = threading.Lock()
+        self.released_at = timer.monotonic()
+
+class SshPool:
+    """Process-wide pool of authenticated SSH connections keyed by host and credentials.
+    Released connections stay open for `idle_timeout` sec, so the next user skips the handshake"""
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, idle_timeout: float = 300, keepalive: int = 30):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.__entries: Dict[Tuple[str, str, str], _PooledConnection] = {}
+        self.__lock = threading.Lock()
+        self.__janitor = None
+        self.__closed = threading.Event()
+
+    def shared() -> "SshPool":
+        with SshPool.__shared_lock:
+            if SshPool.__shared is None:
+                SshPool.__shared = SshPool()
+                atexit.register(SshPool.__shared.close_all)
+            return SshPool.__shared
+
+    def acquire(self, host_name: str, connect_pwd: str, host_root_pwd: str) -> Connection:
+        """Returns an open connection to the host, reusing an idle one when it is still alive"""
+        key = (host_name, connect_pwd, host_root_pwd)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                config = Config(overrides={'sudo': {'password': host_root_pwd}})
+                print_utils.print_info("---------- CONNECT SSH ----------", 1)
+                connection = Connection(host_name, port=22, connect_kwargs={"password": connect_pwd}, config=config)
+                entry = self.__entries[key] = _PooledConnection(connection)
+            else:
+                print_utils.print_info("---------- REUSE SSH CONNECTION ----------", 2)
+            entry.users += 1
+            self.__start_janitor()
+
+        # handshake outside of the lock: other hosts must not wait for it. Dropped connections are reopened
+        with entry.open_lock:
+            if not entry.connection.is_connected:
+                entry.connection.open()
+                entry.connection.transport.set_keepalive(self.keepalive)
+        return entry.connection
+
+    def release(self, connection: Connection):
+        """Returns the connection to the pool. It is closed once idle for `idle_timeout` sec"""
+        with self.__lock:
+            for entry in self.__entries.values():
+                if entry.connection is connection:
+                    entry.users = max(0, entry.users - 1)
+                    entry.released_at = timer.monotonic()
+                    return
+        connection.close() # not pooled
+
+    def evict_idle(self):
+        now = timer.monotonic()
+        with self.__lock:
+            idle = [k for k, v in self.__entries.items() if v.users == 0 and now - v.released_at >= self.idle_timeout]
+            entries = [self.__entries.pop(k) for k in idle]
+        for entry in entries:
+            entry.connection.close()
+            print_utils.print_info("---------- SSH SESSION CLOSED ----------", 2)
+
+    def close_all(self):
+        self.__closed.set()
+        with self.__lock:
+            entries = list(self.__entries.values())
+            self.__entries.clear()
+        for entry in entries:
+            entry.connection.close()
+
+    def __start_janitor(self):
+        if self.__janitor is None or not self.__janitor.is_alive():
+            self.__closed.clear()
+            self.__janitor = threading.Thread(target=self.__run_janitor, name="ssh_pool_janitor", daemon=True)
+            self.__janitor.start()
+
+    def __run_janitor(self):
+        while not self.__closed.wait(min(self.idle_timeout, 10)):
+            self.evict_idle()
+            with self.__lock:
+                if not self.__entries:
+                    self.__janitor = None
+                    return
@@ -0,0 +1,82 @@
+from ..utils.stats import RunningStats
+
+import numpy as np
+from typing import Dict, Iterable
+
+# servo state names printed by `stat` in order of wrpcPtpServoStateN values
+SERVO_STATES = ("UNINITIALIZED", "SYNC_NSEC", "SYNC_SEC", "SYNC_PHASE", "TRACK_PHASE", "WAIT_OFFSET_STABLE")
+TRACK_PHASE = SERVO_STATES.index("TRACK_PHASE")
+UNKNOWN_STATE = -1
+
+# column -> `stat` key. skew is not printed by every firmware: it stays NaN then
+STAT_KEYS = {"crtt": "crtt", "offset": "cko", "skew": "skew"}
+
+class StatParser:
+    """Incremental parser of WRPC `stat` lines, e.g.
+    lnk:1 rx:12 tx:4 lock:1 sv:1 ss:'TRACK_PHASE' ... crtt:123456 cko:-3 setp:... temp:...
+    The servo state is accepted quoted, as the stock firmware prints it, or bare
+
+    Bytes may be fed in chunks of any size. The last `capacity` samples are kept in typed columns and
+    running statistics of every column over TRACK_PHASE samples are updated as lines arrive"""
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.state = np.full(capacity, UNKNOWN_STATE, dtype=np.int8)
+        self.columns: Dict[str, np.ndarray] = {x: np.full(capacity, np.nan) for x in STAT_KEYS}
+        self.stats: Dict[str, RunningStats] = {x: RunningStats() for x in STAT_KEYS}
+        self.count = 0 # stat lines ever parsed
+        self.__partial = ""
+
+    def feed(self, data: bytes | str):
+        """Parses every line completed by `data`, keeping the unfinished tail for the next call"""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        *lines, self.__partial = (self.__partial + data).split("\n")
+        for line in lines:
+            self.feed_line(line)
+
+    def feed_lines(self, lines: Iterable[str]):
+        for line in lines:
+            self.feed_line(line)
+
+    def feed_line(self, line: str) -> bool:
+        """Parses one complete line. Returns False if it is not a `stat` line"""
+        fields = {}
+        for token in line.split():
+            key, sep, value = token.partition(":")
+            if sep:
+                fields[key] = value
+        if "ss" not in fields or "crtt" not in fields:
+            return False
+
+        servo_state = fields["ss"].strip("'\"").upper() # stock firmware quotes it: ss:'TRACK_PHASE'
+        state = SERVO_STATES.index(servo_state) if servo_state in SERVO_STATES else UNKNOWN_STATE
+        pos = self.count % self.capacity
+        self.state[pos] = state
+        for column, key in STAT_KEYS.items():
+            value = StatParser.__to_float(fields.get(key))
+            self.columns[column][pos] = value
+            if state == TRACK_PHASE:
+                self.stats[column].push(value)
+        self.count += 1
+        return True
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns the kept samples of a column ('state' included), oldest first"""
+        values = self.state if name == "state" else self.columns[name]
+        if self.count <= self.capacity:
+            return values[:self.count].copy()
+        return np.roll(values, -(self.count % self.capacity))
+
+    @property
+    def track_phase_count(self) -> int:
+        return self.stats["crtt"].count
+
+    def __to_float(value: str | None) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
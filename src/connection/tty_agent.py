@@ -0,0 +1,134 @@
+"""Serial port agent run on the PC a WR-Node is attached to.
+
+Uploaded and started by SSH_Connect in agent mode. Holds the tty open and talks over its stdin/stdout
+with frames of 1 byte type + 4 bytes big-endian payload length + payload. Standard library only.
+
+Requests:   CMD     !III seq, quiet ms, timeout ms + command  -> RESULT: !I seq + the node output
+            STREAM  b"1" / b"0"                                 -> node lines forwarded as LINE frames
+            LOG     b"1" starts recording node lines,
+                    b"0" + !I seq                               -> BULK: !I seq + every recorded line
+            QUIT
+Replies carry the sequence number of their request, so the client drops the late ones of requests it gave up on.
+ERROR frames report failures. The agent exits after the ones about the tty, e.g. when it is gone.
+"""
+import os
+import select
+import struct
+import sys
+import termios
+import time
+import tty
+
+CMD = b"C"
+STREAM = b"S"
+LOG = b"G"
+QUIT = b"Q"
+RESULT = b"R"
+LINE = b"L"
+BULK = b"B"
+ERROR = b"E"
+
+HEADER = struct.Struct("!cI")
+CMD_HEADER = struct.Struct("!III")
+SEQ = struct.Struct("!I")
+
+def encode_frame(kind: bytes, payload: bytes = b"") -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload
+
+def decode_frames(buf: bytearray):
+    """Pops every complete frame off the buffer. Yields (kind, payload)"""
+    while len(buf) >= HEADER.size:
+        kind, length = HEADER.unpack_from(buf)
+        if len(buf) < HEADER.size + length:
+            return
+        payload = bytes(buf[HEADER.size:HEADER.size + length])
+        del buf[:HEADER.size + length]
+        yield kind, payload
+
+class Agent:
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[4] = attrs[5] = termios.B115200
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.out = sys.stdout.buffer
+        self.partial = b""
+        self.is_streaming = False
+        self.log = None
+        self.command = None # [started, last data at, quiet, timeout, output, seq]
+
+    def send(self, kind: bytes, payload: bytes = b""):
+        self.out.write(encode_frame(kind, payload))
+        self.out.flush()
+
+    def run(self):
+        inbuf = bytearray()
+        while True:
+            timeout = 0.01 if self.command is not None else 1.0
+            ready, _, _ = select.select([self.fd, 0], [], [], timeout)
+            if self.fd in ready:
+                data = os.read(self.fd, 4096)
+                if not data: # tty is gone, e.g. the node was unplugged
+                    self.send(ERROR, b"tty closed")
+                    return
+                self.on_tty(data)
+            if 0 in ready:
+                data = os.read(0, 4096)
+                if not data: # channel closed
+                    return
+                inbuf.extend(data)
+                for kind, payload in decode_frames(inbuf):
+                    if not self.on_request(kind, payload):
+                        return
+            self.check_command()
+
+    def on_tty(self, data: bytes):
+        now = time.monotonic()
+        if self.command is not None:
+            self.command[1] = now
+            self.command[4] += data
+        *lines, self.partial = (self.partial + data).split(b"\n")
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if self.is_streaming:
+                self.send(LINE, line)
+            if self.log is not None:
+                self.log.append(line)
+
+    def on_request(self, kind: bytes, payload: bytes) -> bool:
+        if kind == CMD:
+            seq, quiet, timeout = CMD_HEADER.unpack_from(payload)
+            os.write(self.fd, payload[CMD_HEADER.size:] + b" \r")
+            self.command = [time.monotonic(), None, quiet / 1000, timeout / 1000, b"", seq]
+        elif kind == STREAM:
+            self.is_streaming = payload == b"1"
+        elif kind == LOG:
+            if payload == b"1":
+                self.log = []
+            else:
+                self.send(BULK, payload[1:1 + SEQ.size] + b"\n".join(self.log or []))
+                self.log = None
+        elif kind == QUIT:
+            return False
+        else:
+            self.send(ERROR, b"unknown frame " + kind)
+        return True
+
+    def check_command(self):
+        if self.command is None:
+            return
+        started, last_data_at, quiet, timeout, output, seq = self.command
+        now = time.monotonic()
+        is_settled = last_data_at is not None and now - last_data_at >= quiet
+        if is_settled or now - started >= timeout:
+            self.command = None
+            self.send(RESULT, SEQ.pack(seq) + output)
+
+if __name__ == "__main__":
+    try:
+        Agent(sys.argv[1]).run()
+    except OSError as ex:
+        sys.stdout.buffer.write(encode_frame(ERROR, str(ex).encode("utf-8", "replace")))
+        sys.stdout.buffer.flush()
+        sys.exit(1)
@@ -0,0 +1,93 @@
+from . import tty_agent as agent
+from .line_reader import LineReader
+
+import itertools
+import queue
+import socket
+import threading
+import time as timer
+from typing import List, Tuple
+
+class TtyAgentClient:
+    """Talks to a running tty_agent over a channel (anything with sendall/recv/settimeout).
+    Streamed node lines land in `reader`; command results and log dumps are returned by the calls"""
+
+    def __init__(self, channel, name: str = "tty_agent"):
+        self.__channel = channel
+        self.__channel.settimeout(0.05) # read granularity of the line reader
+        self.__inbuf = bytearray()
+        self.__replies: "queue.Queue[Tuple[bytes, bytes]]" = queue.Queue()
+        self.__request_lock = threading.Lock() # agent replies in request order: one request at a time
+        self.__seqs = itertools.count(1)
+        self.reader = LineReader(self.__read, name=name)
+
+    def start(self):
+        self.reader.start()
+
+    def command(self, op: str, quiet: float = 0.1, timeout: float = 0.4) -> str:
+        """Runs the command on the node. The agent waits for the output to settle, so it is one round trip"""
+        with self.__request_lock:
+            seq = self.__next_seq()
+            self.__send(agent.CMD, agent.CMD_HEADER.pack(seq, int(quiet * 1000), int(timeout * 1000)) + op.encode("utf-8"))
+            output = self.__reply(agent.RESULT, seq, timeout + 5)
+        return output.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "")
+
+    def set_streaming(self, is_on: bool):
+        """Forwards every node line to `reader` while on"""
+        self.__send(agent.STREAM, b"1" if is_on else b"0")
+
+    def start_log(self):
+        """Makes the agent record node lines until fetch_log()"""
+        self.__send(agent.LOG, b"1")
+
+    def fetch_log(self, timeout: float = 30) -> List[str]:
+        with self.__request_lock:
+            seq = self.__next_seq()
+            self.__send(agent.LOG, b"0" + agent.SEQ.pack(seq))
+            log = self.__reply(agent.BULK, seq, timeout)
+        return log.decode("utf-8", errors="replace").split("\n") if log else []
+
+    def close(self):
+        try:
+            self.__send(agent.QUIT)
+        except OSError:
+            pass
+        self.reader.stop()
+
+    def __send(self, kind: bytes, payload: bytes = b""):
+        self.__channel.sendall(agent.encode_frame(kind, payload))
+
+    def __next_seq(self) -> int:
+        return next(self.__seqs) % 2 ** 32
+
+    def __reply(self, kind: bytes, seq: int, timeout: float) -> bytes:
+        """Waits for the reply to request `seq`. Late replies of any kind to requests that timed out earlier are dropped"""
+        deadline = timer.monotonic() + timeout
+        while True:
+            try:
+                reply_kind, payload = self.__replies.get(timeout=max(0, deadline - timer.monotonic()))
+            except queue.Empty:
+                raise ConnectionError(f"tty agent did not answer in {timeout} sec: {self.reader.error}")
+            if reply_kind == agent.ERROR:
+                raise ConnectionError(f"tty agent error: {payload.decode('utf-8', errors='replace')}")
+            # whatever its kind, a reply to another request is a late one
+            if reply_kind == kind and len(payload) >= agent.SEQ.size and agent.SEQ.unpack_from(payload)[0] == seq:
+                return payload[agent.SEQ.size:]
+
+    def __read(self) -> bytes:
+        """Demultiplexes agent frames: returns streamed lines to the line reader, queues replies"""
+        try:
+            data = self.__channel.recv(65536)
+        except socket.timeout:
+            return b""
+        if not data:
+            self.__replies.put((agent.ERROR, b"channel closed"))
+            raise EOFError("tty agent channel closed")
+        self.__inbuf.extend(data)
+        lines = []
+        for kind, payload in agent.decode_frames(self.__inbuf):
+            if kind == agent.LINE:
+                lines.append(payload + b"\n")
+            else:
+                self.__replies.put((kind, payload))
+        return b"".join(lines)
@@ -11,6 +11,7 @@ import io
 from .autocalib_tab import AutocalibTab
 from .remote_config_tab import RemoteConfigTab
 from ..utils import threading as thread_utils
+from ..utils.jobs import JobScheduler
 
 class App:
 
@@ -74,12 +75,12 @@ class App:
         return
     
     def __enable_terminate_btn(self, *args):
-        if len(self.autocalib_tab.threads) + len (self.remote_config_tab.threads) > 0:
+        if len(self.autocalib_tab.jobs) + len (self.remote_config_tab.jobs) > 0:
             self.terminate_threads_btn.config(state=tk.NORMAL)
         return
 
     def __disable_terminate_btn(self, *args):
-        if len(self.autocalib_tab.threads) + len (self.remote_config_tab.threads) == 0:
+        if len(self.autocalib_tab.jobs) + len (self.remote_config_tab.jobs) == 0:
             self.terminate_threads_btn.config(state=tk.DISABLED)
         return
 
@@ -87,8 +88,11 @@ class App:
         self.autocalib_tab.terminate_threads_event.set()
         self.remote_config_tab.terminate_threads_event.set()
 
-        self.autocalib_tab.threads.clear()
-        self.remote_config_tab.threads.clear()
+        # queued scripts are dropped, running ones see their stop event
+        for job in self.autocalib_tab.jobs + self.remote_config_tab.jobs:
+            JobScheduler.shared().cancel(job.id)
+        self.autocalib_tab.jobs.clear()
+        self.remote_config_tab.jobs.clear()
         
         self.autocalib_tab_fr.event_generate(thread_utils.OnScriptThreadTerminate_Event)
         self.remote_config_fr.event_generate(thread_utils.OnScriptThreadTerminate_Event)
@@ -1,16 +1,16 @@
 import tkinter as tk
 from tkinter import ttk 
-import threading
 
 from ..scripts import calib_refine
 from ..utils import threading as thread_utils
+from ..utils import jobs as job_utils
 from ..utils import print as print_utils
+from ..utils.cancel import CancelToken
 from .utils import enablement_control
 class AutocalibTab(object):
     def __init__(self, master = None, **kwargs):
-        self.terminate_threads_event = threading.Event()
-        calib_refine.assign_calib_refine_stop_event(self.terminate_threads_event)
-        self.threads = []
+        self.terminate_threads_event = CancelToken()
+        self.jobs = []
         # ----------------------Visible Frame-----------------------------
         self.master = master
         self.master.bind(thread_utils.OnScriptStart_Event, lambda x: self.__on_script_start_handler(x))
@@ -62,6 +62,11 @@ class AutocalibTab(object):
         ttk.Label(self.visible_fields_fr, text="ttyUSB index (opt.):").grid(row=row, column=0, sticky="w", padx=5, pady=2)
         self.ttyusb_index_entry = ttk.Entry(self.visible_fields_fr, width=30)
         self.ttyusb_index_entry.grid(row=row, column=1, sticky="ew", padx=5, pady=2)
+
+        # Confidence target (optional)
+        ttk.Label(self.visible_fields_fr, text="CI target, ps (opt.):").grid(row=row, column=2, sticky="w", padx=5, pady=2)
+        self.ci_target_entry = ttk.Entry(self.visible_fields_fr, width=30)
+        self.ci_target_entry.grid(row=row, column=3, sticky="ew", padx=5, pady=2)
         row += 1
 
         # Oscilloscope WR-Switch ch. (optional)
@@ -182,6 +187,7 @@ class AutocalibTab(object):
             "--crtt": self.crtt_calib_time_entry.get(),
             "--wfrchsw": self.wr_switch_ch_entry.get(),
             "--wfrchnode": self.wr_node_ch_entry.get(),
+            "--target": self.ci_target_entry.get(),
             "-v": self.verbosity_var.get(),
             "-s": self.enable_ssh_var.get()
         }
@@ -217,6 +223,7 @@ class AutocalibTab(object):
         add_optional("--ttyUSB")
         add_optional("--wfrchsw")
         add_optional("--wfrchnode")
+        add_optional("--target")
         if params["-s"]:
             calib_args.append("-s")
             params["--sshhostname"] = self.ssh_host_name_entry.get()
@@ -231,17 +238,23 @@ class AutocalibTab(object):
         # for item in calib_args:
         #     print_utils.print_untagged(item, 2)
 
-        pid = thread_utils.run_script_in_bg(
+        self.terminate_threads_event.clear() # a terminate of the earlier runs must not drop this one
+        # one run per oscilloscope and per WR-Node tty at a time, later presses queue up
+        tty_host = params["--sshhostname"] if params["-s"] else None
+        resources = [job_utils.scope_resource(params["instrip"]),
+                     job_utils.tty_resource(params["--ttyUSB"] or 0, tty_host)]
+        job = thread_utils.run_script_in_bg(
             func=calib_refine.main,
             args=calib_args,
             gui=self.master,
-            stop_event=self.terminate_threads_event
+            stop_event=self.terminate_threads_event,
+            resources=resources
             )
-        self.threads.append(pid)
+        self.jobs.append(job)
 
     def __on_script_finish_handler(self, *args):
         enablement_control.enableChildren(self.master)
-        self.threads.clear()
+        self.jobs = [job for job in self.jobs if job.status in (job_utils.PENDING, job_utils.RUNNING)]
 
     def __on_script_start_handler(self, *args):
         enablement_control.disableChildren(self.master)
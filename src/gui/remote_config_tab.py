@@ -1,21 +1,21 @@
 import tkinter as tk
 from tkinter import ttk 
 import os 
-import threading
 
 from ..scripts import remote_config
 from ..utils import print as print_utils
 from ..utils import ip as ip_utils
 from ..utils import threading as thread_utils
+from ..utils import jobs as job_utils
+from ..utils.cancel import CancelToken
 from .utils import enablement_control
 
 class RemoteConfigTab(object):
     def __init__(self, master):
         self.coef_entries = [] # List to store groups of fields
         self.group_frs = []
-        self.terminate_threads_event = threading.Event()
-        remote_config.assign_remote_config_stop_event(self.terminate_threads_event)
-        self.threads = []
+        self.terminate_threads_event = CancelToken()
+        self.jobs = []
         
         self.master = master
         self.master.bind(thread_utils.OnScriptStart_Event, lambda x: self.__on_script_start_handler(x))
@@ -139,9 +139,10 @@ class RemoteConfigTab(object):
             all_groups_data.append(data_group)
 
         is_log_cleared = False
+        self.terminate_threads_event.clear() # a terminate of the earlier runs must not drop these ones
 
-        for data_group in all_groups_data:
-            ips_file_path = "./temp.ips"
+        for index, data_group in enumerate(all_groups_data):
+            ips_file_path = f"./temp{index}.ips" # groups may be queued: each reads its own file
             start_ip = data_group["start_ip"]
             end_ip = data_group["end_ip"]
             tx = data_group["tx"]
@@ -163,8 +164,9 @@ class RemoteConfigTab(object):
                 print_utils.print_error(f"Invalid rx coefficient: {rx}. Expected integer value")
                 return
 
+            ips = list(ip_utils.generate_ip_list(start_ip, end_ip))
             with open(ips_file_path, "w") as f:
-                for ip in ip_utils.generate_ip_list(start_ip, end_ip):
+                for ip in ips:
                     f.write(f"{ip}\n")
             
             args = []
@@ -179,8 +181,8 @@ class RemoteConfigTab(object):
                 args.extend(["--sfp", sfp])
             
             log_file_path = "run.log"
-            if not is_log_cleared:
-                open(log_file_path, "w").close()
+            if not is_log_cleared: # through the shared log: groups of an earlier start may still write to it
+                print_utils.logger.truncate(log_file_path)
                 is_log_cleared = True
             
             args.extend(["-l", log_file_path])
@@ -197,13 +199,15 @@ class RemoteConfigTab(object):
             else:
                 args.append("0")
 
-            pid = thread_utils.run_script_in_bg(
+            # groups sharing a node run one after another instead of configuring it concurrently
+            job = thread_utils.run_script_in_bg(
                 func=remote_config.main,
                 args=args,
                 gui=self.master,
-                stop_event=self.terminate_threads_event
+                stop_event=self.terminate_threads_event,
+                resources=[job_utils.snmp_resource(ip) for ip in ips]
             )
-            self.threads.append(pid)
+            self.jobs.append(job)
         return
 
     def __on_group_fr_configure(self, event):
@@ -223,7 +227,7 @@ class RemoteConfigTab(object):
     
     def __on_script_finish_handler(self, *args):
         enablement_control.enableChildren(self.master)
-        self.threads.clear()
+        self.jobs = [job for job in self.jobs if job.status in (job_utils.PENDING, job_utils.RUNNING)]
 
     def __on_script_start_handler(self, *args):
         enablement_control.disableChildren(self.master)
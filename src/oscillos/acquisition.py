@@ -0,0 +1,70 @@
+from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+
+import math
+import time as timer
+from typing import Callable, Tuple
+
+# reasons AcquisitionController.wait() returns
+TARGET_COUNT = "target_count"
+TARGET_CI = "target_ci"
+TIMEOUT = "timeout"
+STOPPED = "stopped"
+
+class AcquisitionController:
+    """Waits for a running acquisition by polling the measurement statistics.
+    Finishes as soon as `target_count` events are captured or the confidence interval of the mean
+    narrows to `ci_target`. If the statistics can't be read, it just waits `fallback_time` sec"""
+
+    def __init__(self, read_statistics: Callable[[], Tuple[int, float, float]], target_count: int,
+                 ci_target: float = None, timeout: float = None, fallback_time: float = None,
+                 is_stopped: Callable[[], bool] = None, poll_interval: float = 0.25, z: float = 1.96,
+                 stop_event = None):
+        """`read_statistics` returns (event count, mean, standard deviation).
+        `ci_target` is the half-width of the `z` confidence interval in units of the mean.
+        Setting `stop_event` ends the wait between polls at once"""
+        self.read_statistics = read_statistics
+        self.target_count = target_count
+        self.ci_target = ci_target
+        self.fallback_time = fallback_time if fallback_time is not None else target_count
+        self.timeout = timeout if timeout is not None else self.fallback_time * 1.5 + 10
+        self.is_stopped = is_stopped if is_stopped is not None else (lambda: False)
+        self.poll_interval = poll_interval
+        self.z = z
+        self.stop_event = stop_event
+        self.count = 0
+        self.mean = math.nan
+        self.std = math.nan
+
+    def ci_half_width(self) -> float:
+        if self.count < 2 or math.isnan(self.std):
+            return math.inf
+        return self.z * self.std / math.sqrt(self.count)
+
+    def wait(self) -> str:
+        started = timer.monotonic()
+        is_polling = True
+        reported_at = started
+        while True:
+            if self.is_stopped() or cancel_utils.is_cancelled(self.stop_event):
+                return STOPPED
+            now = timer.monotonic()
+            if is_polling:
+                try:
+                    self.count, self.mean, self.std = self.read_statistics()
+                except Exception as ex: # statistics unavailable: fall back to a fixed acquisition time
+                    print_utils.print_info(f"Measurement statistics are unavailable ({ex}). Waiting {self.fallback_time} sec", 1)
+                    is_polling = False
+                    continue
+                if self.count >= self.target_count:
+                    return TARGET_COUNT
+                if self.ci_target is not None and self.ci_half_width() <= self.ci_target:
+                    return TARGET_CI
+                if now - started >= self.timeout:
+                    return TIMEOUT
+                if now - reported_at >= 5:
+                    reported_at = now
+                    print_utils.print_loop(f"Acquired {self.count}/{self.target_count} events", 2)
+            elif now - started >= self.fallback_time:
+                return TIMEOUT
+            cancel_utils.wait(self.stop_event, self.poll_interval)
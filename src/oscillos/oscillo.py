@@ -1,10 +1,25 @@
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils import trace as trace_utils
+
+import numpy as np
+from typing import Dict, List
 
 class Oscilloscope:
+    max_slots = 1 # node channels measured against the switch channel at once
+    # phases timed as spans while tracing is on, whichever subclass implements them
+    TRACED_METHODS = ("setup_measurements", "setup_slots", "perform_measurements", "perform_slot_measurements",
+                      "reset_measurements", "close_session")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        trace_utils.trace_methods(cls, Oscilloscope.TRACED_METHODS, trace_utils.OSCILLOSCOPE)
+
     def __init__(self, root = None, stop_event = None):
         self.__device = None
         self.script = root
         self.stop_event = stop_event
+        self.trace_label = "oscilloscope"
 		
     def write(self, op: str):
         raise NotImplementedError()
@@ -38,21 +53,34 @@ class Oscilloscope:
     
     def query_opc(self, timeout: int = 0):
         raise NotImplementedError()
+
+    def write_batch(self, ops: List[str]):
+        raise NotImplementedError()
 	
-    def setup_measurements(self, switch_ch: int, node_ch: int):
+    def setup_measurements(self, switch_ch: int, node_ch: int, force: bool = False):
+        raise NotImplementedError()
+
+    def setup_slots(self, switch_ch: int, node_chs: List[int], force: bool = False):
+        """Measures node_chs[i] against switch_ch in measurement slot i + 1"""
+        raise NotImplementedError()
+
+    def perform_measurements(self, event_count_to_acquire: int, ci_target: float = None) -> np.ndarray | None:
+        """Returns the acquired delays in seconds. None if stopped"""
         raise NotImplementedError()
 
-    def perform_measurements(self, event_count_to_acquire: int):	
+    def perform_slot_measurements(self, slots: List[int], event_count_to_acquire: int,
+                                  ci_target: float = None) -> Dict[int, np.ndarray] | None:
+        """Returns slot -> acquired delays in seconds. None if stopped"""
         raise NotImplementedError()
 
-    def reset_measurements(self):
+    def reset_measurements(self, slots: List[int] = None):
         raise NotImplementedError()
     
     def close_session(self):
         raise NotImplementedError()
     
     def check_stop_event(self, func):
-        if self.stop_event.is_set():
+        if cancel_utils.is_cancelled(self.stop_event):
             print_utils.print_thread_terminated(self.script, func)
             return True
         return False
\ No newline at end of file
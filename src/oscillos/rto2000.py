@@ -1,16 +1,34 @@
 from RsInstrument import *  # The RsInstrument package is hosted on pypi.org, see Readme.txt for more details
 from ..oscillos.oscillo import Oscilloscope
+from ..oscillos.acquisition import AcquisitionController
+from ..oscillos import acquisition as acquisition_utils
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils import trace as trace_utils
 
-import time as timer
+import numpy as np
 import pathlib
+from typing import Dict, List, Tuple
 
 class RTO2000(Oscilloscope):
+	# instrument IP -> setup applied last by this process, so repeated runs skip reconfiguration
+	__applied_setups = {}
+	__MAX_BATCH_LENGTH = 1024
+	# long-term measurement results as a binary block; firmware without it falls back to the CSV export
+	LTMEAS_DATA_QUERY = "measurement{slot}:ltmeas:data?"
+	__binary_transfer_unsupported = set()
+	STATISTICS_QUERY = "measurement{slot}:result:evtcount?;:measurement{slot}:result:avg?;:measurement{slot}:result:stddev?"
+	# one channel is the switch reference, each of the others can be measured against it in its own slot
+	CHANNEL_COUNT = 4
+	max_slots = CHANNEL_COUNT - 1
+
 	def __init__(self, ip_address, data_transfer_chunk_size, root: str, stop_event = None):
 		super().__init__(root, stop_event)
 		# Make sure you have the last version of the RsInstrument
 	
 		RsInstrument.assert_minimum_version('1.53.0')
+		self.__ip_address = ip_address
+		self.trace_label = f"RTO2000 {ip_address}"
 		try:
 			self.__device = RsInstrument(f'TCPIP::{ip_address}', True, True)
 			self.__device.visa_timeout = 3000  # Timeout for VISA Read Operations
@@ -65,84 +83,198 @@ class RTO2000(Oscilloscope):
 	def query_opc(self, timeout: int = 0):
 		self.__device.query_opc(timeout)
 		return	
+
+	def write_batch(self, ops: List[str]):
+		"""Sends the commands joined with ';:' in as few writes as possible.
+		Errors are checked once for the whole batch, after an OPC barrier"""
+		is_status_checking = self.__device.instrument_status_checking
+		self.__device.instrument_status_checking = False
+		try:
+			batch = ""
+			for op in ops:
+				if batch and len(batch) + len(op) + 2 > RTO2000.__MAX_BATCH_LENGTH:
+					self.__device.write_str(batch)
+					batch = ""
+				batch = f"{batch};:{op}" if batch else op
+			if batch:
+				self.__device.write_str(batch)
+			self.__device.query_opc()
+		finally:
+			self.__device.instrument_status_checking = is_status_checking
+		if is_status_checking:
+			self.__device.check_status()
+		return
 	
-	def setup_measurements(self, switch_ch: int, node_ch: int):
+	def setup_measurements(self, switch_ch: int, node_ch: int, force: bool = False):
+		self.setup_slots(switch_ch, [node_ch], force)
+		return
+
+	def setup_slots(self, switch_ch: int, node_chs: List[int], force: bool = False):
+		"""Measures the delay of every channel in `node_chs` to `switch_ch`, node_chs[i] in measurement slot i + 1.
+		Skips reconfiguration if this process already applied the same setup and the scope still reports it"""
 		if self.check_stop_event("setup_measurements"):
 			self.close_session()
 			return
+		if not 0 < len(node_chs) <= RTO2000.max_slots:
+			raise ValueError(f"{len(node_chs)} node channels requested. RTO2000 measures 1 to {RTO2000.max_slots} at once")
+
+		ops = ["system:display:update ON", "timebase:scale 10e-9"]
+		for channel in [switch_ch, *node_chs]:
+			ops += [
+				f"channel{channel}:state 1",
+				f"channel{channel}:coupling dc",
+				f"channel{channel}:position -1.06",
+				f"channel{channel}:scale 0.5",
+			]
+		ops += [
+			f"trigger1:source channel{switch_ch}",
+			"trigger1:type edge",
+			"trigger1:edge:slope pos",
+			"trigger1:level1:value 1.0",
+			"trigger1:mode normal",
+		]
+		fingerprint_query = "trigger1:source?"
+		for slot, node_ch in enumerate(node_chs, start=1):
+			ops += RTO2000.__slot_ops(slot, switch_ch, node_ch)
+			fingerprint_query += f";:measurement{slot}:main?;:measurement{slot}:source?;:measurement{slot}:ltmeas:state?"
+		# slots left over from a run with more nodes would keep slowing the acquisition down
+		ops += [f"measurement{slot}:enable OFF" for slot in range(len(node_chs) + 1, RTO2000.max_slots + 1)]
 
-		def setup_channel(num):
-			self.write_int(f"channel{num}:state", 1)
-			self.write_str(f"channel{num}:coupling dc")
-			self.write_float(f"channel{num}:position", -1.06)
-			self.write_float(f"channel{num}:scale", 0.5)
-
-		self.write_bool("system:display:update", True)
-
-		self.write_float("timebase:scale", 10e-9)
-		for channel in [switch_ch, node_ch]:
-			setup_channel(channel)
-		self.query_opc()
-
-		self.write_str(f"trigger1:source channel{switch_ch}")
-		self.write_str("trigger1:type edge")
-		self.write_str("trigger1:edge:slope pos")
-		self.write_float("trigger1:level1:value", 1.0)
-		self.write_str("trigger1:mode normal")
-		self.query_opc()
-
-		self.write_str("measurement1:main delay")
-		self.write_str(f"measurement1:source c{switch_ch}w1, c{node_ch}w1")
-		self.query_opc()
-		self.write_str("measurement1:amptime:delay1:lselect middle")
-		self.write_str("measurement1:amptime:delay2:lselect middle")
-		self.query_opc()
-		self.write_int("measurement1:detthreshold", 5)
-		self.write_str("measurement1:amptime:delay1:slope positive")
-		self.write_str("measurement1:amptime:delay2:slope positive")
-		self.write_str("measurement1:amptime:delay1:direction FRFI")
-		self.write_str("measurement1:amptime:delay2:direction FRFI")
-		self.write_int("measurement1:amptime:delay1:ecount", 1)
-		self.write_int("measurement1:amptime:delay1:ecount", 1)
-		self.query_opc()
-
-		self.write_str("measurement1:ltmeas:state ON")
-		self.write_str("measurement1:statistics:enable ON")
-		self.write_str("measurement1:statistics:mode meas")
-		self.write_int("measurement1:statistics:rmeascount", 1)
-		self.write_str("measurement1:ltmeas:count MIN")
-		self.write_str("measurement1:vertical:cont ON")
-		self.query_opc()
+		# a cheap fingerprint of the setup: one query instead of the whole reconfiguration
+		applied = RTO2000.__applied_setups.get(self.__ip_address)
+		if not force and applied is not None and applied[0] == ops:
+			if self.__device.query_str(fingerprint_query) == applied[1]:
+				print_utils.print_info("Oscilloscope setup is unchanged since the last run. Skipped", 2)
+				return
+
+		self.write_batch(ops)
+		RTO2000.__applied_setups[self.__ip_address] = (ops, self.__device.query_str(fingerprint_query))
 		return
+
+	def __slot_ops(slot: int, switch_ch: int, node_ch: int) -> List[str]:
+		return [
+			f"measurement{slot}:main delay",
+			f"measurement{slot}:source c{switch_ch}w1, c{node_ch}w1",
+			f"measurement{slot}:amptime:delay1:lselect middle",
+			f"measurement{slot}:amptime:delay2:lselect middle",
+			f"measurement{slot}:detthreshold 5",
+			f"measurement{slot}:amptime:delay1:slope positive",
+			f"measurement{slot}:amptime:delay2:slope positive",
+			f"measurement{slot}:amptime:delay1:direction FRFI",
+			f"measurement{slot}:amptime:delay2:direction FRFI",
+			f"measurement{slot}:amptime:delay1:ecount 1",
+
+			f"measurement{slot}:ltmeas:state ON",
+			f"measurement{slot}:statistics:enable ON",
+			f"measurement{slot}:statistics:mode meas",
+			f"measurement{slot}:statistics:rmeascount 1",
+			f"measurement{slot}:ltmeas:count MIN",
+			f"measurement{slot}:vertical:cont ON",
+		]
 	
-	def perform_measurements(self, event_count_to_acquire: int):	
+	def perform_measurements(self, event_count_to_acquire: int, ci_target: float = None) -> np.ndarray | None:
+		"""Acquires delays and returns them in seconds. None if stopped.
+		Acquisition ends once the scope counted `event_count_to_acquire` events
+		or the 95% confidence interval of the mean delay narrowed to `ci_target` sec"""
+		delays = self.perform_slot_measurements([1], event_count_to_acquire, ci_target)
+		return None if delays is None else delays[1]
+
+	def perform_slot_measurements(self, slots: List[int], event_count_to_acquire: int,
+							   ci_target: float = None) -> Dict[int, np.ndarray] | None:
+		"""Acquires all the slots in one run, so they share the trigger events. Returns slot -> delays in seconds.
+		The run ends once every slot reaches the event count or the confidence interval target. None if stopped"""
 		if self.check_stop_event("perform_measurements"):
 			self.close_session()
 			return
 		print_utils.print_loop("---------- START ACQUISITION----------", 1)
-		# sleeptime = max(EVENT_COUNT_TO_ACQUIRE * 0.9, EVENT_COUNT_TO_ACQUIRE - 30)
-		self.write_str("measurement1:enable ON")
-		self.write_str("run")
-		self.query_opc()
+		self.write_batch([f"measurement{slot}:enable ON" for slot in slots] + ["run"])
 
 		# ----------- accessing measurement results ----------- 
 		print_utils.print_loop("---------- WAITING FOR ACQUISITION TO BE DONE----------", 1)
-		for i in range(event_count_to_acquire):
+		acquisition = AcquisitionController(
+			lambda: self.__read_slowest_statistics(slots),
+			target_count=event_count_to_acquire,
+			ci_target=ci_target,
+			is_stopped=lambda: self.check_stop_event("perform_measurements"),
+			stop_event=self.stop_event)
+		with trace_utils.span("acquire", trace_utils.OSCILLOSCOPE, self.trace_label, slots=slots):
+			reason = acquisition.wait()
+		if reason == acquisition_utils.STOPPED:
+			self.write_str("stop")
+			self.close_session()
+			return None
+		print_utils.print_loop(f"Acquisition done ({reason}): {acquisition.count} events", 2)
+		
+		self.write_str("stop")
+		delays = {}
+		for slot in slots:
 			if self.check_stop_event("perform_measurements"):
-				self.write_str("stop")
 				self.close_session()
 				return None
-			timer.sleep(1)
-		
-		self.write_str("stop")
-		self.write_str("export:measurement:select MEAS1")
+			with trace_utils.span("transfer", trace_utils.OSCILLOSCOPE, self.trace_label, slot=slot):
+				delays[slot] = self.__transfer_slot(slot)
+			if delays[slot] is None:
+				return None
+		return delays
+
+	def read_statistics(self, slot: int = 1) -> Tuple[int, float, float]:
+		"""Returns (event count, mean, standard deviation) of the measurement slot in one query"""
+		count, mean, std = self.__device.query_str(RTO2000.STATISTICS_QUERY.format(slot=slot)).split(";")
+		return int(float(count)), float(mean), float(std)
+
+	def __read_slowest_statistics(self, slots: List[int]) -> Tuple[int, float, float]:
+		"""Statistics of the slots folded so that the acquisition waits for the slowest one:
+		the smallest event count and a deviation giving the widest confidence interval at that count"""
+		statistics = [self.read_statistics(slot) for slot in slots]
+		if len(statistics) == 1:
+			return statistics[0]
+		min_count = min(count for count, _, _ in statistics)
+		if min_count < 2:
+			return min_count, np.nan, np.nan
+		widest = max(std / np.sqrt(count) for count, _, std in statistics)
+		return min_count, np.nan, float(widest * np.sqrt(min_count))
+
+	def __transfer_slot(self, slot: int) -> np.ndarray | None:
+		"""A stop event set during the transfer closes the session, which cuts the blocked VISA read short"""
+		with cancel_utils.on_cancel(self.stop_event, self.__abort_session):
+			try:
+				return self.__transfer_slot_data(slot)
+			except Exception:
+				if cancel_utils.is_cancelled(self.stop_event):
+					print_utils.print_thread_terminated(self.script, "perform_measurements")
+					return None
+				raise
+
+	def __transfer_slot_data(self, slot: int) -> np.ndarray | None:
+		if self.__ip_address not in RTO2000.__binary_transfer_unsupported:
+			try:
+				return self.query_binary_floats(RTO2000.LTMEAS_DATA_QUERY.format(slot=slot))
+			except RsInstrException as ex:
+				if cancel_utils.is_cancelled(self.stop_event):
+					raise
+				RTO2000.__binary_transfer_unsupported.add(self.__ip_address)
+				self.__device.clear_status()
+				print_utils.print_info(f"Binary transfer of measurements is unsupported ({ex}). Using CSV export", 1)
+		return self.__export_measurements(slot)
+
+	def query_binary_floats(self, query: str) -> np.ndarray:
+		"""Transfers REAL,32 values as one binary block straight into an array, no files involved"""
+		self.__device.write_str("format:data REAL,32;:format:border LSBFirst")
+		try:
+			block = self.__device.query_bin_block(query)
+		finally:
+			self.__device.write_str("format:data ASCII")
+		return np.frombuffer(block, dtype="<f4").astype(np.float64)
+
+	def __export_measurements(self, slot: int = 1) -> np.ndarray | None:
+		self.write_str(f"export:measurement:select MEAS{slot}")
 		self.write_str("export:measurement:type LONGTERM")
 		temp_file_path = "C:\\temp\\temp"
 		self.write_str(f"export:measurement:name '{temp_file_path}.csv'")
 		self.write_str_with_opc("export:measurement:save")
 
 		self.__device.events.on_read_handler = transfer_handler
-		file_path_to_results = f"{pathlib.Path().resolve()}\\meas1.csv"
+		file_path_to_results = f"{pathlib.Path().resolve()}\\meas{slot}.csv"
 		if self.check_stop_event("perform_measurements"):
 			self.close_session()
 			return None
@@ -151,12 +283,16 @@ class RTO2000(Oscilloscope):
 			file_path_to_results
 		)
 		self.__device.events.on_read_handler = None
-		return file_path_to_results
+		return np.genfromtxt(file_path_to_results, delimiter=",", usecols=0, ndmin=1) # 1-D like the binary path, even for a single row
 	
-	def reset_measurements(self):
-		self.write_str_with_opc("measurement1:statistics:reset")
+	def reset_measurements(self, slots: List[int] = None):
+		self.write_batch([f"measurement{slot}:statistics:reset" for slot in (slots or [1])])
 		return
 
+	def __abort_session(self):
+		if self.__device.is_connection_active:
+			self.__device.close()
+
 	def close_session(self):
 		if (self.__device.is_connection_active):
 			self.__device.events.on_read_handler = None
@@ -175,4 +311,3 @@ def transfer_handler(args):
 	if args.end_of_transfer:
 		print_utils.print_info('--- transferring finished ---', 2)
 		return
-	timer.sleep(1)
@@ -0,0 +1,147 @@
+from .oscillo import Oscilloscope
+from .acquisition import AcquisitionController
+from . import acquisition as acquisition_utils
+from ..utils import print as print_utils
+from ..utils import trace as trace_utils
+
+import numpy as np
+import time as timer
+from typing import Callable, Dict, List, Tuple
+
+class SimScope(Oscilloscope):
+    """Oscilloscope stand-in measuring simulated skew delays, one measurement slot per node channel.
+    Delays of a channel are normal around the mean its `delay_sources` callable returns in ps, e.g.
+    SimWrpcNode.pps_delay_ps of the node wired to it, so a calibration written to the node shows in the next run.
+    Events arrive at `event_rate` per sec and the acquisition is awaited by the same controller RTO2000 uses"""
+
+    max_slots = 3
+
+    def __init__(self, root = None, stop_event = None, delay_sources: Dict[int, Callable[[], float]] = None,
+                 jitter_ps: float = 10.0, outlier_rate: float = 0.0, event_rate: float = 1000.0, seed: int = None):
+        super().__init__(root, stop_event)
+        self.delay_sources = delay_sources if delay_sources is not None else {}
+        self.jitter_ps = jitter_ps
+        self.outlier_rate = outlier_rate
+        self.event_rate = event_rate
+        self.commands: List[str] = [] # every command written, for inspection
+        self.__random = np.random.default_rng(seed)
+        self.__slot_channels: Dict[int, int] = {}
+        self.__run: Dict[int, np.ndarray] = {} # slot -> delays of the running acquisition in seconds
+        self.__run_started_at = None
+        self.trace_label = "SimScope"
+
+    def write(self, op: str):
+        self.commands.append(op)
+
+    def write_str(self, op: str):
+        self.write(op)
+
+    def write_str_with_opc(self, op: str, timeout: int = None):
+        self.write(op)
+
+    def write_int(self, op: str, arg: int):
+        self.write(f"{op} {arg}")
+
+    def write_int_with_opc(self, op: str, arg: int, timeout: int = None):
+        self.write_int(op, arg)
+
+    def write_float(self, op: str, arg: float):
+        self.write(f"{op} {arg}")
+
+    def write_float_with_opc(self, op: str, arg: float, timeout: int = None):
+        self.write_float(op, arg)
+
+    def write_bool(self, op: str, arg: bool):
+        self.write(f"{op} {'ON' if arg else 'OFF'}")
+
+    def write_bool_with_opc(self, op: str, arg: bool, timeout: int = None):
+        self.write_bool(op, arg)
+
+    def write_batch(self, ops: List[str]):
+        self.commands += ops
+
+    def query(self, query: str):
+        self.commands.append(query)
+        return "1" if query.strip().upper() == "*OPC?" else "SIM,SimScope,0,0"
+
+    def query_opc(self, timeout: int = 0):
+        return 1
+
+    def setup_measurements(self, switch_ch: int, node_ch: int, force: bool = False):
+        self.setup_slots(switch_ch, [node_ch], force)
+
+    def setup_slots(self, switch_ch: int, node_chs: List[int], force: bool = False):
+        if self.check_stop_event("setup_measurements"):
+            return
+        if not 0 < len(node_chs) <= SimScope.max_slots:
+            raise ValueError(f"{len(node_chs)} node channels requested. SimScope measures 1 to {SimScope.max_slots} at once")
+        self.__slot_channels = {slot: channel for slot, channel in enumerate(node_chs, start=1)}
+        self.write_batch([f"measurement{slot}:source C{switch_ch}W1, C{channel}W1"
+                          for slot, channel in self.__slot_channels.items()])
+
+    def perform_measurements(self, event_count_to_acquire: int, ci_target: float = None) -> np.ndarray | None:
+        delays = self.perform_slot_measurements([1], event_count_to_acquire, ci_target)
+        return delays[1] if delays is not None else None
+
+    def perform_slot_measurements(self, slots: List[int], event_count_to_acquire: int,
+                                  ci_target: float = None) -> Dict[int, np.ndarray] | None:
+        if self.check_stop_event("perform_measurements"):
+            return None
+        print_utils.print_loop("---------- START ACQUISITION----------", 1)
+        self.__run = {slot: self.__draw(slot, event_count_to_acquire) for slot in slots}
+        self.__run_started_at = timer.monotonic()
+        self.write_batch([f"measurement{slot}:enable ON" for slot in slots] + ["run"])
+
+        acquisition = AcquisitionController(
+            lambda: self.__read_slowest_statistics(slots),
+            target_count=event_count_to_acquire,
+            ci_target=ci_target,
+            is_stopped=lambda: self.check_stop_event("perform_measurements"),
+            poll_interval=min(0.25, 10 / self.event_rate),
+            stop_event=self.stop_event)
+        with trace_utils.span("acquire", trace_utils.OSCILLOSCOPE, self.trace_label, slots=slots):
+            reason = acquisition.wait()
+        self.write_str("stop")
+        if reason == acquisition_utils.STOPPED:
+            return None
+        count = self.__acquired_count()
+        print_utils.print_loop(f"Acquisition done ({reason}): {count} events", 2)
+        return {slot: delays[:count].copy() for slot, delays in self.__run.items()}
+
+    def read_statistics(self, slot: int = 1) -> Tuple[int, float, float]:
+        """Returns (event count, mean, standard deviation) of the running acquisition of the slot"""
+        delays = self.__run[slot][:self.__acquired_count()]
+        if len(delays) == 0:
+            return 0, np.nan, np.nan
+        return len(delays), float(delays.mean()), float(delays.std(ddof=1)) if len(delays) > 1 else np.nan
+
+    def reset_measurements(self, slots: List[int] = None):
+        self.write_batch([f"measurement{slot}:statistics:reset" for slot in (slots or [1])])
+
+    def close_session(self):
+        pass
+
+    def __acquired_count(self) -> int:
+        if self.__run_started_at is None or not self.__run:
+            return 0
+        total = len(next(iter(self.__run.values())))
+        return min(int((timer.monotonic() - self.__run_started_at) * self.event_rate), total)
+
+    def __read_slowest_statistics(self, slots: List[int]) -> Tuple[int, float, float]:
+        statistics = [self.read_statistics(slot) for slot in slots]
+        if len(statistics) == 1:
+            return statistics[0]
+        count = statistics[0][0] # slots share the trigger events
+        if count < 2:
+            return count, np.nan, np.nan
+        return count, np.nan, max(std for _, _, std in statistics)
+
+    def __draw(self, slot: int, count: int) -> np.ndarray:
+        """Delays of `count` events of the slot in seconds, a `outlier_rate` share of them a nanosecond off"""
+        source = self.delay_sources.get(self.__slot_channels.get(slot, slot))
+        mean = source() if source is not None else 0.0
+        delays = self.__random.normal(mean, self.jitter_ps, count)
+        if self.outlier_rate:
+            outliers = self.__random.random(count) < self.outlier_rate
+            delays[outliers] += self.__random.choice([-1000.0, 1000.0], outliers.sum())
+        return delays * 10 ** -12
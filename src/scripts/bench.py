@@ -0,0 +1,283 @@
+from ..connection import sim_snmp_agent
+from ..connection.sim_connect import Sim_Connect, SimWrpcConsole, SimWrpcNode
+from ..connection.snmp_connect import SNMP_Connect
+from ..connection.stat_parser import StatParser
+from ..oscillos.sim_scope import SimScope
+from . import remote_config
+from . import calib_refine
+from ..utils import print as print_utils
+from ..utils.stats import ConvergenceTracker, allan_deviation
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time as timer
+import numpy as np
+from typing import Callable, Dict, List
+
+script_name = "bench"
+
+FORMAT_VERSION = 1
+BENCHMARKS = ("fleet", "snmp", "stat", "ingest", "calib")
+HIGHER = "higher"
+LOWER = "lower"
+
+def main(args_list=None) -> int:
+    parser = argparse.ArgumentParser(
+    prog=script_name,
+    description='Benchmarks of fleet configuration, SNMP calls, stat parsing and calibration against the simulated node, SNMP agent and oscilloscope'
+    )
+    parser.add_argument("-b", "--bench", choices=BENCHMARKS, action="append",
+                        help="benchmark group to run. May be repeated. Default: all")
+    parser.add_argument("-o", "--output", help="path of the JSON results file. Default: bench.json", default="bench.json")
+    parser.add_argument("--baseline", help="JSON results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", help="slowdown in %% against the baseline reported as a regression. Default: 10", default=10, type=float)
+    parser.add_argument("--sizes", help="fleet sizes of the fleet benchmark. Default: 10 100 1000", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("-j", "--jobs", help="nodes configured in parallel by the fleet benchmark. Default: 16", default=16, type=int)
+    parser.add_argument("--calls", help="calls per operation of the SNMP benchmark. Default: 200", default=200, type=int)
+    parser.add_argument("--repeat", help="runs of every benchmark; the median is reported. Default: 3", default=3, type=int)
+    parser.add_argument("--port", help="UDP port of the simulated SNMP agents. Default: 16161", default=16161, type=int)
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity", default=0)
+    args = parser.parse_args(args=args_list)
+
+    if args.repeat < 1 or args.calls < 1 or args.jobs < 1 or any(x < 1 for x in args.sizes):
+        print_utils.print_error("--repeat, --calls, --jobs and --sizes accept positive integers only")
+        return 1
+    if args.tolerance < 0:
+        print_utils.print_error(f"Invalid --tolerance value ({args.tolerance}). Only non-negative numbers are excepted")
+        return 1
+
+    return launch(
+        BENCHMARK_GROUPS = args.bench or list(BENCHMARKS),
+        FLEET_SIZES =      args.sizes,
+        JOBS =             args.jobs,
+        SNMP_CALLS =       args.calls,
+        REPEAT =           args.repeat,
+        SNMP_PORT =        args.port,
+        OUTPUT =           args.output,
+        BASELINE =         args.baseline,
+        TOLERANCE =        args.tolerance,
+        VERBOSITY_LEVEL =  args.verbosity
+    )
+
+def launch(
+        BENCHMARK_GROUPS: List[str],
+        FLEET_SIZES: List[int],
+        JOBS: int,
+        SNMP_CALLS: int,
+        REPEAT: int,
+        SNMP_PORT: int,
+        OUTPUT: str,
+        BASELINE: str,
+        TOLERANCE: float,
+        VERBOSITY_LEVEL: int
+) -> int:
+    """Returns 1 if a benchmark regressed by more than TOLERANCE % against the baseline, 0 otherwise"""
+    print_utils.set_print_verbosity_lvl(VERBOSITY_LEVEL)
+
+    results: Dict[str, dict] = {}
+    groups = {
+        "fleet":  lambda: {name: result for size in FLEET_SIZES
+                           for name, result in __bench_fleet(size, JOBS, SNMP_PORT, REPEAT).items()},
+        "snmp":   lambda: __bench_snmp(SNMP_CALLS),
+        "stat":   lambda: __bench_stat_parsing(REPEAT),
+        "ingest": lambda: __bench_ingest(REPEAT),
+        "calib":  lambda: __bench_calib(REPEAT),
+    }
+    for group in BENCHMARK_GROUPS:
+        print_utils.print_info(f"Running {group} benchmarks...", 0)
+        results.update(groups[group]())
+
+    report = {
+        "version": FORMAT_VERSION,
+        "created": timer.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if BASELINE is not None:
+        with open(BASELINE, "r") as baseline_file:
+            report["baseline"] = BASELINE
+            report["comparison"] = compare(results, json.load(baseline_file)["results"], TOLERANCE)
+    with open(OUTPUT, "w") as output:
+        json.dump(report, output, indent=2)
+
+    __print_table(results, report.get("comparison", {}))
+    print_utils.print_info(f"Results are written to {OUTPUT}", 0)
+    regressions = [name for name, x in report.get("comparison", {}).items() if x["regression"]]
+    if regressions:
+        print_utils.print_error(f"{len(regressions)} benchmark(s) regressed by more than {TOLERANCE}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> Dict[str, dict]:
+    """Change of every benchmark present in both runs. `change` is in % and positive when it got better"""
+    comparison = {}
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or base["metric"] != result["metric"] or not base["value"]:
+            continue
+        change = (result["value"] - base["value"]) / base["value"] * 100
+        if result["better"] == LOWER:
+            change = -change
+        comparison[name] = {"baseline": base["value"], "change": round(change, 2), "regression": change < -tolerance}
+    return comparison
+
+def __result(metric: str, unit: str, better: str, samples: List[float], **extra) -> dict:
+    """Median of the samples is the value compared between runs"""
+    return dict({"metric": metric, "unit": unit, "better": better, "value": float(np.median(samples)),
+                 "samples": [float(x) for x in samples]}, **extra)
+
+@contextlib.contextmanager
+def __quiet():
+    """Hides what the benchmarked scripts print and restores the verbosity they set"""
+    verbosity = max(x for x in range(3) if print_utils.is_verbosity_printable(x))
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            yield
+        finally:
+            print_utils.set_print_verbosity_lvl(verbosity)
+
+def __bench_fleet(size: int, jobs: int, port: int, repeat: int) -> Dict[str, dict]:
+    """Nodes per second of `remote_config -f` configuring `size` simulated nodes"""
+    fleet = sim_snmp_agent.start_fleet(size, port=port)
+    ips_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "fleet.ips")
+    with open(ips_path, "w") as ips:
+        ips.write("\n".join(fleet.hosts))
+    rates, failed = [], 0
+    try:
+        for run in range(repeat):
+            tx, rx = 1000 + run, 2000 + run # new values every run, so every SET changes the node
+            started = timer.perf_counter()
+            with __quiet():
+                remote_config.main(["-f", ips_path, str(tx), str(rx), "0", "-j", str(jobs), "--port", str(port)])
+            elapsed = timer.perf_counter() - started
+            configured = sum(1 for agent in fleet.agents
+                             if (entry := agent.node.find_sfp(agent.node.sfp_pns[0])) is not None and (entry.tx, entry.rx) == (tx, rx))
+            failed += size - configured
+            rates.append(configured / elapsed)
+            print_utils.print_info(f"fleet of {size}: {configured} nodes configured in {elapsed:.2f} sec", 1)
+    finally:
+        fleet.stop()
+        os.remove(ips_path)
+        os.rmdir(os.path.dirname(ips_path))
+    return {f"fleet_{size}": __result("nodes_per_sec", "nodes/s", HIGHER, rates, nodes=size, jobs=jobs, failed=failed)}
+
+def __bench_snmp(calls: int) -> Dict[str, dict]:
+    """Per-call latency of SNMP_Connect operations against one simulated agent"""
+    agent = sim_snmp_agent.SimSnmpAgent(seed=1).start()
+    agent.node.add_sfp(agent.node.sfp_pns[0], 0, 0, 0)
+    con = SNMP_Connect(mibs="WR-WRPC-MIB", libs=[sim_snmp_agent.MIBS_FOLDER], ip=agent.host, root_script=script_name, port=agent.port)
+    operations: Dict[str, Callable[[], object]] = {
+        "snmp_get":       lambda: con.snmpget("wrpcPtpServoStateN.0", hide=True),
+        "snmp_get_multi": lambda: con.snmpget_values(["wrpcPtpServoStateN.0", "wrpcPtpClockOffsetPsHR.0",
+                                                      "wrpcPtpRTT.0", "wrpcPtpSkew.0"], hide=True),
+        "snmp_set":       lambda: con.snmpset("wrpcPtpConfigDeltaTx.0", 100, hide=True),
+        "snmp_walk":      lambda: con.snmpwalk("wrpcPtpGroup", hide=True),
+        "snmp_table":     lambda: con.snmptable("wrpcSfpTable"),
+    }
+    results = {}
+    try:
+        with __quiet():
+            for name, operation in operations.items():
+                operation() # warm-up: MIB index and caches
+                latencies = []
+                for _ in range(calls):
+                    started = timer.perf_counter()
+                    operation()
+                    latencies.append((timer.perf_counter() - started) * 10 ** 6)
+                results[name] = __result("latency_p50", "us", LOWER, latencies,
+                                         p95=float(np.percentile(latencies, 95)), mean=float(np.mean(latencies)))
+                results[name].pop("samples") # one per call: too many to keep
+    finally:
+        con.close()
+        agent.stop()
+    return results
+
+def __bench_stat_parsing(repeat: int, line_count: int = 50000) -> Dict[str, dict]:
+    """Lines per second of StatParser fed with a console stream in chunks and line by line"""
+    node = SimWrpcNode(seed=1, lock_time=0)
+    node.add_sfp(node.sfp_pns[0], 400000, 400000, 0)
+    node.start_ptp()
+    lines = [node.stat_line() for _ in range(line_count)]
+    stream = "\r\n".join(lines).encode("utf-8") + b"\r\n"
+    chunks = [stream[i:i + 4096] for i in range(0, len(stream), 4096)]
+
+    chunk_rates, line_rates = [], []
+    for _ in range(repeat):
+        parser = StatParser()
+        started = timer.perf_counter()
+        for chunk in chunks:
+            parser.feed(chunk)
+        chunk_rates.append(parser.count / (timer.perf_counter() - started))
+
+        parser = StatParser()
+        started = timer.perf_counter()
+        parser.feed_lines(lines)
+        line_rates.append(parser.count / (timer.perf_counter() - started))
+    return {
+        "stat_parse_stream": __result("lines_per_sec", "lines/s", HIGHER, chunk_rates, lines=line_count),
+        "stat_parse_lines": __result("lines_per_sec", "lines/s", HIGHER, line_rates, lines=line_count),
+    }
+
+def __bench_ingest(repeat: int, batch_size: int = 100000, batches: int = 10) -> Dict[str, dict]:
+    """Samples per second calib_refine takes in: the per-iteration statistics over acquired delays"""
+    random = np.random.default_rng(1)
+    acquired = [random.normal(1500e-12, 10e-12, batch_size) for _ in range(batches)]
+    rates = []
+    for _ in range(repeat):
+        tracker = ConvergenceTracker(target=0.1, outlier_threshold=5, bin_width=1.0, capacity=batch_size * batches)
+        started = timer.perf_counter()
+        for seconds in acquired:
+            delays = seconds * 10 ** 12
+            tracker.push_batch(delays)
+            np.mean(delays), allan_deviation(delays)
+            tracker.ci_half_width(), tracker.batch_adev, tracker.is_converged()
+        rates.append(batch_size * batches / (timer.perf_counter() - started))
+    return {"calib_ingest": __result("samples_per_sec", "samples/s", HIGHER, rates, batch_size=batch_size, batches=batches)}
+
+def __bench_calib(repeat: int, event_count: int = 10000, iterations: int = 3) -> Dict[str, dict]:
+    """Wall time of a whole calib_refine run against a fast simulated node and oscilloscope, i.e. the tool's own overhead"""
+    durations = []
+    for _ in range(repeat):
+        node = SimWrpcNode(delays_ps=(1500.0,), lock_time=0.05, seed=1)
+        con = Sim_Connect(script_name, console=SimWrpcConsole(node, latency=0.001, stat_period=0.01))
+        tic = SimScope(root=script_name, delay_sources={2: lambda: node.pps_delay_ps(0)}, event_rate=10 ** 6, seed=1)
+        started = timer.perf_counter()
+        with __quiet():
+            calib_refine.launch(
+                INSTR_MODEL =                "sim",
+                INSTR_IP =                   "127.0.0.1",
+                TIC_SWITCH_CHANNEL =         1,
+                TIC_NODE_CHANNEL =           2,
+                TTY_USB_PORT_NUM =           0,
+                WR_NODE_SFP_PORT =           0,
+                DATA_TRANSFER_CHUNK_SIZE =   100000,
+                CRTT_TIME =                  1,
+                EVENT_COUNT_TO_ACQUIRE =     event_count,
+                ITERATIONS_PER_CALIBRATION = iterations,
+                IS_SSH_MODE =                False,
+                SSH_HOST_NAME =              None,
+                SSH_CONNECT_PWD =            None,
+                SSH_HOST_ROOT_PWD =          None,
+                VERBOSITY_LEVEL =            0,
+                CONNECTION =                 con,
+                OSCILLOSCOPE =               tic
+            )
+        durations.append(timer.perf_counter() - started)
+        con.close()
+        print_utils.print_info(f"calib_refine: {durations[-1]:.2f} sec, residual delay {node.pps_delay_ps(0):.2f} ps", 1)
+    return {"calib_refine": __result("duration", "s", LOWER, durations, events=event_count, iterations=iterations)}
+
+def __print_table(results: Dict[str, dict], comparison: Dict[str, dict]):
+    print_utils.print_untagged(f"{'benchmark':<20} {'metric':<16} {'value':>14} {'unit':<10} {'baseline':>14} {'change':>9}", 0)
+    for name, result in results.items():
+        line = f"{name:<20} {result['metric']:<16} {result['value']:>14.2f} {result['unit']:<10}"
+        if name in comparison:
+            compared = comparison[name]
+            line += f" {compared['baseline']:>14.2f} {compared['change']:>+8.1f}%" + (" REGRESSION" if compared["regression"] else "")
+        print_utils.print_untagged(line.rstrip(), 0)
@@ -0,0 +1,336 @@
+from ..oscillos.rto2000 import RTO2000
+from ..oscillos.oscillo import Oscilloscope
+from ..oscillos.sim_scope import SimScope
+from ..connection.ssh_connect import SSH_Connect, TTY_EXEC, TTY_RELAY, TTY_AGENT
+from ..connection.direct_connect import Direct_Connect
+from ..connection.sim_connect import Sim_Connect
+from ..connection.connection import Connection
+
+from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils import regex as regex_utils
+from ..utils import ip as ip_utils
+from ..utils import trace as trace_utils
+from ..utils.stats import ConvergenceTracker
+from ..utils import jobs as job_utils
+from ..utils.jobs import JobScheduler
+
+import argparse
+import numpy as np
+from typing import Callable, List, Tuple
+
+calib_multi_stop_event = cancel_utils.ScriptStopEvent(f"{__name__}.stop_event")
+script_name = "calib_multi"
+
+class _Node:
+    """WR-Node calibrated in one measurement slot of the oscilloscope"""
+
+    def __init__(self, slot: int, channel: int, tty_usb_port: int, sfp_port: int, connection: Connection,
+                 delays: ConvergenceTracker, host: str = None):
+        self.slot = slot
+        self.channel = channel
+        self.tty_usb_port = tty_usb_port
+        self.sfp_port = sfp_port
+        self.connection = connection
+        self.delays = delays
+        self.name = f"ttyUSB{tty_usb_port} (ch{channel})"
+        self.resource = job_utils.tty_resource(tty_usb_port, host)
+
+def assign_calib_multi_stop_event(event):
+    calib_multi_stop_event.assign(event)
+    return
+
+def main(args_list=None, stop_event=None):
+    """`stop_event` stops this run only. The assigned stop event is watched without it"""
+    with calib_multi_stop_event.bind(stop_event):
+        return __main(args_list)
+
+def __main(args_list):
+    parser = argparse.ArgumentParser(
+    prog=script_name,
+    description='refine calibration data of up to 3 WR-nodes at once, each measured against the WR-Switch in its own oscilloscope channel (RTO 2000 supported only)'
+    )
+    parser.add_argument("instrmodel", choices=['rto2000', 'sim'], help="oscilloscope model which API to access. sim - simulated oscilloscope and WR-Nodes, no hardware is accessed")
+    parser.add_argument('instrip', help="oscilloscope's IP to connect to")
+    parser.add_argument('time', help="time per calibration iteration", type=int)
+    parser.add_argument('iter', help="number of iterations for calibration (the maximum one if --target is set)", type=int)
+    parser.add_argument("-n", "--node", nargs=3, type=int, action="append", required=True, metavar=("CHANNEL", "TTYUSB", "WRNDSFP"),
+                        help="oscilloscope channel, ttyUSB port number and SFP port number of a WR-Node. Repeat for every node")
+    parser.add_argument('--dtcs', help="Data Transfer Chunk Size to use while sending measurements to controlling device", default=100000, type=int)
+    parser.add_argument('--ci', help="stop an iteration once the 95%% confidence interval half-width of the mean delay of every node is below this value in ps. Default: 0 - acquire all events", default=0, type=float)
+    parser.add_argument('--target', help="stop iterating once the 95%% confidence interval half-width of the total mean delay of every node is below this value in ps. Default: 0 - run all iterations", default=0, type=float)
+    parser.add_argument('--mad', help="reject delays further than this many robust sigmas (1.4826 * MAD) from the iteration median. 0 disables rejection. Default: 5", default=5, type=float)
+    parser.add_argument('--crtt', help="crtt calibration time in seconds. Passing -1 disables crtt reset and calibration; 0 resets coefs, but doesn't calibrate crtt. Default: 60 sec", default=60, type=int)
+    parser.add_argument('--wfrchsw', help="oscilloscope channel the WR-Switch is connected to", default=1, type=int)
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity", default=0)
+
+    parser.add_argument("-s", '--ssh', action='store_true', help='Enable SSH connection to PC the calibrated WR-Nodes are connected to')
+    parser.add_argument('--sshhostname', help="IP address of remote server the WR Nodes are connected to. (required if --ssh is set)")
+    parser.add_argument('--sshpwd', help="password to use for connecting via SSH. (required if --ssh is set)")
+    parser.add_argument('--sshhostrootpwd', help="password to use for login as root on host. Default: equals to sshpwd. (required if --ssh is set)")
+    parser.add_argument('--sshttymode', choices=[TTY_EXEC, TTY_RELAY, TTY_AGENT], default=TTY_RELAY,
+                        help="how the WR-Node ttys are reached on the host: exec - command per access, relay - one streaming channel, agent - one channel to an uploaded helper (needs python3 on host). Default: relay")
+    parser.add_argument('--trace', help="time the phases of the run per node: print a summary table of them and write a Chrome trace (chrome://tracing, Perfetto) to this file")
+
+    args = parser.parse_args(args=args_list)
+
+    if not ip_utils.is_ip_valid(args.instrip):
+        print_utils.print_error(f"Invalid instrument IP: {args.instrip}. Expected format is 2.22.215.05")
+        return 1
+
+    if len(args.node) > RTO2000.max_slots:
+        print_utils.print_error(f"{len(args.node)} nodes passed. Up to {RTO2000.max_slots} nodes are calibrated at once")
+        return 1
+    channels = [args.wfrchsw] + [channel for channel, _, _ in args.node]
+    tty_ports = [tty_usb_port for _, tty_usb_port, _ in args.node]
+    if len(set(channels)) != len(channels) or len(set(tty_ports)) != len(tty_ports):
+        print_utils.print_error("Every node needs its own oscilloscope channel and ttyUSB port, distinct from the WR-Switch channel")
+        return 1
+
+    if args.ssh:
+        missing_options = []
+        if args.sshhostname is None:
+            missing_options.append('--sshhostname')
+        if args.sshpwd is None:
+            missing_options.append('--sshpwd')
+        if missing_options:
+            print_utils.print_error(f"When --ssh is set, the following options are required: {', '.join(missing_options)}")
+            return 1
+        if not regex_utils.check_ssh_hostname_valid(args.sshhostname):
+            print_utils.print_error(f"Invalid ssh host name format: {args.sshhostname}. Expected format is host_name@2.22.215.05")
+            return 1
+
+    if args.crtt < -1:
+        print_utils.print_error(f"Invalid --crtt value ({args.crtt}). --crtt excepts only non-negative integers or -1")
+        return 1
+
+    if args.ci < 0 or args.target < 0 or args.mad < 0:
+        print_utils.print_error(f"Invalid --ci ({args.ci}), --target ({args.target}) or --mad ({args.mad}) value. Only non-negative numbers are excepted")
+        return 1
+
+    if args.sshhostrootpwd is None:
+        args.sshhostrootpwd = args.sshpwd
+
+    if is_stop_event_set():
+        print_utils.print_thread_terminated(script_name, "main")
+        return
+
+    if args.trace is not None:
+        trace_utils.enable_tracing()
+    try:
+        with trace_utils.span(script_name):
+            is_calibrated = launch(
+                INSTR_MODEL =                args.instrmodel,
+                INSTR_IP =                   args.instrip,
+                TIC_SWITCH_CHANNEL =         args.wfrchsw,
+                NODES =                      [tuple(node) for node in args.node],
+                DATA_TRANSFER_CHUNK_SIZE =   args.dtcs,
+                CRTT_TIME =                  args.crtt,
+                EVENT_COUNT_TO_ACQUIRE =     args.time,
+                ITERATIONS_PER_CALIBRATION = args.iter,
+                IS_SSH_MODE =                args.ssh,
+                SSH_HOST_NAME =              args.sshhostname,
+                SSH_CONNECT_PWD =            args.sshpwd,
+                SSH_HOST_ROOT_PWD =          args.sshhostrootpwd,
+                SSH_TTY_MODE =               args.sshttymode,
+                ACQUISITION_CI =             args.ci,
+                CONFIDENCE_TARGET =          args.target,
+                OUTLIER_THRESHOLD =          args.mad,
+                VERBOSITY_LEVEL =            args.verbosity
+            )
+    finally:
+        trace_utils.finish_tracing(args.trace)
+    return 0 if is_calibrated else 1
+
+def launch(
+        INSTR_MODEL: str,
+        INSTR_IP: str,
+        TIC_SWITCH_CHANNEL: int,
+        NODES: List[Tuple[int, int, int]],
+        DATA_TRANSFER_CHUNK_SIZE: int,
+        CRTT_TIME: int,
+        EVENT_COUNT_TO_ACQUIRE: int,
+        ITERATIONS_PER_CALIBRATION: int,
+        IS_SSH_MODE: bool,
+        SSH_HOST_NAME: str,
+        SSH_CONNECT_PWD: str,
+        SSH_HOST_ROOT_PWD: str,
+        VERBOSITY_LEVEL: int,
+        SSH_TTY_MODE: str = TTY_RELAY,
+        ACQUISITION_CI: float = 0,
+        CONFIDENCE_TARGET: float = 0,
+        OUTLIER_THRESHOLD: float = 5,
+        CONNECTIONS: List[Connection] = None,
+        OSCILLOSCOPE: Oscilloscope = None
+) -> bool:
+    """NODES are (oscilloscope channel, ttyUSB port, SFP port). Node connections are driven concurrently,
+    while the oscilloscope acquires all the nodes in one run.
+    CONNECTIONS (one per node) and OSCILLOSCOPE replace the ones the mode and model would open, e.g. with tuned simulators.
+    True once every node is calibrated"""
+
+    print_utils.set_print_verbosity_lvl(VERBOSITY_LEVEL)
+
+    nodes: List[_Node] = []
+    for slot, (channel, tty_usb_port, sfp_port) in enumerate(NODES, start=1):
+        if CONNECTIONS is not None:
+            con = CONNECTIONS[slot - 1]
+        elif INSTR_MODEL == "sim":
+            con = Sim_Connect(tty_usb_port=tty_usb_port,
+                              root=script_name,
+                              stop_event=calib_multi_stop_event.get())
+        elif IS_SSH_MODE:
+            con = SSH_Connect(host_name=SSH_HOST_NAME,
+                              connect_pwd=SSH_CONNECT_PWD,
+                              host_root_pwd=SSH_HOST_ROOT_PWD,
+                              tty_usb_port=tty_usb_port,
+                              tty_mode=SSH_TTY_MODE,
+                              root=script_name,
+                              stop_event=calib_multi_stop_event.get())
+        else:
+            con = Direct_Connect(tty_usb_port=tty_usb_port,
+                                 root=script_name,
+                                 stop_event=calib_multi_stop_event.get())
+        delays = ConvergenceTracker(target=CONFIDENCE_TARGET if CONFIDENCE_TARGET > 0 else None,
+                                    outlier_threshold=OUTLIER_THRESHOLD,
+                                    bin_width=1.0,
+                                    capacity=EVENT_COUNT_TO_ACQUIRE * ITERATIONS_PER_CALIBRATION)
+        nodes.append(_Node(slot, channel, tty_usb_port, sfp_port, con, delays, SSH_HOST_NAME if IS_SSH_MODE else None))
+
+    if not __for_each_node(nodes, lambda node: __prepare_node(node, CRTT_TIME)):
+        return __terminate("launch", nodes)
+
+    # ----------- start instrument -----------
+    print_utils.print_info("---------- START OSCILLOSCOPE SESSION ----------", 1)
+    tic = Oscilloscope()
+    if OSCILLOSCOPE is not None:
+        tic = OSCILLOSCOPE
+    elif (INSTR_MODEL == "rto2000"):
+        tic = RTO2000(ip_address=INSTR_IP,
+                      data_transfer_chunk_size=DATA_TRANSFER_CHUNK_SIZE,
+                      root=script_name,
+                      stop_event=calib_multi_stop_event.get())
+    elif (INSTR_MODEL == "sim"):
+        tic = SimScope(root=script_name,
+                       stop_event=calib_multi_stop_event.get(),
+                       delay_sources={node.channel: __sim_delay_source(node) for node in nodes
+                                      if isinstance(node.connection, Sim_Connect)})
+
+    print_utils.print_info("---------- SETUP ACQUISITION ----------", 1)
+    tic.setup_slots(TIC_SWITCH_CHANNEL, [node.channel for node in nodes])
+    if is_stop_event_set():
+        return __terminate("launch", nodes, tic)
+
+    # Main Measurements Loop: every iteration measures all the nodes at once
+    for i in range(ITERATIONS_PER_CALIBRATION):
+        print_utils.inc_loop_num()
+        print_utils.print_loop("Loop started", 1)
+
+        with trace_utils.span("iteration", index=i + 1):
+            delays = __measure_delays(nodes, tic, EVENT_COUNT_TO_ACQUIRE, ACQUISITION_CI)
+        if delays is None:
+            return __terminate("launch", nodes, tic)
+        for node in nodes:
+            with trace_utils.span("ingest", node=node.connection.trace_label, samples=len(delays[node.slot])):
+                accepted = node.delays.push_batch(delays[node.slot])
+            print_utils.print_loop(f"{node.name}: {accepted} samples added, {len(delays[node.slot]) - accepted} outliers rejected.", 2)
+            print_utils.print_loop(f"{node.name}: measurements' mean: {np.mean(delays[node.slot]):.3f} ps. "
+                                   f"Total mean: {node.delays.mean:.3f} ps +- {node.delays.ci_half_width():.3f} ps (95% CI)", 1)
+
+        if is_stop_event_set():
+            return __terminate("launch", nodes, tic)
+        tic.reset_measurements([node.slot for node in nodes])
+        if all(node.delays.is_converged() for node in nodes):
+            print_utils.print_loop(f"Confidence target of {CONFIDENCE_TARGET} ps reached by every node. Skipping the remaining iterations", 1)
+            break
+
+    print_utils.print_info("Measurements are done", 1)
+    measured = [node for node in nodes if node.delays.count > 0]
+    for node in nodes:
+        if node.delays.count == 0:
+            print_utils.print_error(f"{node.name}: no delays were measured. Calibration is not applied")
+    if not measured:
+        return __terminate("launch", nodes, tic)
+
+    def apply_offset(node: _Node):
+        node.connection.apply_calib_offset_node(node.delays.mean, node.sfp_port)
+    if not __for_each_node(measured, apply_offset):
+        return __terminate("launch", nodes, tic)
+
+    with trace_utils.span("verify"):
+        delays = __measure_delays(measured, tic, EVENT_COUNT_TO_ACQUIRE, ACQUISITION_CI)
+    if delays is None:
+        return __terminate("launch", nodes, tic)
+
+    print_utils.print_info("Calibration performed.", 1)
+    for node in measured:
+        print_utils.print_info(f"{node.name}: old mean was: {node.delays.mean:.3f}ps . New mean is: {np.mean(delays[node.slot]):.3f}ps", 1)
+
+    tic.close_session()
+    return len(measured) == len(nodes)
+
+def __sim_delay_source(node: _Node) -> Callable[[], float]:
+    return lambda: node.connection.node.pps_delay_ps(node.sfp_port)
+
+def __prepare_node(node: _Node, crtt_time: int):
+    """Sets the node up and, unless crtt_time is -1, resets its coefficients. crtt is calibrated unless crtt_time is 0 either"""
+    con = node.connection
+    con.setup_connection()
+    con.setup_node()
+    if crtt_time == -1 or is_stop_event_set():
+        return
+    print_utils.print_info(f"---------- RESETTING COEFS OF {node.name} ----------", 1)
+    with trace_utils.span("coef_reset", node=con.trace_label):
+        con.apply_calib_node(0, 0, node.sfp_port)
+        if is_stop_event_set():
+            return
+        con.resync_ptp_node()
+    if crtt_time == 0 or is_stop_event_set():
+        return
+    print_utils.print_info(f"---------- MEASURING CRTT OF {node.name} ----------", 1)
+    with trace_utils.span("crtt", node=con.trace_label, time=crtt_time):
+        crtt = con.read_node_stats(time=crtt_time).stats["crtt"]
+        if crtt.count == 0:
+            raise ValueError("No TRACK_PHASE stat lines received from the node while measuring crtt")
+        print_utils.print_info(f"{node.name}: crtt: {crtt.count} samples, mean {crtt.mean:.1f} ps, std {crtt.std:.1f} ps", 1)
+        if is_stop_event_set():
+            return
+        con.apply_calib_node(int(crtt.mean) // 2, int(crtt.mean) // 2, node.sfp_port)
+
+def __measure_delays(nodes: List[_Node], tic: Oscilloscope, event_count_to_acquire: int, ci_ps: float):
+    """Resyncs the nodes in parallel, then acquires them in one oscilloscope run. Returns slot -> delays in ps"""
+    def resync(node: _Node):
+        node.connection.resync_ptp_node()
+        node.connection.close()
+    if not __for_each_node(nodes, resync):
+        return None
+
+    delays = tic.perform_slot_measurements([node.slot for node in nodes], event_count_to_acquire,
+                                           ci_target=ci_ps * 10 ** -12 if ci_ps else None)
+    if delays is None or is_stop_event_set():
+        return None
+    return {slot: slot_delays * 10 ** 12 for slot, slot_delays in delays.items()}
+
+def __for_each_node(nodes: List[_Node], func: Callable[[_Node], None]) -> bool:
+    """Runs func for every node at once. False if any of them failed or the script is stopped"""
+    is_ok = True
+    scheduler = JobScheduler(max_workers=len(nodes), name=script_name)
+    jobs = [(node, scheduler.submit(func, args=(node,), name=node.name, resources=[node.resource])) for node in nodes]
+    for node, job in jobs:
+        try:
+            job.result()
+        except Exception as ex:
+            print_utils.print_error(f"{node.name}: {ex}")
+            is_ok = False
+    scheduler.shutdown()
+    return is_ok and not is_stop_event_set()
+
+def __terminate(func: str, nodes: List[_Node], tic: Oscilloscope = None):
+    print_utils.print_thread_terminated(script_name, func)
+    for node in nodes:
+        node.connection.close()
+    if tic is not None:
+        tic.close_session()
+    return False
+
+def is_stop_event_set():
+    return calib_multi_stop_event.is_set()
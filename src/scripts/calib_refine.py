@@ -1,38 +1,50 @@
 from ..oscillos.rto2000 import RTO2000
 from ..oscillos.oscillo import Oscilloscope
-from ..connection.ssh_connect import SSH_Connect
+from ..oscillos.sim_scope import SimScope
+from ..connection.ssh_connect import SSH_Connect, TTY_EXEC, TTY_RELAY, TTY_AGENT
 from ..connection.direct_connect import Direct_Connect
+from ..connection.sim_connect import Sim_Connect
 from ..connection.connection import Connection
+from ..connection.stat_parser import StatParser
+from ..utils.stats import ConvergenceTracker, allan_deviation
 
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
 from ..utils import regex as regex_utils
 from ..utils import ip as ip_utils
+from ..utils import trace as trace_utils
 
 import argparse
-import pandas as pd
 import numpy as np
 
 
-calib_refine_stop_event = None
+calib_refine_stop_event = cancel_utils.ScriptStopEvent(f"{__name__}.stop_event")
 script_name = "calib_refine"
 
 def assign_calib_refine_stop_event(event):
-    global calib_refine_stop_event
-    calib_refine_stop_event = event
+    calib_refine_stop_event.assign(event)
     return
 
-def main(args_list=None):
+def main(args_list=None, stop_event=None):
+    """`stop_event` stops this run only. The assigned stop event is watched without it"""
+    with calib_refine_stop_event.bind(stop_event):
+        return __main(args_list)
+
+def __main(args_list):
     parser = argparse.ArgumentParser(
     prog=script_name,
     description='refine calibration data of WR-node via dedicated oscilloscope (RTO 2000 supported only) and direct to WR-Node or SSH access to remote server connected to WR-Node'
     )
-    parser.add_argument("instrmodel", choices=['rto2000'], help="oscilloscope model which API to access")
+    parser.add_argument("instrmodel", choices=['rto2000', 'sim'], help="oscilloscope model which API to access. sim - simulated oscilloscope and WR-Node, no hardware is accessed")
     parser.add_argument('instrip', help="oscilloscope's IP to connect to")
     parser.add_argument('--ttyUSB', help="ttyUSB port number to connect on the linux-running server", default=0, type=int)
     parser.add_argument('--dtcs', help="Data Transfer Chunk Size to use while sending measurements to controlling device", default=100000, type=int)
     parser.add_argument('time', help="time per calibration iteration", type=int)
-    parser.add_argument('iter', help="number of iterations for calibration", type=int)
+    parser.add_argument('iter', help="number of iterations for calibration (the maximum one if --target is set)", type=int)
     parser.add_argument('wrndsfp', help="WR-node SFP port number to use for calibration", default=0, type=int)
+    parser.add_argument('--ci', help="stop an iteration once the 95%% confidence interval half-width of the mean delay is below this value in ps. Default: 0 - acquire all events", default=0, type=float)
+    parser.add_argument('--target', help="stop iterating once the 95%% confidence interval half-width of the total mean delay is below this value in ps. Default: 0 - run all iterations", default=0, type=float)
+    parser.add_argument('--mad', help="reject delays further than this many robust sigmas (1.4826 * MAD) from the iteration median. 0 disables rejection. Default: 5", default=5, type=float)
     parser.add_argument('--crtt', help="crtt calibration time in seconds. Passing -1 disables crtt reset and calibration; 0 resets coefs, but doesn't calibrate crtt. Default: 60 sec", default=60, type=int)
 
     parser.add_argument('--wfrchsw', help="oscilloscope channel the WR-Switch is connected to", default=1, type=int)
@@ -43,6 +55,9 @@ def main(args_list=None):
     parser.add_argument('--sshhostname', help="IP address of remote server the WR Node is connected to. (required if --ssh is set)")
     parser.add_argument('--sshpwd', help="password to use for connecting via SSH. (required if --ssh is set)")
     parser.add_argument('--sshhostrootpwd', help="password to use for login as root on host. Default: equals to sshpwd. (required if --ssh is set)")
+    parser.add_argument('--sshttymode', choices=[TTY_EXEC, TTY_RELAY, TTY_AGENT], default=TTY_RELAY,
+                        help="how the WR-Node tty is reached on the host: exec - command per access, relay - one streaming channel, agent - one channel to an uploaded helper (needs python3 on host). Default: relay")
+    parser.add_argument('--trace', help="time the phases of the run: print a summary table of them and write a Chrome trace (chrome://tracing, Perfetto) to this file")
     
     args = parser.parse_args(args=args_list)
     
@@ -68,6 +83,14 @@ def main(args_list=None):
         print_utils.print_error(f"Invalid --crtt value ({args.crtt}). --crtt excepts only non-negative integers or -1")
         return 1
 
+    if args.target < 0 or args.mad < 0:
+        print_utils.print_error(f"Invalid --target ({args.target}) or --mad ({args.mad}) value. Only non-negative numbers are excepted")
+        return 1
+
+    if args.ci < 0:
+        print_utils.print_error(f"Invalid --ci value ({args.ci}). --ci excepts only non-negative numbers")
+        return 1
+
     if args.sshhostrootpwd is None:
         args.sshhostrootpwd = args.sshpwd
 
@@ -75,31 +98,39 @@ def main(args_list=None):
         print_utils.print_thread_terminated(script_name, "main")
         return
 
-    launch(
-        INSTR_MODEL =                args.instrmodel,
-        INSTR_IP =                   args.instrip,
-        TIC_SWITCH_CHANNEL =         args.wfrchsw,
-        TIC_NODE_CHANNEL =           args.wfrchnode,
-        TTY_USB_PORT_NUM =           args.ttyUSB,
-        WR_NODE_SFP_PORT =           args.wrndsfp,
-        DATA_TRANSFER_CHUNK_SIZE =   args.dtcs,
-        CRTT_TIME =                  args.crtt,
-        EVENT_COUNT_TO_ACQUIRE =     args.time,
-        ITERATIONS_PER_CALIBRATION = args.iter,
-        IS_SSH_MODE =                args.ssh,
-        SSH_HOST_NAME =              args.sshhostname,
-        SSH_CONNECT_PWD =            args.sshpwd,
-        SSH_HOST_ROOT_PWD =          args.sshhostrootpwd,
-		VERBOSITY_LEVEL =            args.verbosity
-    )
+    if args.trace is not None:
+        trace_utils.enable_tracing()
+    try:
+        with trace_utils.span(script_name):
+            launch(
+                INSTR_MODEL =                args.instrmodel,
+                INSTR_IP =                   args.instrip,
+                TIC_SWITCH_CHANNEL =         args.wfrchsw,
+                TIC_NODE_CHANNEL =           args.wfrchnode,
+                TTY_USB_PORT_NUM =           args.ttyUSB,
+                WR_NODE_SFP_PORT =           args.wrndsfp,
+                DATA_TRANSFER_CHUNK_SIZE =   args.dtcs,
+                CRTT_TIME =                  args.crtt,
+                EVENT_COUNT_TO_ACQUIRE =     args.time,
+                ITERATIONS_PER_CALIBRATION = args.iter,
+                IS_SSH_MODE =                args.ssh,
+                SSH_HOST_NAME =              args.sshhostname,
+                SSH_CONNECT_PWD =            args.sshpwd,
+                SSH_HOST_ROOT_PWD =          args.sshhostrootpwd,
+                SSH_TTY_MODE =               args.sshttymode,
+                ACQUISITION_CI =             args.ci,
+                CONFIDENCE_TARGET =          args.target,
+                OUTLIER_THRESHOLD =          args.mad,
+                VERBOSITY_LEVEL =            args.verbosity
+            )
+    finally:
+        trace_utils.finish_tracing(args.trace)
     return 0
 
 if __name__ == script_name:
     main()
 
-def __measure_skew_mean(con: Connection, tic: Oscilloscope, event_count_to_acquire: int):
-    global calib_refine_stop_event
-    
+def __measure_skew_mean(con: Connection, tic: Oscilloscope, event_count_to_acquire: int, ci: float = 0):
     con.resync_ptp_node()
     con.close()
     
@@ -109,11 +140,10 @@ def __measure_skew_mean(con: Connection, tic: Oscilloscope, event_count_to_acqui
         tic.close_session()
         return
     
-    file_path_to_write_data = tic.perform_measurements(event_count_to_acquire)
-    if file_path_to_write_data is None:
-        return []
-    delays = pd.read_csv(file_path_to_write_data, names=["a", "b", "c", "d", "e", "f", "g"])["a"] * 10 ** 12
-    return delays
+    delays = tic.perform_measurements(event_count_to_acquire, ci_target=ci * 10 ** -12 if ci else None)
+    if delays is None:
+        return np.array([])
+    return delays * 10 ** 12
 
 
 def launch(
@@ -131,24 +161,37 @@ def launch(
         SSH_HOST_NAME: str,
 		SSH_CONNECT_PWD: str,
 		SSH_HOST_ROOT_PWD: str,
-		VERBOSITY_LEVEL: int
+		VERBOSITY_LEVEL: int,
+        SSH_TTY_MODE: str = TTY_RELAY,
+        ACQUISITION_CI: float = 0,
+        CONFIDENCE_TARGET: float = 0,
+        OUTLIER_THRESHOLD: float = 5,
+        CONNECTION: Connection = None,
+        OSCILLOSCOPE: Oscilloscope = None
 ):
-    global calib_refine_stop_event
+    """CONNECTION and OSCILLOSCOPE replace the ones the mode and model would open, e.g. with tuned simulators"""
 
     print_utils.set_print_verbosity_lvl(VERBOSITY_LEVEL)
     
     con = Connection()
-    if(IS_SSH_MODE):
+    if CONNECTION is not None:
+        con = CONNECTION
+    elif (INSTR_MODEL == "sim"):
+        con = Sim_Connect(tty_usb_port=TTY_USB_PORT_NUM,
+                          root=script_name,
+                          stop_event=calib_refine_stop_event.get())
+    elif(IS_SSH_MODE):
         con = SSH_Connect(host_name=SSH_HOST_NAME,
                           connect_pwd=SSH_CONNECT_PWD,
                           host_root_pwd=SSH_HOST_ROOT_PWD,
                           tty_usb_port=TTY_USB_PORT_NUM,
+                          tty_mode=SSH_TTY_MODE,
                           root=script_name,
-                          stop_event=calib_refine_stop_event)
+                          stop_event=calib_refine_stop_event.get())
     else:
         con = Direct_Connect(tty_usb_port=TTY_USB_PORT_NUM,
                             root=script_name,
-                            stop_event=calib_refine_stop_event)	
+                            stop_event=calib_refine_stop_event.get())	
 
     if is_stop_event_set():
         con.close()
@@ -164,29 +207,32 @@ def launch(
             return
         print_utils.print_info("---------- RESETTING COEFS ----------", 1)
         
-        con.apply_calib_node(0, 0, WR_NODE_SFP_PORT)
-        
-        if is_stop_event_set():
-            con.close()
-            print_utils.print_thread_terminated(script_name, "launch")
-            return
-        
-        con.resync_ptp_node()
-        
-        if is_stop_event_set():
-            con.close()
-            print_utils.print_thread_terminated(script_name, "launch")
-            return
-        
-        print_utils.print_info("---------- MEASURING CRTT ----------", 1)
-        crtt_mean = __calc_crtt_mean(con.read_node_log(time = CRTT_TIME))
+        with trace_utils.span("coef_reset", node=con.trace_label):
+            con.apply_calib_node(0, 0, WR_NODE_SFP_PORT)
+            
+            if is_stop_event_set():
+                con.close()
+                print_utils.print_thread_terminated(script_name, "launch")
+                return
+            
+            con.resync_ptp_node()
         
         if is_stop_event_set():
             con.close()
             print_utils.print_thread_terminated(script_name, "launch")
             return
         
-        con.apply_calib_node(crtt_mean // 2, crtt_mean // 2, WR_NODE_SFP_PORT)
+        if CRTT_TIME > 0: # 0 resets coefs only
+            print_utils.print_info("---------- MEASURING CRTT ----------", 1)
+            with trace_utils.span("crtt", node=con.trace_label, time=CRTT_TIME):
+                crtt_mean = __calc_crtt_mean(con.read_node_stats(time = CRTT_TIME))
+                
+                if is_stop_event_set():
+                    con.close()
+                    print_utils.print_thread_terminated(script_name, "launch")
+                    return
+                
+                con.apply_calib_node(crtt_mean // 2, crtt_mean // 2, WR_NODE_SFP_PORT)
     # con.resync_ptp_node() # - needed ONLY when supoport of dynamic horizontal axis scaling will be on
 
 	# ----------- start instrument ----------- 
@@ -197,13 +243,18 @@ def launch(
     print_utils.print_info("---------- START OSCILLOSCOPE SESSION ----------", 1)
 
     tic = Oscilloscope()
-    if (INSTR_MODEL == "rto2000"):
+    if OSCILLOSCOPE is not None:
+        tic = OSCILLOSCOPE
+    elif (INSTR_MODEL == "rto2000"):
         tic = RTO2000(ip_address=INSTR_IP,
                       data_transfer_chunk_size=DATA_TRANSFER_CHUNK_SIZE,
                       root=script_name,
-                      stop_event=calib_refine_stop_event)
-    else:
-        pass
+                      stop_event=calib_refine_stop_event.get())
+    elif (INSTR_MODEL == "sim"):
+        sources = {TIC_NODE_CHANNEL: lambda: con.node.pps_delay_ps(WR_NODE_SFP_PORT)} if isinstance(con, Sim_Connect) else None
+        tic = SimScope(root=script_name,
+                       stop_event=calib_refine_stop_event.get(),
+                       delay_sources=sources)
 
 	# ----------- setup measurements ----------- 
     print_utils.print_info("---------- SETUP ACQUISITION ----------", 1)
@@ -216,7 +267,11 @@ def launch(
         return
     
     # Main Measurements Loop
-    sampled_delays = []
+    # raw delays are kept as float32 in one preallocated array sized for every iteration
+    sampled_delays = ConvergenceTracker(target=CONFIDENCE_TARGET if CONFIDENCE_TARGET > 0 else None,
+                                        outlier_threshold=OUTLIER_THRESHOLD,
+                                        bin_width=1.0,
+                                        capacity=EVENT_COUNT_TO_ACQUIRE * ITERATIONS_PER_CALIBRATION)
     for i in range(ITERATIONS_PER_CALIBRATION):
         print_utils.inc_loop_num()
         print_utils.print_loop("Loop started", 1)
@@ -227,15 +282,18 @@ def launch(
             tic.close_session()
             return
         
-        delays = __measure_skew_mean(con, tic, EVENT_COUNT_TO_ACQUIRE)
+        with trace_utils.span("iteration", node=con.trace_label, index=i + 1):
+            delays = __measure_skew_mean(con, tic, EVENT_COUNT_TO_ACQUIRE, ACQUISITION_CI)
         if is_stop_event_set():
             print_utils.print_thread_terminated(script_name, "launch")
             con.close()
             tic.close_session()
             return
-        sampled_delays.extend(delays.to_list())
-        print_utils.print_loop(f"Measurement no. {i + 1}, loaded to delays. {len(delays)} samples added.", 2)
-        print_utils.print_loop(f"Measurements' mean: {np.mean(delays):.3f} ps", 1)
+        with trace_utils.span("ingest", node=con.trace_label, samples=len(delays)):
+            accepted = sampled_delays.push_batch(delays)
+        print_utils.print_loop(f"Measurement no. {i + 1}, loaded to delays. {accepted} samples added, {len(delays) - accepted} outliers rejected.", 2)
+        print_utils.print_loop(f"Measurements' mean: {np.mean(delays):.3f} ps, ADEV(1 sample): {allan_deviation(delays):.3f} ps", 1)
+        print_utils.print_loop(f"Total mean: {sampled_delays.mean:.3f} ps +- {sampled_delays.ci_half_width():.3f} ps (95% CI), ADEV(1 iteration): {sampled_delays.batch_adev:.3f} ps", 1)
 
         if is_stop_event_set():
             print_utils.print_thread_terminated(script_name, "launch")
@@ -243,10 +301,21 @@ def launch(
             tic.close_session()
             return
         tic.reset_measurements()
+        if sampled_delays.is_converged():
+            print_utils.print_loop(f"Confidence target of {CONFIDENCE_TARGET} ps reached. Skipping the remaining iterations", 1)
+            break
 
     print_utils.print_info("Measurements are done", 1)
-    meanOffset = np.mean(sampled_delays)
-    print_utils.print_info(f"Measurements' total mean: {meanOffset:.3f} ps", 1)
+    if sampled_delays.count == 0:
+        print_utils.print_error("No delays were measured. Calibration is not applied")
+        con.close()
+        tic.close_session()
+        return
+    meanOffset = sampled_delays.mean
+    print_utils.print_info(f"Measurements' total mean: {meanOffset:.3f} ps +- {sampled_delays.ci_half_width():.3f} ps (95% CI) over {sampled_delays.count} samples, {sampled_delays.rejected} rejected", 1)
+    samples = sampled_delays.samples
+    print_utils.print_info(f"Delays' std: {samples.std:.3f} ps, min: {samples.min:.3f} ps, max: {samples.max:.3f} ps, "
+                           f"percentiles 5/50/95: {samples.percentile(5):.3f}/{samples.percentile(50):.3f}/{samples.percentile(95):.3f} ps", 2)
     
     if is_stop_event_set():
         print_utils.print_thread_terminated(script_name, "launch")
@@ -262,7 +331,8 @@ def launch(
         tic.close_session()
         return
     
-    delays = __measure_skew_mean(con, tic, EVENT_COUNT_TO_ACQUIRE)
+    with trace_utils.span("verify", node=con.trace_label):
+        delays = __measure_skew_mean(con, tic, EVENT_COUNT_TO_ACQUIRE, ACQUISITION_CI)
     
     if is_stop_event_set():
         print_utils.print_thread_terminated(script_name, "launch")
@@ -275,12 +345,12 @@ def launch(
 
     tic.close_session()
 
-def __calc_crtt_mean(lines) -> int:
-    crtt = 0
-    buf = list(filter(lambda x: "TRACK_PHASE" in x, lines))
-    for line in buf:
-        crtt += int(line.split("crtt:")[1].split(" ")[0])
-    return crtt // len(buf)
+def __calc_crtt_mean(stats: StatParser) -> int:
+    crtt = stats.stats["crtt"]
+    if crtt.count == 0:
+        raise ValueError("No TRACK_PHASE stat lines received from the node while measuring crtt")
+    print_utils.print_info(f"crtt: {crtt.count} samples, mean {crtt.mean:.1f} ps, std {crtt.std:.1f} ps", 1)
+    return int(crtt.mean)
 
 def is_stop_event_set():
-    return calib_refine_stop_event is not None and calib_refine_stop_event.is_set()
\ No newline at end of file
+    return calib_refine_stop_event.is_set()
\ No newline at end of file
@@ -0,0 +1,131 @@
+from ..connection import snmp_mib
+from ..connection import ptp_monitor
+from ..connection.ptp_monitor import PtpMonitor
+
+from ..utils import print as print_utils
+from ..utils import ip as ip_utils
+
+from ..connection.exceptions.execution_statuses import ScriptRunStatusesEnum
+from ..utils.cancel import CancelToken
+
+import argparse
+import time as timer
+from typing import List
+
+ptp_monitor_stop_event = None
+script_name = "ptp_monitor"
+
+__MIBS_FOLDER__ = ["src/mibs"]
+__EVENT_STATUSES = {
+    ptp_monitor.LOCK_LOST: ScriptRunStatusesEnum.PTP_LOCK_LOST,
+    ptp_monitor.OFFSET_DRIFT: ScriptRunStatusesEnum.PTP_OFFSET_DRIFT,
+    ptp_monitor.UNREACHABLE: ScriptRunStatusesEnum.DESTINATION_UNREACHABLE,
+    ptp_monitor.LOCK_ACQUIRED: ScriptRunStatusesEnum.OK,
+    ptp_monitor.REACHABLE: ScriptRunStatusesEnum.OK,
+}
+
+def assign_ptp_monitor_stop_event(event):
+    global ptp_monitor_stop_event
+    ptp_monitor_stop_event = event
+    return
+
+def main(args_list=None, stop_event=None) -> int:
+    """`stop_event` stops this run only. The assigned stop event, or a new one, is watched without it"""
+    parser = argparse.ArgumentParser(
+    prog=script_name,
+    description='Continuous monitoring of PTP lock of WR-Nodes (wrpcPtp*) and WR-Switches (wrsPtpDataTable) via SNMP'
+    )
+    parser.add_argument("-ip", help="WR-Node IP-address to monitor. May be repeated", type=str, action="append", default=[])
+    parser.add_argument("-f", "--file", help="file of WR-Node IP-addresses to monitor", type=str)
+    parser.add_argument("-sw", "--switch", help="WR-Switch IP-address to monitor. May be repeated", type=str, action="append", default=[])
+    parser.add_argument("-swf", "--switchfile", help="file of WR-Switch IP-addresses to monitor", type=str)
+    parser.add_argument("--interval",   help="poll period of every target in seconds. Default: 1 sec", type=float, default=1.0)
+    parser.add_argument("--rate",       help="maximum SNMP requests per second over the whole fleet. Default: 500", type=float, default=500)
+    parser.add_argument("--history",    help="samples kept per node/switch port. Default: 600", type=int, default=600)
+    parser.add_argument("--offsetlimit",help="clock offset in ps reported as drift while locked. Default: 1000 ps", type=int, default=1000)
+    parser.add_argument("--report",     help="period in seconds of the fleet summary. Default: 10 sec", type=float, default=10)
+    parser.add_argument("--duration",   help="monitoring time in seconds. Default: 0 - until stopped", type=float, default=0)
+    parser.add_argument("-v", "--verbosity",help="increase output verbosity", action="count", default=0)
+    parser.add_argument("-l", "--log",      help="path to output file for logging lock losses and drifts to", type=str)
+    args = parser.parse_args(args=args_list)
+
+    print_utils.set_print_verbosity_lvl(args.verbosity)
+    if args.interval <= 0 or args.rate <= 0 or args.report <= 0 or args.history < 1 or args.duration < 0:
+        print_utils.print_error("--interval, --rate, --report and --history accept positive values only, --duration non-negative")
+        return 1
+
+    nodes = args.ip + (__read_ips(args.file) if args.file is not None else [])
+    switches = args.switch + (__read_ips(args.switchfile) if args.switchfile is not None else [])
+    invalid = [x for x in nodes + switches if not ip_utils.is_ip_valid(x)]
+    if invalid:
+        print_utils.print_error(f"Invalid IP format: {', '.join(invalid)}. Expected format: 2.25.255.03")
+        return 1
+    if not nodes and not switches:
+        print_utils.print_error("No -ip/-f/-sw/-swf is given. At least one target is required")
+        return 1
+
+    if (args.log is not None):
+        try:
+            print_utils.logger.open(args.log, "a")
+        except ValueError as ex:
+            print_utils.print_error(str(ex))
+            return 1
+    if stop_event is None:
+        stop_event = ptp_monitor_stop_event if ptp_monitor_stop_event is not None else CancelToken()
+
+    monitor = PtpMonitor(
+        snmp_mib.load_mibs("WR-WRPC-MIB:WR-SWITCH-MIB", __MIBS_FOLDER__),
+        interval=args.interval,
+        rate=args.rate,
+        history=args.history,
+        offset_limit=args.offsetlimit,
+        on_event=__on_event
+    )
+    for ip in nodes:
+        monitor.add(ip)
+    for ip in switches:
+        monitor.add(ip, is_switch=True)
+    print_utils.print_info(f"Monitoring {len(nodes)} node(s) and {len(switches)} switch(es) every {args.interval} sec", 0)
+
+    monitor.start()
+    started = timer.monotonic()
+    try:
+        while not stop_event.is_set():
+            left = args.duration - (timer.monotonic() - started) if args.duration else args.report
+            if left <= 0:
+                break
+            if stop_event.wait(min(left, args.report)):
+                break
+            __print_summary(monitor)
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        monitor.close()
+        if args.log is not None:
+            print_utils.logger.close_log()
+
+    if stop_event.is_set():
+        print_utils.print_thread_terminated(script_name, "main")
+    return 0
+
+def __read_ips(path: str) -> List[str]:
+    with open(path, "r") as addresses:
+        return [x.strip() for x in addresses if x.strip() != ""]
+
+def __on_event(ip: str, index, kind: str, text: str):
+    target = ip if not index else f"{ip} PTP instance #{'.'.join(str(x) for x in index)}"
+    status = __EVENT_STATUSES[kind]
+    if status == ScriptRunStatusesEnum.OK:
+        print_utils.print_info(f"{target}: {kind}. {text}", 1)
+    else:
+        print_utils.print_error(f"{target}: {ScriptRunStatusesEnum(status).name}({status:X}). {text}")
+    if print_utils.logger.is_logging_on():
+        print_utils.logger.log(target, status, script=script_name, message=f"{kind}. {text}")
+
+def __print_summary(monitor: PtpMonitor):
+    summary = monitor.summary()
+    print_utils.print_info(
+        f"Locked: {summary['locked']}/{summary['series']}, unlocked: {summary['unlocked']}, "
+        f"unreachable: {summary['unreachable']}, drifting: {summary['drifting']}, "
+        f"worst offset: {summary['worst_offset']} ps. "
+        f"Requests: {monitor.requests_sent}, timeouts: {monitor.timeouts}", 0)
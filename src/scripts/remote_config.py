@@ -2,26 +2,42 @@ from ..connection.exceptions.node_errors import *
 from ..connection.snmp_connect import SNMP_Connect
 
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
 from ..utils import ip as ip_utils
 from ..utils import math  as math_utils 
+from ..utils import jobs as job_utils
+from ..utils import trace as trace_utils
+from ..utils.jobs import JobScheduler
 
 from ..connection.exceptions.execution_statuses import ScriptRunStatusesEnum
+from ..utils.cancel import CancelToken
 
 import argparse
+import time as timer
+from concurrent.futures import Future
+from typing import List, Tuple
 
 __NODE_MODEL__ = None
+__matched_sfps = {} # node IP -> PN of the SFP matched on the last visit
+__applied_coefs = {} # node IP -> (tx, rx, alpha) read back on the current visit
+__started_at = {} # node IP -> time.monotonic() the current visit started at
 
-remote_config_stop_event = None
+remote_config_stop_event = cancel_utils.ScriptStopEvent(f"{__name__}.stop_event")
 script_name = "remote_config"
 
 def assign_remote_config_stop_event(event):
-    global remote_config_stop_event
-    remote_config_stop_event = event
+    remote_config_stop_event.assign(event)
     return
 
-def main(args_list=None) -> int:
+def main(args_list=None, stop_event=None) -> int:
+    """`stop_event` stops this run only. The assigned stop event, or a new one, is watched without it"""
+    if stop_event is None:
+        stop_event = remote_config_stop_event.get()
+    with remote_config_stop_event.bind(stop_event if stop_event is not None else CancelToken()):
+        return __main(args_list)
+
+def __main(args_list) -> int:
     global __NODE_MODEL__
-    global remote_config_stop_event
 
     parser = argparse.ArgumentParser(
     prog=script_name,
@@ -39,11 +55,11 @@ def main(args_list=None) -> int:
     parser.add_argument("-rs", "--resync",  help="restart PTP with applied coefficients", action="store_true", default=False)
     parser.add_argument("--wait",           help="wait time in secods for resynchronization after PTP restart. Default: 0 sec - wait is turned off", type=int, default=0)
     parser.add_argument("-nm", "--nodemodel", help="specify node model for platform specific coefficient calculations", type=str)
+    parser.add_argument("-j", "--jobs",     help="number of nodes from --file configured in parallel. Default: 1 - nodes are configured one by one", type=int, default=1)
+    parser.add_argument("--port",           help="UDP port the SNMP agents of the nodes listen on. Default: 161", type=int, default=161)
+    parser.add_argument("--trace",          help="time the SNMP requests and PTP lock waits per node: print a summary table of them and write a Chrome trace (chrome://tracing, Perfetto) to this file", type=str)
     args = parser.parse_args(args=args_list)
 
-    if (args.log is not None):
-        print_utils.logger.open(args.log, "a")
-
     print_utils.set_print_verbosity_lvl(args.verbosity)
     __NODE_MODEL__ = args.nodemodel.upper() if args.nodemodel is not None else None
 
@@ -55,9 +71,31 @@ def main(args_list=None) -> int:
     if (args.wait < 0):
         print_utils.print_error("--wait flag accepts non-negative integers only")
         return 1
+    if (args.jobs < 1):
+        print_utils.print_error("--jobs flag accepts positive integers only")
+        return 1
     if __is_stop_event_set():
             print_utils.print_thread_terminated(script_name, "main")
             return
+
+    if args.log is not None:
+        try:
+            print_utils.logger.open(args.log, "a")
+        except ValueError as ex:
+            print_utils.print_error(str(ex))
+            return 1
+    if args.trace is not None:
+        trace_utils.enable_tracing()
+    try:
+        with trace_utils.span(script_name):
+            return __configure(args)
+    finally:
+        trace_utils.finish_tracing(args.trace)
+        if args.log is not None:
+            print_utils.logger.close_log()
+
+def __configure(args) -> int:
+    """Configures the node of -ip or the nodes of -f"""
     if args.ip is not None:
         
         __x_launch(
@@ -67,8 +105,24 @@ def main(args_list=None) -> int:
             ALPHA_COEF=args.alpha,
             SFP_PN=args.sfp,
             RESYNC=args.resync,
-            RESYNC_TIMEOUT=args.wait
+            RESYNC_TIMEOUT=args.wait,
+            SNMP_PORT=args.port
         )
+    elif args.file is not None and args.jobs > 1:
+        with open(args.file, "r") as addresses:
+            ips = [line.strip() for line in addresses]
+        __launch_concurrently(ips, args.jobs,
+            TX_DELAY=args.tx,
+            RX_DELAY=args.rx,
+            ALPHA_COEF=args.alpha,
+            SFP_PN=args.sfp,
+            RESYNC=args.resync,
+            RESYNC_TIMEOUT=args.wait,
+            SNMP_PORT=args.port
+        )
+        if __is_stop_event_set():
+            print_utils.print_thread_terminated(script_name, "main")
+            return
     elif args.file is not None: # if exception - break interation but not the whole cycle
             with open(args.file, "r") as addresses:
                 ip = ""
@@ -83,14 +137,13 @@ def main(args_list=None) -> int:
                             ALPHA_COEF=args.alpha,
                             SFP_PN=args.sfp,
                             RESYNC=args.resync,
-                            RESYNC_TIMEOUT=args.wait
+                            RESYNC_TIMEOUT=args.wait,
+                            SNMP_PORT=args.port
                         )
                 except Exception as ex:
                     __print_error(ip, ScriptRunStatusesEnum.UNKNOWN_ERROR, str(ex))
-                    remote_config_stop_event.set()
+                    remote_config_stop_event.get().set()
                 finally:
-                    if print_utils.logger.is_logging_on():
-                        print_utils.logger.close_log()
                     if __is_stop_event_set():
                         print_utils.print_thread_terminated(script_name, "main")
                         return
@@ -106,9 +159,11 @@ def launch(
         ALPHA_COEF: int,
         SFP_PN: str,
         RESYNC: bool,
-        RESYNC_TIMEOUT: int
+        RESYNC_TIMEOUT: int,
+        SYNC_WAITS: list = None,
+        SNMP_PORT: int = 161
 ) -> int:
-    global remote_config_stop_event
+    """With SYNC_WAITS given, the PTP lock is not awaited: (ip, future) of the node is appended to it instead"""
     __MIBS_FOLDER__ = ["src/mibs"]
     
     if __is_stop_event_set():
@@ -120,97 +175,178 @@ def launch(
         libs=__MIBS_FOLDER__,
         ip=IP_ADDRESS,
         root_script=script_name,
-        stop_event=remote_config_stop_event
+        stop_event=remote_config_stop_event.get(),
+        port=SNMP_PORT
     )
-    node_con.set_retries(2)
+    try:
+        node_con.set_retries(2)
 
-    set_error_flag = False
-    tx_get = None
-    rx_get = None
-    alpha_get = None
-    for i in range(2):
-        if __is_stop_event_set():
-            node_con.close()
-            print_utils.print_thread_terminated(script_name, "launch")
-            return
+        set_error_flag = False
+        tx_get = None
+        rx_get = None
+        alpha_get = None
+        for i in range(2):
+            if __is_stop_event_set():
+                print_utils.print_thread_terminated(script_name, "launch")
+                return
         
-        set_error_flag = False   
-        set_tx = __prepare_coef(TX_DELAY)
-        set_rx = __prepare_coef(RX_DELAY)
-        set_alpha = __prepare_coef(ALPHA_COEF)
-        print_utils.print_info(f"Trying to load coefficients: {TX_DELAY}({set_tx}), {RX_DELAY}({set_rx}), {ALPHA_COEF}({set_alpha})", 0)
-        node_con.snmpset("wrpcPtpConfigDeltaTx.0",  set_tx)
-        node_con.snmpset("wrpcPtpConfigDeltaRx.0",  set_rx)
-        node_con.snmpset("wrpcPtpConfigAlpha.0",    set_alpha)
-        if (SFP_PN is None):
-            node_con.snmpset("wrpcPtpConfigApply.0", "writeToFlashCurrentSfp")
-        else:
-            node_con.snmpset("wrpcPtpConfigSfpPn.0", SFP_PN)
-            node_con.snmpset("wrpcPtpConfigApply.0", "writeToFlashGivenSfp")
+            set_error_flag = False   
+            set_tx = __prepare_coef(TX_DELAY)
+            set_rx = __prepare_coef(RX_DELAY)
+            set_alpha = __prepare_coef(ALPHA_COEF)
+            print_utils.print_info(f"Trying to load coefficients: {TX_DELAY}({set_tx}), {RX_DELAY}({set_rx}), {ALPHA_COEF}({set_alpha})", 0)
+            coefs = [
+                ("wrpcPtpConfigDeltaTx.0",  set_tx),
+                ("wrpcPtpConfigDeltaRx.0",  set_rx),
+                ("wrpcPtpConfigAlpha.0",    set_alpha)
+            ]
+            if (SFP_PN is None):
+                coefs.append(("wrpcPtpConfigApply.0", "writeToFlashCurrentSfp"))
+            else:
+                coefs.append(("wrpcPtpConfigSfpPn.0", SFP_PN))
+                coefs.append(("wrpcPtpConfigApply.0", "writeToFlashGivenSfp"))
+            node_con.snmpset_multi(coefs) # one PDU: the agent applies the coefficients set along with it
         
-        print_utils.print_info(f"SNMP sets to {IP_ADDRESS} performed.", 1)
+            print_utils.print_info(f"SNMP sets to {IP_ADDRESS} performed.", 1)
 
-        if __is_stop_event_set():
-            node_con.close()
-            print_utils.print_thread_terminated(script_name, "launch")
-            return
-        
-        print_utils.print_info(f"Validating correct assignments...", 2)
+            if __is_stop_event_set():
+                print_utils.print_thread_terminated(script_name, "launch")
+                return
         
-        # config check
-        # check via wrpcSfpTable
-        buf = node_con.snmpwalk("wrpcSfpTable", hide=True).split("\n")
+            print_utils.print_info(f"Validating correct assignments...", 2)
         
-        matched_sfp = node_con.snmpget("wrpcPortSfpPn.0").strip("\" \n")
-        print_utils.print_info(f"Matched SFP: {matched_sfp}", 2)
-        table_index = next(x for x in buf if matched_sfp in x).split(".")[1].split("=")[0].strip()
-        print_utils.print_info(f"Table index: {table_index}", 2)
-
-        buf = list(filter(lambda x: (f"wrpcSfpDeltaTx.{table_index}" in x or f"wrpcSfpDeltaRx.{table_index}" in x or f"wrpcSfpAlpha.{table_index}" in x), buf))
-        tx_get = int("".join(filter(lambda x: (str.isdigit(x) or x=="-"), buf[0].split("=")[1])))
-        rx_get = int("".join(filter(lambda x: (str.isdigit(x) or x=="-"), buf[1].split("=")[1])))
-        alpha_get = int("".join(filter(lambda x: (str.isdigit(x) or x=="-"), buf[2].split("=")[1])))
-
-        print_utils.print_untagged("", 2)
-        print_utils.print_info(f"The set TX delay: {tx_get}. The set RX delay: {rx_get}. The set alpha: {alpha_get}", 2)
-        print_utils.print_info(f"Expected TX delay: {set_tx}. Expected RX delay: {set_rx}. Expected alpha: {set_alpha}", 2)
-        print_utils.print_untagged("", 2)
-        set_error_flag = (tx_get != set_tx)
-        set_error_flag = (set_error_flag or rx_get != set_rx)
-        set_error_flag = (set_error_flag or alpha_get != set_alpha)
-        if (not set_error_flag):
-            break
+            # config check
+            # check via wrpcSfpTable
+            tx_get, rx_get, alpha_get = __read_applied_coefs(node_con, IP_ADDRESS)
+            __applied_coefs[IP_ADDRESS] = (tx_get, rx_get, alpha_get)
+
+            print_utils.print_untagged("", 2)
+            print_utils.print_info(f"The set TX delay: {tx_get}. The set RX delay: {rx_get}. The set alpha: {alpha_get}", 2)
+            print_utils.print_info(f"Expected TX delay: {set_tx}. Expected RX delay: {set_rx}. Expected alpha: {set_alpha}", 2)
+            print_utils.print_untagged("", 2)
+            set_error_flag = (tx_get != set_tx)
+            set_error_flag = (set_error_flag or rx_get != set_rx)
+            set_error_flag = (set_error_flag or alpha_get != set_alpha)
+            if (not set_error_flag):
+                break
         
-    if __is_stop_event_set():
-        node_con.close()
-        print_utils.print_thread_terminated(script_name, "launch")
-        return
+        if __is_stop_event_set():
+            print_utils.print_thread_terminated(script_name, "launch")
+            return
 
-    if set_error_flag:
-        raise NodeValueError(SnmpCommandCode.WALK, 
-                             ScriptRunStatusesEnum.COEF_COHERENCY_LOSS,
-                             "wrpcPtpGroup",
-                             f"Unable to apply delay coefficients for {IP_ADDRESS}. Current are:",
-                             f"TX delay: {tx_get}, RX delay: {rx_get}, alpha: {alpha_get}")
-    else:
-        print_utils.print_info(
-            f"Successfully applied delay coefficients for {IP_ADDRESS}. Current "
-            f"TX delay: {tx_get}, RX delay: {rx_get}, alpha: {alpha_get}",
-            verbosity=0
-        )
+        if set_error_flag:
+            raise NodeValueError(SnmpCommandCode.WALK, 
+                                 ScriptRunStatusesEnum.COEF_COHERENCY_LOSS,
+                                 "wrpcPtpGroup",
+                                 f"Unable to apply delay coefficients for {IP_ADDRESS}. Current are:",
+                                 f"TX delay: {tx_get}, RX delay: {rx_get}, alpha: {alpha_get}")
+        else:
+            print_utils.print_info(
+                f"Successfully applied delay coefficients for {IP_ADDRESS}. Current "
+                f"TX delay: {tx_get}, RX delay: {rx_get}, alpha: {alpha_get}",
+                verbosity=0
+            )
 
-    if (RESYNC):
-        print_utils.print_info(f"Restart PTP...", 0)
-        if (node_con.ptp_resync(timeout=RESYNC_TIMEOUT)):
-            print_utils.print_untagged("",0)
-            if RESYNC_TIMEOUT:
-                print_utils.print_info(f"PTP Synchronized", 0)
+        if (RESYNC and RESYNC_TIMEOUT and SYNC_WAITS is not None):
+            print_utils.print_info(f"Restart PTP...", 0)
+            SYNC_WAITS.append((IP_ADDRESS, node_con.ptp_resync_async(timeout=RESYNC_TIMEOUT)))
+            print_utils.print_info(f"Config {IP_ADDRESS} finished. Waiting for PTP lock", 0)
+            return 0
+
+        if (RESYNC):
+            print_utils.print_info(f"Restart PTP...", 0)
+            if (node_con.ptp_resync(timeout=RESYNC_TIMEOUT)):
+                print_utils.print_untagged("",0)
+                if RESYNC_TIMEOUT:
+                    print_utils.print_info(f"PTP Synchronized", 0)
     
-    if print_utils.logger.is_logging_on():
-        print_utils.logger.log(IP_ADDRESS, ScriptRunStatusesEnum.OK)
+        __log_result(IP_ADDRESS, ScriptRunStatusesEnum.OK)
     
-    print_utils.print_info(f"Config {IP_ADDRESS} finished", 0)
-    return 0
+        print_utils.print_info(f"Config {IP_ADDRESS} finished", 0)
+        return 0
+    finally: # also on errors: the connection holds sockets
+        node_con.close()
+
+def __launch_concurrently(ips: List[str], jobs: int, **launch_args):
+    """Configures up to `jobs` nodes at once. Output of every node is printed as one block once it is done.
+    PTP locks of all nodes are awaited together after the configuration, so the fleet waits for resync once"""
+    sync_waits: List[Tuple[str, Future]] = []
+
+    def configure(ip: str):
+        if __is_stop_event_set():
+            return
+        with print_utils.buffered_output():
+            print_utils.print_untagged("------------------------", 0)
+            try:
+                __x_launch(IP_ADDRESS=ip, SYNC_WAITS=sync_waits, **launch_args)
+            except Exception as ex: # an unexpected failure affects only its own node
+                __print_error(ip, ScriptRunStatusesEnum.UNKNOWN_ERROR, str(ex))
+
+    # an IP listed twice is configured twice, but never concurrently
+    scheduler = JobScheduler(max_workers=jobs, name=script_name)
+    try:
+        for job in [scheduler.submit(configure, args=(ip,), name=ip, resources=[job_utils.snmp_resource(ip)])
+                    for ip in ips]:
+            job.result()
+    except KeyboardInterrupt:
+        remote_config_stop_event.get().set()
+        scheduler.cancel_all()
+        raise
+    finally:
+        scheduler.shutdown(cancel_pending=True, wait=False)
+
+    if sync_waits:
+        print_utils.print_untagged("------------------------", 0)
+        print_utils.print_info(f"Waiting for PTP lock of {len(sync_waits)} node(s)...", 0)
+    try:
+        for ip, sync_wait in sync_waits:
+            is_synced = sync_wait.result()
+            if __is_stop_event_set():
+                print_utils.print_thread_terminated(script_name, "__launch_concurrently")
+                return
+            if is_synced:
+                print_utils.print_info(f"{ip}: PTP Synchronized", 0)
+                __log_result(ip, ScriptRunStatusesEnum.OK, "PTP Synchronized")
+            else:
+                __print_error(ip, ScriptRunStatusesEnum.SYNC_TIMEOUT,
+                              f"Synchronisation timeout ({launch_args['RESYNC_TIMEOUT']} sec) reached")
+    except KeyboardInterrupt:
+        remote_config_stop_event.get().set()
+        raise
+    return
+
+def __read_applied_coefs(node_con: SNMP_Connect, ip: str) -> Tuple[int, int, int]:
+    """Reads TX, RX and alpha of the matched SFP's wrpcSfpTable row.
+    Once the row of the node is known it takes one GET, otherwise the table is walked to find it"""
+    matched_sfp = __matched_sfps.get(ip)
+    table_index = None if matched_sfp is None else \
+        node_con.cached_table_row("wrpcSfpTable", "wrpcSfpPn", matched_sfp)
+    if table_index is not None:
+        idx = SNMP_Connect.index_to_str(table_index)
+        port_sfp, row_sfp, tx_get, rx_get, alpha_get = node_con.snmpget_values([
+            "wrpcPortSfpPn.0",
+            f"wrpcSfpPn.{idx}",
+            f"wrpcSfpDeltaTx.{idx}",
+            f"wrpcSfpDeltaRx.{idx}",
+            f"wrpcSfpAlpha.{idx}"
+        ], hide=True)
+        if port_sfp == matched_sfp and row_sfp is not None and row_sfp.strip() == matched_sfp.strip():
+            print_utils.print_info(f"Matched SFP: {matched_sfp}. Table index: {idx} (cached)", 2)
+            return (tx_get, rx_get, alpha_get)
+        node_con.forget_table_row("wrpcSfpTable", "wrpcSfpPn", matched_sfp)
+
+    matched_sfp = node_con.snmpget_values(["wrpcPortSfpPn.0"], hide=True)[0]
+    __matched_sfps[ip] = matched_sfp
+    print_utils.print_info(f"Matched SFP: {matched_sfp}", 2)
+    row = node_con.find_table_row("wrpcSfpTable", "wrpcSfpPn", matched_sfp)
+    if row is None:
+        raise NodeValueError(SnmpCommandCode.WALK,
+                             ScriptRunStatusesEnum.COEF_COHERENCY_LOSS,
+                             "wrpcSfpTable",
+                             f"Matched SFP {matched_sfp} of {ip} is not found in wrpcSfpTable")
+    table_index, row = row
+    print_utils.print_info(f"Table index: {SNMP_Connect.index_to_str(table_index)}", 2)
+    return (row["wrpcSfpDeltaTx"], row["wrpcSfpDeltaRx"], row["wrpcSfpAlpha"])
 
 # handles try-catches for logging into file if enabled
 def __x_launch(
@@ -220,24 +356,30 @@ def __x_launch(
         ALPHA_COEF: int,
         SFP_PN: str,
         RESYNC: bool,
-        RESYNC_TIMEOUT: int
+        RESYNC_TIMEOUT: int,
+        SYNC_WAITS: list = None,
+        SNMP_PORT: int = 161
 ) -> int:
-    global remote_config_stop_event
+    __started_at[IP_ADDRESS] = timer.monotonic()
+    __applied_coefs.pop(IP_ADDRESS, None)
     if not ip_utils.is_ip_valid(IP_ADDRESS):
             err_msg = f"Invalid IP ({IP_ADDRESS}) format. Expected format: 2.25.255.03"
             __print_error(IP_ADDRESS, ScriptRunStatusesEnum.IP_INVALID,
                             err_msg)
             return
     try:
-        launch(
-            IP_ADDRESS = IP_ADDRESS,
-            TX_DELAY = TX_DELAY,
-            RX_DELAY = RX_DELAY,
-            ALPHA_COEF = ALPHA_COEF,
-            SFP_PN = SFP_PN,
-            RESYNC=RESYNC,
-            RESYNC_TIMEOUT=RESYNC_TIMEOUT
-        )
+        with trace_utils.span("configure", node=IP_ADDRESS):
+            launch(
+                IP_ADDRESS = IP_ADDRESS,
+                TX_DELAY = TX_DELAY,
+                RX_DELAY = RX_DELAY,
+                ALPHA_COEF = ALPHA_COEF,
+                SFP_PN = SFP_PN,
+                RESYNC=RESYNC,
+                RESYNC_TIMEOUT=RESYNC_TIMEOUT,
+                SYNC_WAITS=SYNC_WAITS,
+                SNMP_PORT=SNMP_PORT
+            )
 
         if __is_stop_event_set():
             print_utils.print_thread_terminated(script_name, "__x_launch")
@@ -264,10 +406,22 @@ def __x_launch(
 
 def __print_error(ip: str, err_code: ScriptRunStatusesEnum, msg: str):
     print_utils.print_error(f"{ip}: {ScriptRunStatusesEnum(err_code).name}({err_code:X}). {msg}")
-    if print_utils.logger.is_logging_on():
-        print_utils.logger.log(ip, err_code)
+    __log_result(ip, err_code, msg)
     return
 
+def __log_result(ip: str, status: ScriptRunStatusesEnum, msg: str = None):
+    """Logs the node with the coefficients read back from it and the time since its visit started"""
+    if not print_utils.logger.is_logging_on():
+        return
+    tx, rx, alpha = __applied_coefs.get(ip, (None, None, None))
+    started_at = __started_at.get(ip)
+    print_utils.logger.log(ip, status,
+                           script=script_name,
+                           duration=timer.monotonic() - started_at if started_at is not None else None,
+                           tx=tx, rx=rx, alpha=alpha,
+                           sfp=__matched_sfps.get(ip),
+                           message=msg)
+
 def __prepare_coef(val: int) -> int:
     global __NODE_MODEL__
     if __NODE_MODEL__=="CUTE_A7":
@@ -275,4 +429,4 @@ def __prepare_coef(val: int) -> int:
     return val
 
 def __is_stop_event_set():
-    return remote_config_stop_event is not None and remote_config_stop_event.is_set()
\ No newline at end of file
+    return remote_config_stop_event.is_set()
\ No newline at end of file
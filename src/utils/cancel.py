@@ -0,0 +1,101 @@
+import contextlib
+import contextvars
+import itertools
+import threading
+import time as timer
+from typing import Callable, Tuple
+
+class CancelToken(threading.Event):
+    """Stop event that also aborts what is blocked on its behalf.
+    Code stuck in a socket, a subprocess or an instrument read registers a callback that tears it down,
+    so set() frees the hardware at once instead of on the next poll"""
+
+    def __init__(self):
+        super().__init__()
+        self.__callbacks = {}
+        self.__ids = itertools.count()
+        self.__callbacks_lock = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self.__callbacks_lock:
+            callbacks = list(self.__callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception: # aborting is best effort: the owner sees the failure of its own call
+                pass
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Calls `callback` on every set() until the returned function is called. Called at once if already set"""
+        with self.__callbacks_lock:
+            callback_id = next(self.__ids)
+            self.__callbacks[callback_id] = callback
+        if self.is_set():
+            callback()
+        return lambda: self.__remove(callback_id)
+
+    def __remove(self, callback_id: int):
+        with self.__callbacks_lock:
+            self.__callbacks.pop(callback_id, None)
+
+class ScriptStopEvent:
+    """Stop event of a script module. `assign()` sets the default one; a run `bind()`s its own for its
+    duration, so concurrent runs of one script are stopped one by one. The binding holds in the calling
+    context, which JobScheduler hands over to the jobs submitted from it"""
+
+    def __init__(self, name: str):
+        self.__default = None
+        self.__current = contextvars.ContextVar(name, default=None)
+
+    def assign(self, event):
+        self.__default = event
+
+    def get(self):
+        """Event of the current run, the assigned one outside of a run"""
+        event = self.__current.get()
+        return event if event is not None else self.__default
+
+    @contextlib.contextmanager
+    def bind(self, event):
+        token = self.__current.set(event)
+        try:
+            yield event
+        finally:
+            self.__current.reset(token)
+
+    def is_set(self) -> bool:
+        return is_cancelled(self.get())
+
+def linked_token(stop_event) -> Tuple[CancelToken, Callable[[], None]]:
+    """New token that is set together with `stop_event`, while setting it leaves `stop_event` alone.
+    Returns the token and the function that unlinks it. Plain events can't notify: the token is left unlinked"""
+    token = CancelToken()
+    if isinstance(stop_event, CancelToken):
+        return token, stop_event.on_cancel(token.set)
+    if stop_event is not None and stop_event.is_set():
+        token.set()
+    return token, lambda: None
+
+def is_cancelled(stop_event) -> bool:
+    return stop_event is not None and stop_event.is_set()
+
+def wait(stop_event, timeout: float) -> bool:
+    """Sleeps `timeout` sec unless the stop event is set first. True if it is set.
+    Works with no event, a threading.Event or a CancelToken"""
+    if stop_event is None:
+        timer.sleep(timeout)
+        return False
+    return stop_event.wait(timeout)
+
+@contextlib.contextmanager
+def on_cancel(stop_event, abort: Callable[[], None]):
+    """Runs `abort` if the stop event is set while inside the block. Plain events can't notify: nothing is registered"""
+    if not isinstance(stop_event, CancelToken):
+        yield
+        return
+    remove = stop_event.on_cancel(abort)
+    try:
+        yield
+    finally:
+        remove()
@@ -0,0 +1,247 @@
+from ..utils import print as print_utils
+from ..utils.cancel import CancelToken
+
+import contextvars
+import heapq
+import itertools
+import threading
+import time as timer
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List
+
+# Job.status values
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+def scope_resource(ip: str) -> str:
+    return f"scope:{ip}"
+
+def tty_resource(tty_usb_port: int, host: str = None) -> str:
+    return f"tty:{host or 'localhost'}:{tty_usb_port}"
+
+def snmp_resource(ip: str) -> str:
+    return f"snmp:{ip}"
+
+class Job:
+    """Unit of work of JobScheduler. `future` resolves to what `func` returned"""
+
+    def __init__(self, job_id: int, name: str, func: Callable, args: tuple, kwargs: dict,
+                 priority: int, resources: Iterable[str], stop_event):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.resources = frozenset(resources)
+        self.stop_event = stop_event if stop_event is not None else CancelToken()
+        self.context = contextvars.copy_context() # of the submitter: the job sees e.g. the stop event its script bound
+        self.status = PENDING
+        self.future = Future()
+        self.submitted_at = timer.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds spent in the queue"""
+        return (self.started_at or timer.monotonic()) - self.submitted_at
+
+    @property
+    def run_time(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or timer.monotonic()) - self.started_at
+
+    def cancel(self) -> bool:
+        """Drops a pending job or sets the stop event of a running one. False if it has already finished"""
+        if self.status in (DONE, FAILED, CANCELLED):
+            return False
+        self.stop_event.set()
+        return True
+
+    def result(self, timeout: float = None) -> Any:
+        return self.future.result(timeout)
+
+class JobScheduler:
+    """Runs jobs on at most `max_workers` threads, higher `priority` first.
+    Jobs sharing a resource name (an oscilloscope, a ttyUSB, an SNMP target) never run at the same time:
+    a job waits until all its resources are free while jobs behind it that can run go ahead"""
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, max_workers: int = 4, name: str = "jobs"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive")
+        self.max_workers = max_workers
+        self.name = name
+        self.__queue: List[tuple] = [] # heap of (-priority, job id, job)
+        self.__jobs: Dict[int, Job] = {}
+        self.__busy_resources = set()
+        self.__workers: List[threading.Thread] = []
+        self.__idle_workers = 0
+        self.__ids = itertools.count(1)
+        self.__cond = threading.Condition()
+        self.__is_shut_down = False
+
+    def shared() -> "JobScheduler":
+        """Process-wide scheduler the GUI tabs submit their scripts to"""
+        with JobScheduler.__shared_lock:
+            if JobScheduler.__shared is None:
+                JobScheduler.__shared = JobScheduler(name="shared_jobs")
+            return JobScheduler.__shared
+
+    def submit(self, func: Callable, args: tuple = (), kwargs: dict = None, name: str = None,
+               priority: int = 0, resources: Iterable[str] = (), stop_event = None) -> Job:
+        """`stop_event` is set by Job.cancel(); pass the one `func` watches to make running jobs cancellable.
+        It must belong to this job alone: cancel_utils.linked_token() derives one from a shared event"""
+        with self.__cond:
+            if self.__is_shut_down:
+                raise RuntimeError(f"{self.name} scheduler is shut down")
+            job_id = next(self.__ids)
+            job = Job(job_id, name or getattr(func, "__name__", "job"), func, args, kwargs or {},
+                      priority, resources, stop_event)
+            self.__jobs[job_id] = job
+            heapq.heappush(self.__queue, (-priority, job_id, job))
+            if len(self.__queue) > self.__idle_workers and len(self.__workers) < self.max_workers:
+                worker = threading.Thread(target=self.__run_worker, name=f"{self.name}_{len(self.__workers)}", daemon=True)
+                self.__workers.append(worker)
+                worker.start()
+            self.__cond.notify_all()
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        job = self.__jobs.get(job_id)
+        if job is None:
+            return False
+        with self.__cond:
+            is_cancelled = job.cancel()
+            self.__cond.notify_all() # pending jobs are dropped by the workers
+        return is_cancelled
+
+    def cancel_all(self):
+        with self.__cond:
+            for job in self.__jobs.values():
+                job.cancel()
+            self.__cond.notify_all()
+
+    def jobs(self) -> List[Job]:
+        with self.__cond:
+            return list(self.__jobs.values())
+
+    def metrics(self) -> Dict[str, float]:
+        """Job counts per status plus mean/max queue and run times of the finished jobs in seconds"""
+        with self.__cond:
+            jobs = list(self.__jobs.values())
+        metrics = {status: 0 for status in (PENDING, RUNNING, DONE, FAILED, CANCELLED)}
+        for job in jobs:
+            metrics[job.status] += 1
+        finished = [job for job in jobs if job.status in (DONE, FAILED)]
+        metrics["submitted"] = len(jobs)
+        metrics["mean_wait"] = sum(job.wait_time for job in finished) / len(finished) if finished else 0.0
+        metrics["max_wait"] = max((job.wait_time for job in finished), default=0.0)
+        metrics["mean_run"] = sum(job.run_time for job in finished) / len(finished) if finished else 0.0
+        metrics["max_run"] = max((job.run_time for job in finished), default=0.0)
+        return metrics
+
+    def forget_finished(self):
+        """Drops finished jobs from jobs() and metrics()"""
+        with self.__cond:
+            self.__jobs = {k: v for k, v in self.__jobs.items() if v.status in (PENDING, RUNNING)}
+
+    def wait_all(self, timeout: float = None) -> bool:
+        """Blocks until no job is pending or running. False on timeout"""
+        deadline = None if timeout is None else timer.monotonic() + timeout
+        with self.__cond:
+            while any(job.status in (PENDING, RUNNING) for job in self.__jobs.values()):
+                left = None if deadline is None else deadline - timer.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self.__cond.wait(left)
+            return True
+
+    def shutdown(self, cancel_pending: bool = False, wait: bool = True):
+        with self.__cond:
+            self.__is_shut_down = True
+            if cancel_pending:
+                for job in self.__jobs.values():
+                    if job.status == PENDING:
+                        job.cancel()
+            self.__cond.notify_all()
+            workers = list(self.__workers)
+        if wait:
+            for worker in workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+    def __take_job(self, dropped: List[Job]) -> Job | None:
+        """Pops the highest priority job whose resources are free and moves cancelled ones to `dropped`.
+        Must hold the condition"""
+        runnable = None
+        for entry in sorted(self.__queue):
+            job = entry[2]
+            if job.stop_event.is_set():
+                self.__queue.remove(entry)
+                self.__finish(job, CANCELLED)
+                dropped.append(job)
+                continue
+            if runnable is None and not job.resources & self.__busy_resources:
+                runnable = entry
+        if runnable is None:
+            return None
+        self.__queue.remove(runnable)
+        heapq.heapify(self.__queue)
+        job = runnable[2]
+        self.__busy_resources |= job.resources
+        job.status = RUNNING
+        job.started_at = timer.monotonic()
+        return job
+
+    def __finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = timer.monotonic()
+        print_utils.print_info(f"Job #{job.id} {job.name}: {status} in {job.run_time:.1f} sec, "
+                               f"waited {job.wait_time:.1f} sec", 2)
+
+    def __run_worker(self):
+        while True:
+            dropped = []
+            with self.__cond:
+                self.__idle_workers += 1
+                while (job := self.__take_job(dropped)) is None and not dropped:
+                    if self.__is_shut_down and not self.__queue:
+                        self.__idle_workers -= 1
+                        self.__cond.notify_all()
+                        return
+                    self.__cond.wait(0.5) # Job.cancel() called directly does not notify
+                self.__idle_workers -= 1
+                if dropped:
+                    self.__cond.notify_all() # wait_all() may be done now
+            for dropped_job in dropped:
+                dropped_job.future.cancel()
+            if job is None:
+                continue
+            result, error = None, None
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    result = job.context.run(job.func, *job.args, **job.kwargs)
+                except BaseException as ex: # reported through the future, the worker keeps serving
+                    error = ex
+            with self.__cond:
+                self.__busy_resources -= job.resources
+                if job.future.cancelled():
+                    self.__finish(job, CANCELLED)
+                elif error is not None:
+                    self.__finish(job, FAILED)
+                else: # a job stopped through its stop event still hands over what it returned
+                    self.__finish(job, CANCELLED if job.stop_event.is_set() else DONE)
+                self.__cond.notify_all()
+            # done callbacks may call back into the scheduler: resolve the future outside of the lock
+            if error is not None:
+                job.future.set_exception(error)
+            elif not job.future.cancelled():
+                job.future.set_result(result)
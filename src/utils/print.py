@@ -1,9 +1,15 @@
 from ..connection.exceptions.execution_statuses import ScriptRunStatusesEnum
-from .file_logger import FileLogger
+from .result_log import ResultLog
+import contextlib
+import io
+import threading
 __loop_num__ = 0
 __verbosity_lvl__ = 3
 
-logger = FileLogger()
+__thread_output__ = threading.local()
+__print_lock__ = threading.Lock()
+
+logger = ResultLog() # results of the scripts, shared by all their threads
 
 def get_loop_num() -> int:
     global __loop_num__
@@ -33,32 +39,55 @@ def is_verbosity_printable(verbosity: int) -> bool:
 def print_loop(text: str, verbosity: int):
     global __loop_num__
     if is_verbosity_printable(verbosity):
-        print(f"[LOOP #{__loop_num__}] {text}")
+        __print__(f"[LOOP #{__loop_num__}] {text}")
     return
 
 def print_info(text: str, verbosity: int = 1):
     if is_verbosity_printable(verbosity):
-        print(f"[INFO] {text}")
+        __print__(f"[INFO] {text}")
     return
 
 def print_error(text: str):
-    print(f"[ERROR] {text}")
+    __print__(f"[ERROR] {text}")
     return
 
 def print_executable(text: str, verbosity: int = 2):
     if is_verbosity_printable(verbosity):
-        print(f"[EXE] {text}")
+        __print__(f"[EXE] {text}")
     return
 
 def print_untagged(text: str, verbosity: int = 1, end="\n"):
     if is_verbosity_printable(verbosity):
-        print(text, end=end)
+        __print__(text, end=end)
     return
 
 def print_thread_terminated(script:str, func:str):
-    print(f"[THREAD] Script {script} is terminated while executing {func}()")
+    __print__(f"[THREAD] Script {script} is terminated while executing {func}()")
     return
 
+@contextlib.contextmanager
+def buffered_output():
+    """Collects everything the calling thread prints and outputs it as one block on exit"""
+    buffer = io.StringIO()
+    __thread_output__.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        __thread_output__.buffer = None
+        with __print_lock__:
+            print(buffer.getvalue(), end="", flush=True)
+
+def is_output_buffered() -> bool:
+    return getattr(__thread_output__, "buffer", None) is not None
+
+def __print__(text: str, end: str = "\n"):
+    buffer = getattr(__thread_output__, "buffer", None)
+    if buffer is not None:
+        buffer.write(f"{text}{end}")
+        return
+    with __print_lock__:
+        print(text, end=end)
+
 def __check_verbosity_valid__(verbosity: int) -> int:
     if verbosity not in range(3):
         raise ValueError(f"verbosity level {verbosity} is out of range")
@@ -77,6 +106,9 @@ def timer_bar(iterable, prefix = '', suffix = '', length = 100, fill = '█', pr
         printEnd    - Optional  : end character (e.g. "\r", "\r\n") (Str)
     """
     total = len(iterable)
+    if is_output_buffered(): # a bar redrawn into a per-thread buffer is just noise
+        yield from iterable
+        return
     # Progress Bar Printing Function
     def print_timer_bar (iteration):
         time = iteration
@@ -0,0 +1,231 @@
+from ..connection.exceptions.execution_statuses import ScriptRunStatusesEnum
+
+import atexit
+import csv
+import io
+import json
+import os
+import queue
+import threading
+import time as timer
+from typing import Any, Dict, List
+
+# record fields, in the column order of CSV logs
+FIELDS = ("time", "script", "target", "status", "code", "duration", "tx", "rx", "alpha", "sfp", "message")
+
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+
+# when written records are forced to the disk
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch" # after every batch written
+FSYNC_CLOSE = "close" # once, when the log is closed
+
+class _Marker:
+    """Request to the writer thread, handled in order with the records queued before it"""
+
+    def __init__(self, action: str):
+        self.action = action
+        self.done = threading.Event()
+
+class ResultLog:
+    """Structured log of per-node results shared by every thread of the process.
+    log() only queues the record; one writer thread takes whatever is queued, up to `batch_size` records,
+    writes it at once and fsyncs it according to `fsync`, so the busier the log the bigger the batches. The file is
+    rotated to `path.1` .. `path.<backups>` once it grows over `max_bytes` (0 - never).
+    Records are JSON lines, or CSV rows if the path ends with .csv.
+
+    Scripts open() and close_log() the log around their run. Opens of one path are counted,
+    so the file is closed only when the last of the concurrent scripts writing to it is done.
+    One file is written at a time: opening another path meanwhile is refused"""
+
+    def __init__(self, batch_size: int = 512, fsync: str = FSYNC_BATCH, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0 # records written since the process started
+        self.dropped = 0 # records lost to write errors
+        self.error: OSError = None # last write error
+        self.__path = "run.log"
+        self.__users = 0
+        self.__queue = queue.SimpleQueue()
+        self.__thread = None
+        self.__file = None
+        self.__format = FORMAT_JSONL
+        self.__lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def is_logging_on(self) -> bool:
+        return self.__users > 0
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def open(self, path: str = None, mode: str = "a"):
+        """Starts logging to `path` ("run.log" by default). Mode "w" truncates the file,
+        unless another script already writes to it: use truncate() to clear a shared log.
+        Raises ValueError if another script writes to a different path, whose records must not be redirected"""
+        with self.__lock:
+            path = path if path is not None else self.__path
+            if self.__users == 0:
+                self.__path = path
+                self.__open_file(mode)
+                self.__thread = threading.Thread(target=self.__run, name="result_log", daemon=True)
+                self.__thread.start()
+            elif os.path.abspath(path) != os.path.abspath(self.__path):
+                raise ValueError(f"Can't log to {path}: results of a running script are logged to {self.__path}")
+            self.__users += 1
+
+    def log(self, target: str, status: ScriptRunStatusesEnum, script: str = None, duration: float = None,
+            tx: int = None, rx: int = None, alpha: int = None, sfp: str = None, message: str = None):
+        """Queues the result of a node (or any other target). `duration` is in seconds"""
+        if self.__users == 0:
+            return
+        now = timer.time()
+        self.__queue.put({
+            "time": timer.strftime("%Y-%m-%dT%H:%M:%S", timer.localtime(now)) + f".{int(now % 1 * 1000):03}",
+            "script": script,
+            "target": target,
+            "status": ScriptRunStatusesEnum(status).name,
+            "code": int(status),
+            "duration": round(duration, 3) if duration is not None else None,
+            "tx": tx,
+            "rx": rx,
+            "alpha": alpha,
+            "sfp": sfp,
+            "message": message,
+        })
+
+    def flush(self):
+        """Blocks until every record queued so far is written"""
+        with self.__lock:
+            if self.__users > 0:
+                self.__request("flush")
+
+    def truncate(self, path: str = None):
+        """Clears the log file. Records queued before are dropped with it, the ones queued after are kept"""
+        with self.__lock:
+            path = path if path is not None else self.__path
+            if self.__users > 0 and path == self.__path:
+                self.__request("truncate")
+            else:
+                open(path, "w").close()
+
+    def close_log(self):
+        """Ends the logging of one script. The last one flushes and closes the file"""
+        with self.__lock:
+            if self.__users == 0:
+                return
+            self.__users -= 1
+            if self.__users == 0:
+                self.__request("close")
+                self.__thread.join()
+                self.__thread = None
+
+    def close_all(self):
+        """Writes what is queued and closes the file whoever still has it open, e.g. at exit"""
+        with self.__lock:
+            if self.__users > 0:
+                self.__users = 0
+                self.__request("close")
+                self.__thread.join()
+                self.__thread = None
+
+    def __request(self, action: str):
+        """Hands the marker to the writer thread and waits for it. Must hold the lock"""
+        marker = _Marker(action)
+        self.__queue.put(marker)
+        marker.done.wait()
+
+    def __open_file(self, mode: str):
+        self.__format = FORMAT_CSV if self.__path.lower().endswith(".csv") else FORMAT_JSONL
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__file = open(self.__path, mode, newline="")
+        if self.__format == FORMAT_CSV and self.__file.tell() == 0:
+            self.__file.write(",".join(FIELDS) + "\r\n")
+
+    def __close_file(self):
+        if self.__file is None:
+            return
+        self.__file.flush()
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self.__file.fileno())
+        self.__file.close()
+        self.__file = None
+
+    def __run(self):
+        while True:
+            batch: List[Dict[str, Any]] = []
+            marker = None
+            item = self.__queue.get()
+            try:
+                while True:
+                    if isinstance(item, _Marker):
+                        marker = item
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self.__queue.get_nowait()
+            except queue.Empty: # all queued records are taken
+                pass
+            try:
+                if batch:
+                    self.__write(batch)
+            except OSError as ex: # e.g. disk full: the batch is lost, logging goes on
+                self.error = ex
+                self.dropped += len(batch)
+            if marker is None:
+                continue
+            try:
+                is_closed = self.__handle(marker)
+            except OSError as ex:
+                self.error = ex
+                is_closed = marker.action == "close"
+            finally:
+                marker.done.set() # never leave the requesting thread waiting
+            if is_closed:
+                return
+
+    def __handle(self, marker: _Marker) -> bool:
+        """Carries the marker out. True once the file is closed for good"""
+        if marker.action == "close":
+            self.__close_file()
+            return True
+        if marker.action == "truncate":
+            self.__close_file()
+            self.__open_file("w")
+        return False
+
+    def __write(self, batch: List[Dict[str, Any]]):
+        if self.__file is None: # reopening after a write error failed
+            self.__open_file("a")
+        if self.__format == FORMAT_CSV:
+            text = io.StringIO()
+            writer = csv.writer(text)
+            for record in batch:
+                writer.writerow(["" if record[x] is None else record[x] for x in FIELDS])
+            text = text.getvalue()
+        else:
+            text = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in batch)
+        self.__file.write(text)
+        self.__file.flush()
+        if self.fsync == FSYNC_BATCH:
+            os.fsync(self.__file.fileno())
+        self.written += len(batch)
+        if self.max_bytes and self.__file.tell() >= self.max_bytes:
+            self.__rotate()
+
+    def __rotate(self):
+        """Shifts path.1 .. path.<backups - 1> up by one, moves the log to path.1 and starts a new one"""
+        self.__close_file()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.__path}.{i}"):
+                    os.replace(f"{self.__path}.{i}", f"{self.__path}.{i + 1}")
+            os.replace(self.__path, f"{self.__path}.1")
+        self.__open_file("w")
@@ -0,0 +1,53 @@
+from array import array
+from typing import Any, Dict, Iterator, List, Tuple
+
+class RingBuffer:
+    """Fixed-capacity history of records kept column-wise in preallocated typed arrays.
+    Once full, every new record overwrites the oldest one"""
+
+    def __init__(self, capacity: int, fields: Dict[str, str]):
+        """`fields` maps a column name to its array typecode, e.g. {"time": "d", "offset": "q"}"""
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be positive")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.__columns = {name: array(typecode, bytes(array(typecode).itemsize * capacity))
+                          for name, typecode in fields.items()}
+        self.__next = 0
+        self.__size = 0
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def append(self, *values):
+        """Appends one record, values given in the order of `fields`"""
+        for name, value in zip(self.fields, values):
+            self.__columns[name][self.__next] = value
+        self.__next = (self.__next + 1) % self.capacity
+        self.__size = min(self.__size + 1, self.capacity)
+
+    def latest(self, back: int = 0) -> Dict[str, Any] | None:
+        """Returns the newest record (or the one `back` records before it) as {field: value}"""
+        if back >= self.__size:
+            return None
+        pos = (self.__next - 1 - back) % self.capacity
+        return {name: column[pos] for name, column in self.__columns.items()}
+
+    def column(self, name: str) -> List[Any]:
+        """Returns the values of one field, oldest first"""
+        column = self.__columns[name]
+        start = (self.__next - self.__size) % self.capacity
+        if start + self.__size <= self.capacity:
+            return column[start:start + self.__size].tolist()
+        return column[start:].tolist() + column[:self.__next].tolist()
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        """Yields records as tuples in the order of `fields`, oldest first"""
+        return zip(*(self.column(name) for name in self.fields))
+
+    def clear(self):
+        self.__next = 0
+        self.__size = 0
+
+    def nbytes(self) -> int:
+        return sum(x.itemsize * len(x) for x in self.__columns.values())
@@ -0,0 +1,288 @@
+import math
+import numpy as np
+
+class RunningStats:
+    """Count, mean, variance, min and max of a stream in constant memory (Welford / Chan et al.)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = math.nan
+        self.min = math.nan
+        self.max = math.nan
+        self.__m2 = 0.0
+
+    def push(self, value: float):
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.min = self.max = float(value)
+            return
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.__m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def push_many(self, values):
+        """Merges a whole batch at once. Non-finite values are skipped"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        if self.count == 0:
+            self.count, self.mean, self.__m2 = values.size, batch_mean, batch_m2
+            self.min, self.max = float(values.min()), float(values.max())
+            return
+        total = self.count + values.size
+        delta = batch_mean - self.mean
+        self.mean += delta * values.size / total
+        self.__m2 += batch_m2 + delta ** 2 * self.count * values.size / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def variance(self) -> float:
+        """Sample (n - 1) variance"""
+        return self.__m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance) if self.count > 1 else math.nan
+
+    def reset(self):
+        self.__init__()
+
+
+class Histogram:
+    """Fixed-width bins over a fixed range of `max_bins` bins centred on the median of the first batch.
+    Values outside of the range are only counted as underflow or overflow, so memory stays constant
+    whatever arrives, e.g. a node losing lock or the 9.91e37 an oscilloscope returns for an invalid result"""
+
+    def __init__(self, bin_width: float = 1.0, max_bins: int = 65536):
+        self.bin_width = bin_width
+        self.max_bins = max_bins
+        self.count = 0
+        self.underflow = 0
+        self.overflow = 0
+        self.__first_bin = 0.0
+        self.__counts = np.zeros(0, dtype=np.int64)
+
+    def push_many(self, values):
+        """Non-finite values are skipped"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        if self.__counts.size == 0:
+            self.__first_bin = float(np.floor(np.median(values) / self.bin_width)) - self.max_bins // 2
+            self.__counts = np.zeros(self.max_bins, dtype=np.int64)
+        bins = np.floor(values / self.bin_width) - self.__first_bin # float: far values must not overflow the int cast
+        is_under = bins < 0
+        is_over = bins >= self.max_bins
+        self.underflow += int(is_under.sum())
+        self.overflow += int(is_over.sum())
+        self.__counts += np.bincount(bins[~(is_under | is_over)].astype(np.int64), minlength=self.max_bins)
+        self.count += values.size
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Counts of the bins inside the range"""
+        return self.__counts
+
+    @property
+    def edges(self) -> np.ndarray:
+        """Bin edges, one more than counts"""
+        return (self.__first_bin + np.arange(self.__counts.size + 1)) * self.bin_width
+
+    def percentile(self, q: float) -> float:
+        """Estimate interpolated linearly inside the bin, so it is exact to a bin width.
+        Ranks falling into the underflow or overflow are clipped to the edge of the range"""
+        if self.count == 0:
+            return math.nan
+        rank = q / 100 * self.count - self.underflow
+        if rank < 0 or (rank == 0 and self.underflow > 0):
+            return float(self.__first_bin * self.bin_width)
+        if rank > self.count - self.underflow - self.overflow:
+            return float((self.__first_bin + self.__counts.size) * self.bin_width)
+        cumulative = np.cumsum(self.__counts)
+        if rank > 0:
+            index = min(int(np.searchsorted(cumulative, rank)), self.__counts.size - 1)
+        else: # the lowest value: start of the first bin in use
+            index = int(np.argmax(self.__counts > 0))
+        below = cumulative[index] - self.__counts[index]
+        fraction = (rank - below) / self.__counts[index] if self.__counts[index] else 0.0
+        return float((self.__first_bin + index + fraction) * self.bin_width)
+
+    def reset(self):
+        self.__init__(self.bin_width, self.max_bins)
+
+class SampleStore:
+    """Preallocated array of raw samples. Doubles its capacity when full instead of growing per sample"""
+
+    def __init__(self, capacity: int = 65536, dtype = np.float32):
+        self.__data = np.empty(max(capacity, 1), dtype=dtype)
+        self.__size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.__data.dtype).ravel()
+        end = self.__size + values.size
+        if end > self.__data.size:
+            data = np.empty(max(end, self.__data.size * 2), dtype=self.__data.dtype)
+            data[:self.__size] = self.__data[:self.__size]
+            self.__data = data
+        self.__data[self.__size:end] = values
+        self.__size = end
+
+    @property
+    def values(self) -> np.ndarray:
+        """View of the stored samples, valid until the next extend()"""
+        return self.__data[:self.__size]
+
+    @property
+    def nbytes(self) -> int:
+        return self.__data.nbytes
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def clear(self):
+        self.__size = 0
+
+class StreamingStats:
+    """RunningStats plus a histogram for percentiles and, if `capacity` is given, a float32 copy of the raw samples"""
+
+    def __init__(self, bin_width: float = 1.0, capacity: int = 0):
+        self.running = RunningStats()
+        self.histogram = Histogram(bin_width)
+        self.store = SampleStore(capacity) if capacity > 0 else None
+
+    def push_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        self.running.push_many(values)
+        self.histogram.push_many(values)
+        if self.store is not None:
+            self.store.extend(values)
+
+    @property
+    def count(self) -> int:
+        return self.running.count
+
+    @property
+    def mean(self) -> float:
+        return self.running.mean
+
+    @property
+    def variance(self) -> float:
+        return self.running.variance
+
+    @property
+    def std(self) -> float:
+        return self.running.std
+
+    @property
+    def min(self) -> float:
+        return self.running.min
+
+    @property
+    def max(self) -> float:
+        return self.running.max
+
+    def percentile(self, q: float) -> float:
+        """Exact when the raw samples are kept, a histogram estimate otherwise"""
+        if self.store is not None and len(self.store) > 0:
+            return float(np.percentile(self.store.values, q))
+        return self.histogram.percentile(q)
+
+    def reset(self):
+        self.running.reset()
+        self.histogram.reset()
+        if self.store is not None:
+            self.store.clear()
+
+
+def standard_error(std: float, count: int) -> float:
+    return std / math.sqrt(count) if count > 1 and not math.isnan(std) else math.inf
+
+def outlier_mask(values, threshold: float = 5.0) -> np.ndarray:
+    """True for the values within `threshold` robust sigmas (1.4826 * MAD) of the median.
+    A non-positive threshold keeps everything but NaNs and infinities"""
+    values = np.asarray(values, dtype=np.float64)
+    is_kept = np.isfinite(values)
+    if threshold <= 0 or is_kept.sum() < 3:
+        return is_kept
+    median = np.median(values[is_kept])
+    sigma = 1.4826 * np.median(np.abs(values[is_kept] - median))
+    if sigma == 0: # mostly identical values: nothing to judge the spread by
+        return is_kept
+    return is_kept & (np.abs(values - median) <= threshold * sigma)
+
+def allan_deviation(values, tau: int = 1) -> float:
+    """Overlapping Allan deviation of a sample series averaged over `tau` samples"""
+    values = np.asarray(values, dtype=np.float64)
+    if tau < 1 or values.size < 2 * tau + 1:
+        return math.nan
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    averages = (sums[tau:] - sums[:-tau]) / tau
+    diffs = averages[tau:] - averages[:-tau]
+    return math.sqrt(0.5 * float(np.mean(diffs ** 2)))
+
+class ConvergenceTracker:
+    """Pools batches of samples with robust outlier rejection and tells when their mean is known
+    to within `target` at confidence `z`. The standard error is the most pessimistic of the pooled one
+    and the ones from the spread and the Allan deviation of batch means, so slow drifts are not hidden"""
+
+    def __init__(self, target: float = None, z: float = 1.96, outlier_threshold: float = 5.0, min_batches: int = 2,
+                 bin_width: float = 1.0, capacity: int = 0):
+        self.target = target
+        self.z = z
+        self.outlier_threshold = outlier_threshold
+        self.min_batches = min_batches
+        self.samples = StreamingStats(bin_width, capacity)
+        self.batch_means: list = []
+        self.rejected = 0
+
+    def push_batch(self, values) -> int:
+        """Adds a batch (e.g. one acquisition). Returns the number of samples accepted"""
+        values = np.asarray(values, dtype=np.float64)
+        accepted = values[outlier_mask(values, self.outlier_threshold)]
+        self.rejected += values.size - accepted.size
+        if accepted.size == 0:
+            return 0
+        self.samples.push_many(accepted)
+        self.batch_means.append(float(accepted.mean()))
+        return accepted.size
+
+    @property
+    def count(self) -> int:
+        return self.samples.count
+
+    @property
+    def mean(self) -> float:
+        return self.samples.mean
+
+    @property
+    def batch_adev(self) -> float:
+        """Allan deviation of the batch means, tau = one batch"""
+        return allan_deviation(self.batch_means)
+
+    @property
+    def standard_error(self) -> float:
+        errors = [standard_error(self.samples.std, self.samples.count)]
+        batches = len(self.batch_means)
+        if batches > 1:
+            errors.append(standard_error(float(np.std(self.batch_means, ddof=1)), batches))
+        if not math.isnan(adev := self.batch_adev):
+            errors.append(standard_error(adev, batches))
+        return max(errors)
+
+    def ci_half_width(self) -> float:
+        return self.z * self.standard_error
+
+    def is_converged(self) -> bool:
+        return (self.target is not None and len(self.batch_means) >= self.min_batches
+                and self.ci_half_width() <= self.target)
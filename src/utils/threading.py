@@ -1,38 +1,43 @@
-import sys
-import threading
-import time as timer
 import os, signal
 
 from ..utils import print as print_utils
+from ..utils import cancel as cancel_utils
+from ..utils.jobs import Job, JobScheduler
 
 OnScriptStart_Event = "<<OnScriptStart>>"
 OnScriptFinish_Event = "<<OnScriptFinish>>"
 OnScriptThreadGenerate_Event = "<<OnScriptThreadGenerate>>"
 OnScriptThreadTerminate_Event = "<<OnScriptThreadTerminate>>"
 
-def run_script_in_bg(func, args, gui = None, stop_event=None) -> int:
-        """Runs a command in a separate thread"""
-        def run(run_func, func_args, stop_event = None, run_gui = None):
+def run_script_in_bg(func, args, gui = None, stop_event=None, name: str = None, resources = (), priority: int = 0) -> Job:
+        """Queues a command on the shared job scheduler. It starts once a worker and all its `resources` are free.
+        `func` is a script main taking the args list and a `stop_event`: it gets a token of its own, set whenever
+        `stop_event` (the tab's one) is, so cancelling the job leaves its siblings running.
+        `stop_event` is never cleared here: the tab resets it when it starts new scripts"""
+        def run(run_func, func_args, run_stop_event, run_gui = None):
             if run_gui is not None:
                 run_gui.event_generate(OnScriptStart_Event)
                 run_gui.event_generate(OnScriptThreadGenerate_Event)
             try:
-                # timer.sleep(10)
-                run_func(func_args)
+                run_func(func_args, stop_event=run_stop_event)
             except Exception as ex:
-                # import traceback
-                # print_utils.print_error(f"[THREAD] {traceback.format_exc()}")
                 print_utils.print_error(f"[THREAD] {ex}")
-            if run_gui is not None:
-                run_gui.event_generate(OnScriptFinish_Event)
-                run_gui.event_generate(OnScriptThreadTerminate_Event)
-            stop_event.clear()
-            
-        thread = threading.Thread(target=run, args=(func, args, stop_event, gui))
-        thread.start()
-        timer.sleep(1)
-        print_utils.print_info(f"Script process id: {thread.ident}", 2)
-        return thread.ident
+
+        job_token, unlink = cancel_utils.linked_token(stop_event)
+
+        def on_done(future):
+            """Runs once the job status is final, so the handlers see it finished. Dropped jobs never ran"""
+            unlink()
+            if gui is not None:
+                gui.event_generate(OnScriptFinish_Event)
+                gui.event_generate(OnScriptThreadTerminate_Event)
+
+        job = JobScheduler.shared().submit(run, args=(func, args, job_token, gui),
+                                           name=name or getattr(func, "__module__", "script").split(".")[-1],
+                                           priority=priority, resources=resources, stop_event=job_token)
+        job.future.add_done_callback(on_done)
+        print_utils.print_info(f"Script job id: {job.id}", 2)
+        return job
 
 def terminate_thread(pid):
     print_utils.print_info(f"PID to terminate: {pid}", 2)
@@ -0,0 +1,218 @@
+from . import print as print_utils
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time as timer
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# span categories
+SCRIPT = "script"
+CONNECTION = "connection"
+OSCILLOSCOPE = "oscilloscope"
+SNMP = "snmp"
+
+RUN_LABEL = "run" # node label of the spans not tied to a node
+
+class Span:
+    """Finished span. `start` is in seconds since the tracer was reset, `duration` in seconds"""
+
+    __slots__ = ("name", "category", "node", "start", "duration", "thread", "thread_name", "args")
+
+    def __init__(self, name: str, category: str, node: str, start: float, duration: float,
+                 thread: int, thread_name: str, args: Dict[str, Any]):
+        self.name = name
+        self.category = category
+        self.node = node
+        self.start = start
+        self.duration = duration
+        self.thread = thread
+        self.thread_name = thread_name
+        self.args = args
+
+class _OpenSpan:
+    __slots__ = ("tracer", "name", "category", "node", "args", "started_at")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, node: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.node = node
+        self.args = args
+
+    def __enter__(self):
+        self.started_at = timer.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended_at = timer.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.name, self.category, self.node, self.started_at, ended_at - self.started_at, self.args)
+        return False
+
+class Tracer:
+    """Times the phases of a run. Every span is kept for the Chrome trace (up to `max_spans` of them)
+    and folded into per node and phase totals for the summary. A disabled tracer hands out a no-op
+    context, so instrumented code costs next to nothing until tracing is enabled"""
+
+    def __init__(self, max_spans: int = 200000):
+        self.enabled = False
+        self.max_spans = max_spans
+        self.dropped = 0 # spans left out of the trace once max_spans was reached
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.__lock:
+            self.__spans: List[Span] = []
+            self.__totals: Dict[Tuple[str, str], list] = {} # (node, name) -> [category, count, total, min, max]
+            self.__extents: Dict[str, list] = {} # node -> [first start, last end]
+            self.__origin = timer.perf_counter()
+            self.__started_at = timer.time()
+            self.dropped = 0
+
+    def span(self, name: str, category: str = SCRIPT, node: str = None, **args):
+        """Context timing its block. `args` are shown with the span in the trace viewer"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return _OpenSpan(self, name, category, node, args)
+
+    def record(self, name: str, category: str, node: str, started_at: float, duration: float, args: Dict[str, Any] = None):
+        """Adds a span timed elsewhere. `started_at` is a time.perf_counter() value"""
+        node = node if node is not None else RUN_LABEL
+        thread = threading.current_thread()
+        start = started_at - self.__origin
+        with self.__lock:
+            totals = self.__totals.get((node, name))
+            if totals is None:
+                self.__totals[(node, name)] = [category, 1, duration, duration, duration]
+            else:
+                totals[1] += 1
+                totals[2] += duration
+                totals[3] = min(totals[3], duration)
+                totals[4] = max(totals[4], duration)
+            extent = self.__extents.setdefault(node, [start, start + duration])
+            extent[0] = min(extent[0], start)
+            extent[1] = max(extent[1], start + duration)
+            if len(self.__spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.__spans.append(Span(name, category, node, start, duration, thread.ident, thread.name, args or {}))
+
+    def spans(self) -> List[Span]:
+        with self.__lock:
+            return list(self.__spans)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Count and total, mean, min and max duration in seconds of every phase of every node.
+        `share` is the part of the node's wall time (first span start to last span end) spent in the phase"""
+        with self.__lock:
+            totals = dict(self.__totals)
+            extents = {node: extent[1] - extent[0] for node, extent in self.__extents.items()}
+        rows = []
+        for (node, name), (category, count, total, shortest, longest) in totals.items():
+            rows.append({"node": node, "name": name, "category": category, "count": count, "total": total,
+                         "mean": total / count, "min": shortest, "max": longest,
+                         "share": total / extents[node] if extents[node] > 0 else 0.0})
+        rows.sort(key=lambda x: (x["node"], -x["total"]))
+        return rows
+
+    def export_chrome_trace(self, path: str):
+        """Writes the spans in the Trace Event Format that chrome://tracing and Perfetto open.
+        Every node is shown as a process with its threads under it; the summary goes to `otherData`"""
+        spans = self.spans()
+        nodes = {node: pid for pid, node in enumerate(sorted({x.node for x in spans}), start=1)}
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": node}}
+                  for node, pid in nodes.items()]
+        events += [{"name": "thread_name", "ph": "M", "pid": nodes[node], "tid": thread, "args": {"name": thread_name}}
+                   for node, thread, thread_name in {(x.node, x.thread, x.thread_name) for x in spans}]
+        events += [{"name": x.name, "cat": x.category, "ph": "X", "pid": nodes[x.node], "tid": x.thread,
+                    "ts": round(x.start * 10 ** 6, 3), "dur": round(x.duration * 10 ** 6, 3), "args": x.args}
+                   for x in spans]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as trace_file:
+            json.dump({
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "started": timer.strftime("%Y-%m-%dT%H:%M:%S", timer.localtime(self.__started_at)),
+                    "dropped": self.dropped,
+                    "summary": self.summary(),
+                },
+            }, trace_file, default=str)
+
+    def format_summary(self) -> str:
+        lines = [f"{'node':<24} {'phase':<28} {'count':>7} {'total, s':>10} {'mean, s':>10} {'max, s':>10} {'share':>7}"]
+        for row in self.summary():
+            lines.append(f"{row['node']:<24} {row['name']:<28} {row['count']:>7} {row['total']:>10.3f} "
+                         f"{row['mean']:>10.3f} {row['max']:>10.3f} {row['share'] * 100:>6.1f}%")
+        return "\n".join(lines)
+
+tracer = Tracer() # shared by the scripts and the connections they open
+
+def enable_tracing(enabled: bool = True):
+    """Starts a new trace on the shared tracer"""
+    tracer.reset()
+    tracer.enable(enabled)
+
+def is_tracing_on() -> bool:
+    return tracer.enabled
+
+def span(name: str, category: str = SCRIPT, node: str = None, **args):
+    return tracer.span(name, category, node, **args)
+
+def traced(name: str = None, category: str = SCRIPT, node: str = None):
+    """Decorator timing every call of a function as a span named after it"""
+    def decorate(func: Callable) -> Callable:
+        span_name = name if name is not None else func.__name__.strip("_")
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, category, node):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def traced_method(category: str, name: str = None):
+    """Decorator timing every call of a method. The span is labelled with the `trace_label` of the instance"""
+    def decorate(func: Callable) -> Callable:
+        span_name = name if name is not None else func.__name__
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not tracer.enabled:
+                return func(self, *args, **kwargs)
+            with tracer.span(span_name, category, getattr(self, "trace_label", None)):
+                return func(self, *args, **kwargs)
+        wrapper.__traced__ = True
+        return wrapper
+    return decorate
+
+def trace_methods(cls: type, names: Iterable[str], category: str):
+    """Wraps the methods among `names` that `cls` defines itself with traced_method.
+    Base classes call it from __init_subclass__, so every implementation of a phase is timed"""
+    for method_name in names:
+        func = cls.__dict__.get(method_name)
+        if callable(func) and not getattr(func, "__traced__", False):
+            setattr(cls, method_name, traced_method(category)(func))
+
+def print_summary(verbosity: int = 0):
+    print_utils.print_untagged(tracer.format_summary(), verbosity)
+
+def finish_tracing(path: str = None):
+    """Prints the summary, writes the Chrome trace to `path` if given and stops tracing"""
+    if not tracer.enabled:
+        return
+    tracer.enable(False)
+    print_summary()
+    if path is not None:
+        tracer.export_chrome_trace(path)
+        print_utils.print_info(f"Trace is written to {path}", 0)